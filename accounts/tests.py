@@ -3,9 +3,11 @@ from django.urls import reverse
 from django.contrib.auth import get_user_model
 from unittest.mock import patch
 import gitlab
+from gitlab_classroom import gitlab_client
 
 class LoginViewTest(TestCase):
     def setUp(self):
+        gitlab_client.clear()
         self.client = Client()
         self.login_url = reverse('accounts:login')
         self.user_model = get_user_model()
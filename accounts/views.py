@@ -3,6 +3,8 @@ from django.shortcuts import render
 from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
 from django.contrib.auth import authenticate, login, logout
 from django.urls import reverse
+from gitlab_classroom import gitlab_client
+from gitlab_classroom.breaker import GitlabUnavailable
 
 def login_view(request: HttpRequest) -> HttpResponse:
     if request.method == "GET":
@@ -12,7 +14,7 @@ def login_view(request: HttpRequest) -> HttpResponse:
         if not access_token:
             return render(request, "accounts/login.html", {'error': 'Access token is required'})
         request.session["access_token"] = access_token
-        gl = gitlab.Gitlab(url='https://gitlab-stud.elka.pw.edu.pl', private_token=request.session["access_token"])
+        gl = gitlab_client.get_client(access_token)
         try:
             gl.auth()
             gl_user_id = gl.user.id
@@ -29,11 +31,19 @@ def login_view(request: HttpRequest) -> HttpResponse:
                     "error": "Invalid credentials" 
                 }
         except gitlab.exceptions.GitlabAuthenticationError:
+            gitlab_client.discard(access_token)
             error_context = {
                 "error": "Invalid access token"
             }
+        except GitlabUnavailable:
+            error_context = {
+                "error": "GitLab is unavailable, please try again later"
+            }
         return render(request, "accounts/login.html", context=error_context)
 
 def logout_view(request: HttpRequest) -> HttpResponse:
+    access_token = request.session.get("access_token")
+    if access_token:
+        gitlab_client.discard(access_token)
     logout(request)
     return render(request, "accounts/logout.html")
\ No newline at end of file
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from gitlab_classroom.models import Teacher, Classroom, Assignment, Student
+from gitlab_classroom.models import (Teacher, Classroom, Assignment, Student, GitlabJob, GitlabUserCache, Submission,
+                                     WebhookEvent, RepositoryMirror, SimilarPair)
 from django.contrib.auth.admin import UserAdmin
 
 # admin.site.register(Teacher, UserAdmin)
@@ -25,3 +26,43 @@ class AssignmentAdmin(admin.ModelAdmin):
     list_display = ["title", "creation_date", "deadline", "teacher", "classroom", ]
     list_filter = ["teacher", "creation_date", ]
     search_fields = ["title", ]
+
+
+@admin.register(GitlabJob)
+class GitlabJobAdmin(admin.ModelAdmin):
+    list_display = ["kind", "status", "teacher", "creation_date", "progress_done", "progress_total", ]
+    list_filter = ["kind", "status", ]
+    exclude = ["access_token", ]
+
+
+@admin.register(GitlabUserCache)
+class GitlabUserCacheAdmin(admin.ModelAdmin):
+    list_display = ["username", "gitlab_id", "state", "last_verified", ]
+    list_filter = ["state", ]
+    search_fields = ["username", ]
+
+
+@admin.register(Submission)
+class SubmissionAdmin(admin.ModelAdmin):
+    list_display = ["student", "assignment", "commit_sha", "commit_date", "pipeline_status", "collected_at", ]
+    list_filter = ["pipeline_status", "assignment", ]
+    search_fields = ["student__gitlab_username", ]
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ["event_id", "kind", "assignment", "received_at", "processed_at", ]
+    list_filter = ["kind", ]
+
+
+@admin.register(RepositoryMirror)
+class RepositoryMirrorAdmin(admin.ModelAdmin):
+    list_display = ["student", "assignment", "head_sha", "size_bytes", "fetched_at", "used_at", ]
+    list_filter = ["assignment", ]
+    search_fields = ["student__gitlab_username", ]
+
+
+@admin.register(SimilarPair)
+class SimilarPairAdmin(admin.ModelAdmin):
+    list_display = ["assignment", "student_a", "student_b", "shared", "score", ]
+    list_filter = ["assignment", ]
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class GitlabConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'gitlab_classroom'
+
+    def ready(self):
+        from gitlab_classroom import search, dashboard
+        post_migrate.connect(search.install, sender=self)
+        dashboard.connect()
@@ -0,0 +1,102 @@
+"""Failing fast while a GitLab instance is down.
+
+Every pooled client talks to GitLab with the connect and read timeouts of
+``GITLAB_CONNECT_TIMEOUT`` and ``GITLAB_READ_TIMEOUT``, and through a circuit
+breaker per instance. After ``GITLAB_BREAKER_THRESHOLD`` failures in a row
+(timeouts, connection errors, 5xx responses) the breaker opens and calls
+raise :class:`GitlabUnavailable` straight away instead of tying up the
+request for the whole timeout. After ``GITLAB_BREAKER_RESET_TIMEOUT`` seconds
+a single trial call is let through, and closes the breaker again if it works.
+
+The breakers live in each process. Views catch ``GitlabUnavailable`` to save
+locally and leave the GitLab side to a queued job, and the worker puts jobs
+that hit it back into the queue.
+"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+import gitlab
+import requests
+from django.conf import settings
+
+from gitlab_classroom.ratelimit import RateLimitedSession
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class GitlabUnavailable(gitlab.exceptions.GitlabConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, instance, threshold=None, reset_timeout=None):
+        self.instance = instance
+        self.threshold = threshold or settings.GITLAB_BREAKER_THRESHOLD
+        self.reset_timeout = reset_timeout or settings.GITLAB_BREAKER_RESET_TIMEOUT
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.state != CLOSED and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def before_call(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN  # this call is the trial
+                return
+            raise GitlabUnavailable(f"GitLab at {self.instance} is unavailable, try again later.")
+
+    def success(self):
+        with self._lock:
+            self.state, self.failures = CLOSED, 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.threshold:
+                self.state, self.opened_at = OPEN, time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(url):
+    instance = urlsplit(url).netloc or url
+    with _breakers_lock:
+        if instance not in _breakers:
+            _breakers[instance] = CircuitBreaker(instance)
+        return _breakers[instance]
+
+
+def timeout():
+    return settings.GITLAB_CONNECT_TIMEOUT, settings.GITLAB_READ_TIMEOUT
+
+
+class CircuitBreakerSession(RateLimitedSession):
+    def send(self, request, **kwargs):
+        breaker = breaker_for(request.url)
+        breaker.before_call()
+        try:
+            response = super().send(request, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            breaker.failure()
+            raise GitlabUnavailable(f"GitLab at {breaker.instance} did not answer: {e}") from e
+        except Exception:
+            # anything else counts too, or a trial call that raised would leave the breaker half-open for good
+            breaker.failure()
+            raise
+        if response.status_code >= 500:
+            breaker.failure()
+        else:
+            breaker.success()
+        return response
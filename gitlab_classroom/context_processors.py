@@ -0,0 +1,5 @@
+from django.conf import settings
+
+
+def gitlab(request):
+    return {"GITLAB_URL": settings.GITLAB_URL}
@@ -0,0 +1,94 @@
+"""The teacher's dashboard on the index page.
+
+The summary takes three queries whatever the number of classrooms: the
+classrooms with their counts, the student totals and the upcoming deadlines.
+It is cached per teacher for ``DASHBOARD_CACHE_TIMEOUT`` seconds and dropped
+from the cache as soon as one of the teacher's classrooms, assignments or
+students changes (see ``connect``). Changes made with ``QuerySet.update``
+send no signals and show up when the entry expires.
+"""
+from django.core.cache import cache
+from django.conf import settings
+from django.db.models import Count, OuterRef, Q
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.utils import timezone
+
+from gitlab_classroom.models import Classroom, Assignment, Student, subquery_count
+
+
+UPCOMING_DEADLINES = 5
+
+
+def cache_key(teacher_id):
+    return f"dashboard:{teacher_id}"
+
+
+def compute_summary(teacher):
+    classrooms = list(
+        Classroom.objects.filter(teacher=teacher)
+        .annotate(student_count=subquery_count(Classroom.students.through.objects.filter(classroom=OuterRef("pk"))),
+                  assignment_count=subquery_count(Assignment.objects.filter(classroom=OuterRef("pk"))))
+        .values("id", "title", "student_count", "assignment_count")
+    )
+    totals = Student.objects.filter(classroom__teacher=teacher).aggregate(
+        students=Count("id", distinct=True),
+        without_gitlab_account=Count("id", distinct=True, filter=Q(gl_flag=False)),
+    )
+    deadlines = list(
+        Assignment.objects.filter(teacher=teacher, deadline__gte=timezone.now())
+        .order_by("deadline")
+        .values("id", "title", "deadline", "classroom__title")[:UPCOMING_DEADLINES]
+    )
+    return {
+        "classrooms": classrooms,
+        "assignments": sum(classroom["assignment_count"] for classroom in classrooms),
+        "deadlines": deadlines,
+        **totals,
+    }
+
+
+def get_summary(teacher):
+    key = cache_key(teacher.pk)
+    summary = cache.get(key)
+    if summary is None:
+        summary = compute_summary(teacher)
+        cache.set(key, summary, settings.DASHBOARD_CACHE_TIMEOUT)
+    return summary
+
+
+def invalidate(*teacher_ids):
+    cache.delete_many([cache_key(teacher_id) for teacher_id in set(teacher_ids)])
+
+
+def teachers_of(student_ids):
+    return Classroom.objects.filter(students__in=student_ids).values_list("teacher_id", flat=True).distinct()
+
+
+def owner_changed(sender, instance, **kwargs):
+    invalidate(instance.teacher_id)
+
+
+def student_changed(sender, instance, **kwargs):
+    # pre_delete rather than post_delete: afterwards the student's classrooms are already gone
+    invalidate(*teachers_of([instance.pk]))
+
+
+def classroom_students_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        invalidate(instance.teacher_id)
+        return
+    # student.classroom.add(...): pk_set holds classroom ids
+    classrooms = Classroom.objects.filter(Q(pk__in=pk_set or ()) | Q(students=instance))
+    invalidate(*classrooms.values_list("teacher_id", flat=True).distinct())
+
+
+def connect():
+    for model in (Classroom, Assignment):
+        post_save.connect(owner_changed, sender=model, dispatch_uid=f"dashboard_{model.__name__}_save")
+        post_delete.connect(owner_changed, sender=model, dispatch_uid=f"dashboard_{model.__name__}_delete")
+    post_save.connect(student_changed, sender=Student, dispatch_uid="dashboard_Student_save")
+    pre_delete.connect(student_changed, sender=Student, dispatch_uid="dashboard_Student_delete")
+    m2m_changed.connect(classroom_students_changed, sender=Classroom.students.through,
+                        dispatch_uid="dashboard_classroom_students")
@@ -0,0 +1,210 @@
+"""Exporting every student's submission of an assignment as one ZIP file.
+
+Each fork's archive is fetched at the commit recorded in its ``Submission``
+(see submissions.py; the view has them collected by the worker first when
+they are :func:`stale`), as a tar.gz, from a thread pool of
+``EXPORT_CONCURRENCY`` threads that also respects the fork engine's cap on
+in-flight requests per GitLab instance. No more than ``EXPORT_CONCURRENCY``
+downloads are started at a time, counting the one being written, so a slow
+client holds back the downloads too.
+
+The archives land in an on-disk cache addressed by the commit SHA, which
+determines the content of the archive, so exporting an unchanged submission
+again (or any of the untouched forks of one template) costs no GitLab call.
+The least recently used archives are removed once the cache grows past
+``EXPORT_CACHE_MAX_BYTES``.
+
+The ZIP is written as it is sent: the archives are read in order, one tar
+member at a time, and their files are deflated into
+``<assignment>/<username>/...`` entries of a ZIP written to a non-seekable
+stream, which never holds more than a chunk or two in memory. A
+``manifest.csv`` at the end lists what every student's folder contains.
+"""
+import csv
+import io
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import gitlab
+from django.conf import settings
+from django.utils import timezone
+
+from gitlab_classroom.forking import instance_limit
+from gitlab_classroom.groups import sanitize_path
+from gitlab_classroom.instrumentation import propagate
+
+
+CHUNK_SIZE = 64 * 1024
+# ZIP can't store times before 1980
+ZIP_EPOCH = 315532800
+
+
+def cache_path(sha):
+    return os.path.join(settings.EXPORT_CACHE_DIR, sha[:2], f"{sha}.tar.gz")
+
+
+def fetch_archive(gl, project_id, sha):
+    """Return the path of the cached tar.gz archive of ``project_id`` at ``sha``."""
+    path = cache_path(sha)
+    try:
+        os.utime(path)  # recently used, see evict
+        return path
+    except FileNotFoundError:
+        pass  # not cached, or just evicted
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, partial = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f, instance_limit(gl.url):
+            gl.projects.get(project_id, lazy=True).repository_archive(
+                sha=sha, format="tar.gz", streamed=True, action=f.write, chunk_size=CHUNK_SIZE)
+        os.replace(partial, path)  # complete archives only, whoever is reading the cache
+    except BaseException:
+        os.unlink(partial)
+        raise
+    return path
+
+
+def evict(directory, max_bytes):
+    """Remove the least recently used files of ``directory`` until it is under ``max_bytes``."""
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # removed by another process
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def stale(assignment):
+    """Whether the submissions were never collected or the deadline passed since the last sweep."""
+    collected_at = assignment.submissions_collected_at
+    return bool(assignment.gitlab_id) and (collected_at is None
+                                           or collected_at < assignment.deadline <= timezone.now())
+
+
+def plan(assignment):
+    """``(student, submission or None)`` of every student of the assignment, by username."""
+    students = list(assignment.classroom.students.order_by("gitlab_username"))
+    recorded = {submission.student_id: submission for submission in assignment.submission.all()}
+    return [(student, recorded.get(student.pk)) for student in students]
+
+
+class ZipStream:
+    """Non-seekable file ``zipfile`` writes to, emptied by the generator sending the ZIP."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def member_name(name):
+    """Path of a tar member inside the project, without GitLab's ``<project>-<sha>/`` folder."""
+    parts = [part for part in name.split("/")[1:] if part not in ("", ".")]
+    return None if not parts or ".." in parts else "/".join(parts)
+
+
+def add_archive(archive, stream, path, folder):
+    """Write the files of the tar.gz at ``path`` into ``folder``, yielding the ZIP as it grows."""
+    with tarfile.open(path, "r|gz") as tar:
+        for member in tar:
+            name = member_name(member.name)
+            if not member.isfile() or name is None:
+                continue
+            info = zipfile.ZipInfo(f"{folder}/{name}", date_time=time.gmtime(max(member.mtime, ZIP_EPOCH))[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = (member.mode & 0o777 | 0o100000) << 16
+            info.file_size = member.size
+            with tar.extractfile(member) as source, archive.open(info, "w", force_zip64=member.size > 2 ** 31) as target:
+                while chunk := source.read(CHUNK_SIZE):
+                    target.write(chunk)
+                    if len(stream.buffer) >= CHUNK_SIZE:
+                        yield stream.take()
+
+
+def fetches(executor, gl, planned, ahead):
+    """``(student, submission, future or None)`` of ``planned``.
+
+    At most ``ahead`` downloads are started, the one the ZIP is waiting for included.
+    """
+    fetch = propagate(fetch_archive)
+    window, started = deque(), 0
+    for student, submission in planned:
+        future = None
+        if submission and submission.commit_sha:
+            while started >= ahead:
+                item = window.popleft()
+                started -= item[2] is not None
+                yield item
+            future = executor.submit(fetch, gl, submission.project_id, submission.commit_sha)
+            started += 1
+        window.append((student, submission, future))
+    yield from window
+
+
+def stream_zip(gl, assignment, planned):
+    """Generate the bytes of the ZIP of ``planned``, as returned by :func:`plan`."""
+    root = sanitize_path(assignment.title) or "assignment"
+    stream = ZipStream()
+    manifest = io.StringIO()
+    writer = csv.writer(manifest)
+    writer.writerow(["username", "commit", "committed", "pipeline", "included"])
+    executor = ThreadPoolExecutor(max_workers=settings.EXPORT_CONCURRENCY)
+    try:
+        with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+            for student, submission, future in fetches(executor, gl, planned, settings.EXPORT_CONCURRENCY):
+                if future is None:
+                    writer.writerow([student.gitlab_username, "", "", "", "no submission"])
+                    continue
+                try:
+                    path = future.result()
+                    yield from add_archive(archive, stream, path, f"{root}/{student.gitlab_username}")
+                except gitlab.exceptions.GitlabError as e:
+                    included = f"failed: {e.error_message or e}"
+                except (OSError, tarfile.TarError) as e:
+                    # e.g. a broken archive, or one evicted by another export; the others are still sent
+                    included = f"failed: {e}"
+                else:
+                    included = "yes"
+                writer.writerow([student.gitlab_username, submission.commit_sha, submission.commit_date or "",
+                                 submission.pipeline_status, included])
+                if stream.buffer:
+                    yield stream.take()
+            archive.writestr(f"{root}/manifest.csv", manifest.getvalue())
+        yield stream.take()
+    finally:
+        # a download still running completes into the cache for next time
+        executor.shutdown(wait=False, cancel_futures=True)
+        #also when the client went away in the middle
+        evict(settings.EXPORT_CACHE_DIR, settings.EXPORT_CACHE_MAX_BYTES)
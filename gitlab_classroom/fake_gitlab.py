@@ -0,0 +1,516 @@
+"""An in-memory stand-in for the parts of the GitLab v4 API this app uses.
+
+It serves users, groups and subgroups, group and project members, projects,
+forks, commits, repository archives, pipelines and group webhooks over real
+HTTP, with GitLab's pagination headers, so the whole client stack (pooling,
+rate limiting, circuit breaker, instrumentation) and the fork engine can be
+measured on a machine without network access::
+
+    python manage.py fake_gitlab --port 8081 --students 300 --latency 0.05
+    GITLAB_URL=http://127.0.0.1:8081 python manage.py runserver
+
+Latency and errors can be injected per endpoint template (the keys of
+``instrumentation.endpoint_template``, e.g. ``"POST projects/:id/fork"``, or
+``"*"`` for every endpoint). Any access token is accepted and gets a user of
+its own unless the server is started with ``strict_tokens``; tokens starting
+with ``invalid`` are always rejected. Commits and pipelines added with
+:meth:`FakeGitlab.add_commit` and :meth:`FakeGitlab.add_pipeline` are
+delivered to the webhooks of the groups above the project, like GitLab does.
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import tarfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit
+
+import requests
+
+from gitlab_classroom.instrumentation import endpoint_template
+
+
+OWNER = 50
+DEVELOPER = 30
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status, self.message, self.headers = status, message, headers or {}
+
+
+@dataclass
+class Faults:
+    latency: float = 0.0  # seconds added to every call
+    endpoint_latency: dict = field(default_factory=dict)  # endpoint -> seconds, instead of latency
+    error_rate: dict = field(default_factory=dict)  # endpoint or "*" -> probability of an error
+    error_status: int = 500
+    rate_limit: int = 0  # calls per minute and token, 0 for no limit
+
+    def delay(self, key):
+        return self.endpoint_latency.get(key, self.latency)
+
+    def fails(self, key):
+        return random.random() < self.error_rate.get(key, self.error_rate.get("*", 0))
+
+
+class FakeGitlab:
+    def __init__(self, host="127.0.0.1", port=0, faults=None, strict_tokens=False):
+        self.faults = faults or Faults()
+        self.strict_tokens = strict_tokens
+        self.lock = threading.RLock()
+        self.ids = count(1)
+        self.users, self.tokens = {}, {}
+        self.groups, self.group_members = {}, {}
+        self.projects, self.project_members = {}, {}
+        self.commits, self.pipelines = {}, {}  # project id -> newest first
+        self.hooks = {}
+        self.deliveries = []  # (url, event, status or exception)
+        self.calls = []  # (method, endpoint, status)
+        self._windows = {}  # token -> (minute, calls)
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # seeding
+
+    def add_user(self, username, token=None, **extra):
+        with self.lock:
+            user_id = next(self.ids)
+            self.users[user_id] = {"id": user_id, "username": username, "name": username, "state": "active",
+                                   "email": f"{username}@example.com", "avatar_url": "",
+                                   "web_url": f"{self.url}/{username}", **extra}
+            if token:
+                self.tokens[token] = user_id
+            return self.users[user_id]
+
+    def add_group(self, name, path=None, parent_id=None, description="", owner_id=None):
+        with self.lock:
+            path = path or re.sub(r"[^a-zA-Z0-9_.-]", "_", name)
+            parent_id = int(parent_id) if parent_id else None
+            parent = self.groups.get(parent_id) if parent_id else None
+            if parent_id and parent is None:
+                raise ApiError(404, "404 Group Not Found")
+            full_path = f"{parent['full_path']}/{path}" if parent else path
+            if any(group["full_path"] == full_path for group in self.groups.values()):
+                raise ApiError(400, {"path": ["has already been taken"]})
+            group_id = next(self.ids)
+            self.groups[group_id] = {"id": group_id, "name": name, "path": path, "full_path": full_path,
+                                     "description": description, "parent_id": parent_id,
+                                     "web_url": f"{self.url}/groups/{full_path}"}
+            self.group_members[group_id] = {owner_id: OWNER} if owner_id else {}
+            return self.groups[group_id]
+
+    def add_project(self, name, namespace_id=None, path=None, forked_from=None, owner_id=None):
+        with self.lock:
+            path = path or re.sub(r"[^a-zA-Z0-9_.-]", "_", name)
+            namespace = self.groups.get(namespace_id)
+            full_path = f"{namespace['full_path']}/{path}" if namespace else path
+            if any(project["path_with_namespace"] == full_path for project in self.projects.values()):
+                raise ApiError(409, {"project_namespace.name": ["has already been taken"]})
+            project_id = next(self.ids)
+            self.projects[project_id] = {
+                "id": project_id, "name": name, "path": path, "path_with_namespace": full_path,
+                "namespace": {"id": namespace_id, "full_path": namespace["full_path"] if namespace else ""},
+                "forked_from_project": {"id": forked_from} if forked_from else None,
+                "http_url_to_repo": f"{self.url}/{full_path}.git", "web_url": f"{self.url}/{full_path}",
+                "default_branch": "main", "created_at": now(), "last_activity_at": now(),
+            }
+            self.project_members[project_id] = {owner_id: OWNER} if owner_id else {}
+            self.commits[project_id] = list(self.commits.get(forked_from, []))
+            self.pipelines[project_id] = []
+            return self.projects[project_id]
+
+    def add_commit(self, project_id, message="Update", committed_date=None):
+        """Push a commit to the default branch; ``committed_date`` is what the author's clock said."""
+        with self.lock:
+            sha = os.urandom(20).hex()
+            commit = {"id": sha, "short_id": sha[:8], "title": message, "message": message,
+                      "committed_date": committed_date or now(), "created_at": committed_date or now()}
+            self.commits[project_id].insert(0, commit)
+            self.projects[project_id]["last_activity_at"] = now()
+        project = self.projects[project_id]
+        self.deliver(project, "Push Hook", {
+            "object_kind": "push", "ref": f"refs/heads/{project['default_branch']}", "after": sha,
+            "checkout_sha": sha, "project_id": project_id, "project": self.hook_project(project),
+            "commits": [{"id": sha, "message": message, "title": message, "timestamp": commit["committed_date"]}],
+            "total_commits_count": 1,
+        })
+        return commit
+
+    def add_pipeline(self, project_id, sha, status="success"):
+        """Record a pipeline. Like in GitLab this is not project activity."""
+        with self.lock:
+            pipeline = {"id": next(self.ids), "sha": sha, "ref": "main", "status": status, "created_at": now()}
+            self.pipelines[project_id].insert(0, pipeline)
+        project = self.projects[project_id]
+        self.deliver(project, "Pipeline Hook", {
+            "object_kind": "pipeline", "object_attributes": pipeline, "project": self.hook_project(project),
+        })
+        return pipeline
+
+    def add_hook(self, group_id, url, token="", push_events=True, pipeline_events=False):
+        with self.lock:
+            hook_id = next(self.ids)
+            self.hooks[hook_id] = {"id": hook_id, "group_id": group_id, "url": url, "token": token,
+                                   "push_events": push_events, "pipeline_events": pipeline_events}
+            return self.hooks[hook_id]
+
+    # webhook deliveries
+
+    def hook_project(self, project):
+        return {key: project[key] for key in ("id", "name", "path_with_namespace", "default_branch", "web_url")}
+
+    def deliver(self, project, event, payload):
+        """POST ``payload`` to the hooks of the project's groups, from a thread like GitLab's Sidekiq."""
+        with self.lock:
+            group_ids, group = set(), self.groups.get(project["namespace"]["id"])
+            while group:
+                group_ids.add(group["id"])
+                group = self.groups.get(group["parent_id"])
+            wanted = "push_events" if event == "Push Hook" else "pipeline_events"
+            hooks = [hook for hook in self.hooks.values() if hook["group_id"] in group_ids and hook[wanted]]
+        for hook in hooks:
+            headers = {"X-Gitlab-Event": event, "X-Gitlab-Token": hook["token"],
+                       "X-Gitlab-Event-UUID": str(uuid.uuid4()), "Idempotency-Key": str(uuid.uuid4())}
+            threading.Thread(target=self.post_hook, args=(hook["url"], event, payload, headers), daemon=True).start()
+
+    def post_hook(self, url, event, payload, headers):
+        try:
+            self.deliveries.append((url, event, requests.post(url, json=payload, headers=headers, timeout=10).status_code))
+        except requests.RequestException as e:
+            self.deliveries.append((url, event, e))
+
+    # request handling
+
+    def authenticate(self, token):
+        if not token or token.startswith("invalid"):
+            raise ApiError(401, "401 Unauthorized")
+        with self.lock:
+            if token not in self.tokens:
+                if self.strict_tokens:
+                    raise ApiError(401, "401 Unauthorized")
+                self.add_user("teacher_" + hashlib.sha256(token.encode()).hexdigest()[:8], token=token)
+            return self.users[self.tokens[token]]
+
+    def rate_limit_headers(self, token):
+        limit = self.faults.rate_limit
+        if not limit:
+            return {}
+        minute = int(time.time() // 60)
+        with self.lock:
+            window, calls = self._windows.get(token, (minute, 0))
+            if window != minute:
+                window, calls = minute, 0
+            calls += 1
+            self._windows[token] = (window, calls)
+        reset = (window + 1) * 60
+        headers = {"RateLimit-Limit": str(limit), "RateLimit-Remaining": str(max(limit - calls, 0)),
+                   "RateLimit-Reset": str(reset)}
+        if calls > limit:
+            headers["Retry-After"] = str(max(int(reset - time.time()), 1))
+            raise ApiError(429, "Retry later", headers)
+        return headers
+
+    def dispatch(self, method, path, params, token):
+        user = self.authenticate(token)
+        for route_method, pattern, name in ROUTES:
+            if route_method == method and (match := pattern.fullmatch(path)):
+                return getattr(self, name)(user, params, *(arg and unquote(arg) for arg in match.groups()))
+        raise ApiError(404, "404 Not Found")
+
+    def group(self, group_id):
+        group = self.groups.get(int(group_id)) if str(group_id).isdigit() else next(
+            (g for g in self.groups.values() if g["full_path"] == group_id), None)
+        if group is None:
+            raise ApiError(404, "404 Group Not Found")
+        return group
+
+    def project(self, project_id):
+        project = self.projects.get(int(project_id)) if str(project_id).isdigit() else next(
+            (p for p in self.projects.values() if p["path_with_namespace"] == project_id), None)
+        if project is None:
+            raise ApiError(404, "404 Project Not Found")
+        return project
+
+    def member(self, user_id, level):
+        return {**self.users[user_id], "access_level": level}
+
+    def get_current_user(self, user, params):
+        return 200, user
+
+    def list_users(self, user, params):
+        users = list(self.users.values())
+        if "username" in params:
+            users = [u for u in users if u["username"].lower() == params["username"].lower()]
+        return 200, users
+
+    def create_group(self, user, params):
+        return 201, self.add_group(params.get("name", ""), params.get("path"), params.get("parent_id"),
+                                   params.get("description", ""), owner_id=user["id"])
+
+    def get_group(self, user, params, group_id):
+        return 200, self.group(group_id)
+
+    def update_group(self, user, params, group_id):
+        group = self.group(group_id)
+        with self.lock:
+            group.update({key: params[key] for key in ("name", "description") if key in params})
+        return 200, group
+
+    def delete_group(self, user, params, group_id):
+        group = self.group(group_id)
+        with self.lock:
+            doomed = [g["id"] for g in self.groups.values()
+                      if g["full_path"] == group["full_path"] or g["full_path"].startswith(group["full_path"] + "/")]
+            for doomed_id in doomed:
+                self.groups.pop(doomed_id, None)
+                self.group_members.pop(doomed_id, None)
+            for project_id in [p["id"] for p in self.projects.values() if p["namespace"]["id"] in doomed]:
+                self.projects.pop(project_id)
+        return 202, {"message": "202 Accepted"}
+
+    def list_subgroups(self, user, params, group_id):
+        parent = self.group(group_id)
+        return 200, [g for g in self.groups.values() if g["parent_id"] == parent["id"]]
+
+    def list_group_projects(self, user, params, group_id):
+        group = self.group(group_id)
+        projects = [p for p in self.projects.values() if p["namespace"]["id"] == group["id"]]
+        if params.get("order_by") in ("id", "created_at", "last_activity_at"):
+            projects.sort(key=lambda p: (p[params["order_by"]], p["id"]), reverse=params.get("sort", "desc") == "desc")
+        return 200, projects
+
+    def list_group_members(self, user, params, group_id):
+        group = self.group(group_id)
+        return 200, [self.member(uid, level) for uid, level in self.group_members[group["id"]].items()]
+
+    def add_group_members(self, user, params, group_id):
+        group = self.group(group_id)
+        user_ids = [uid for uid in str(params.get("user_id", "")).split(",") if uid]
+        level = int(params.get("access_level", DEVELOPER))
+        errors = {}
+        with self.lock:
+            members = self.group_members[group["id"]]
+            for uid in user_ids:
+                member = self.users.get(int(uid)) if uid.isdigit() else None
+                if member is None:
+                    errors[uid] = "User not found"
+                elif member["id"] in members:
+                    errors[member["username"]] = "Already a member"
+                else:
+                    members[member["id"]] = level
+        if len(user_ids) == 1:
+            if errors:
+                message = next(iter(errors.values()))
+                raise ApiError(409 if message == "Already a member" else 404, message)
+            return 201, self.member(int(user_ids[0]), level)
+        if errors:
+            return 201, {"status": "error", "message": errors}
+        return 201, {"status": "success"}
+
+    def remove_group_member(self, user, params, group_id, user_id):
+        group = self.group(group_id)
+        with self.lock:
+            if self.group_members[group["id"]].pop(int(user_id), None) is None:
+                raise ApiError(404, "404 Member Not Found")
+        return 204, None
+
+    def get_project(self, user, params, project_id):
+        return 200, self.project(project_id)
+
+    def fork_project(self, user, params, project_id):
+        source = self.project(project_id)
+        # "namespace" is the older name of the parameter and may also be a path
+        namespace = self.group(params.get("namespace_id") or params.get("namespace"))
+        return 201, self.add_project(params.get("name", source["name"]), namespace["id"],
+                                     params.get("path", source["path"]), forked_from=source["id"],
+                                     owner_id=user["id"])
+
+    def list_commits(self, user, params, project_id):
+        commits = self.commits[self.project(project_id)["id"]]
+        if "until" in params:
+            commits = [c for c in commits if parse_time(c["committed_date"]) <= parse_time(params["until"])]
+        if "since" in params:
+            commits = [c for c in commits if parse_time(c["committed_date"]) >= parse_time(params["since"])]
+        return 200, commits
+
+    def get_archive(self, user, params, project_id, archive_format=None):
+        project = self.project(project_id)
+        if (archive_format or "tar.gz") != "tar.gz":
+            raise ApiError(400, "Only tar.gz archives are faked")
+        commits = self.commits[project["id"]]
+        sha = params.get("sha")
+        commit = next((c for c in commits if sha in (None, c["id"])), None)
+        if commit is None:
+            raise ApiError(404, "404 Commit Not Found")
+        #the same bytes every time for the same commit, like GitLab's cached archives
+        folder = f"{project['path']}-{commit['id']}-{commit['id']}"
+        mtime = int(parse_time(commit["committed_date"]).timestamp())
+        files = {"README.md": f"# {project['name']}\n", "COMMIT": commit["message"] + "\n"}
+        data = io.BytesIO()
+        with gzip.GzipFile(fileobj=data, mode="wb", mtime=mtime) as gz, \
+                tarfile.open(fileobj=gz, mode="w", format=tarfile.PAX_FORMAT) as tar:
+            for name, content in files.items():
+                info = tarfile.TarInfo(f"{folder}/{name}")
+                info.size, info.mtime, info.mode = len(content.encode()), mtime, 0o644
+                tar.addfile(info, io.BytesIO(content.encode()))
+        return 200, data.getvalue()
+
+    def list_pipelines(self, user, params, project_id):
+        pipelines = self.pipelines[self.project(project_id)["id"]]
+        return 200, [p for p in pipelines if params.get("sha", p["sha"]) == p["sha"]]
+
+    def list_group_hooks(self, user, params, group_id):
+        group = self.group(group_id)
+        return 200, [{key: value for key, value in hook.items() if key != "token"}  # never shown again
+                     for hook in self.hooks.values() if hook["group_id"] == group["id"]]
+
+    def create_group_hook(self, user, params, group_id):
+        group = self.group(group_id)
+        if not params.get("url"):
+            raise ApiError(400, "url is missing")
+        truthy = lambda name: str(params.get(name, "")).lower() in ("true", "1")
+        return 201, self.add_hook(group["id"], params["url"], params.get("token", ""),
+                                  push_events=truthy("push_events") or "push_events" not in params,
+                                  pipeline_events=truthy("pipeline_events"))
+
+    def add_project_member(self, user, params, project_id):
+        project = self.project(project_id)
+        uid = int(params.get("user_id", 0))
+        if uid not in self.users:
+            raise ApiError(404, "404 User Not Found")
+        with self.lock:
+            members = self.project_members[project["id"]]
+            if uid in members:
+                raise ApiError(409, "Member already exists")
+            members[uid] = int(params.get("access_level", DEVELOPER))
+        return 201, self.member(uid, members[uid])
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def respond(self, status, body, headers=None):
+                if isinstance(body, bytes):
+                    data, content_type = body, "application/octet-stream"
+                else:
+                    data, content_type = b"" if body is None else json.dumps(body).encode(), "application/json"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def handle_api(self):
+                url = urlsplit(self.path)
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    raw = self.rfile.read(length)
+                    if "json" in (self.headers.get("Content-Type") or ""):
+                        params.update(json.loads(raw or b"{}"))
+                    else:
+                        params.update(parse_qsl(raw.decode()))
+                path = url.path.split("/api/v4", 1)[-1].rstrip("/") or "/"
+                key = f"{self.command} {endpoint_template(url.path)}"
+                time.sleep(fake.faults.delay(key))
+                headers = {}
+                try:
+                    headers = fake.rate_limit_headers(self.headers.get("PRIVATE-TOKEN", ""))
+                    if fake.faults.fails(key):
+                        raise ApiError(fake.faults.error_status, "Injected error")
+                    status, body = fake.dispatch(self.command, path, params, self.headers.get("PRIVATE-TOKEN"))
+                except ApiError as e:
+                    status, body = e.status, {"message": e.message}
+                    headers.update(e.headers)
+                if isinstance(body, list):
+                    body, page_headers = paginate(body, params, f"http://{self.headers['Host']}{url.path}")
+                    headers.update(page_headers)
+                fake.calls.append((self.command, key.split(" ", 1)[1], status))
+                self.respond(status, body, headers)
+
+            do_GET = do_POST = do_PUT = do_DELETE = handle_api
+
+        return Handler
+
+
+def paginate(items, params, base_url):
+    per_page = min(int(params.get("per_page", 20)), 100)
+    page = max(int(params.get("page", 1)), 1)
+    pages = max((len(items) + per_page - 1) // per_page, 1)
+    headers = {"X-Page": str(page), "X-Per-Page": str(per_page), "X-Total": str(len(items)),
+               "X-Total-Pages": str(pages), "X-Next-Page": str(page + 1) if page < pages else "",
+               "X-Prev-Page": str(page - 1) if page > 1 else ""}
+    if page < pages:
+        query = urlencode({**params, "page": page + 1, "per_page": per_page})
+        headers["Link"] = f'<{base_url}?{query}>; rel="next"'
+    return items[(page - 1) * per_page:page * per_page], headers
+
+
+ROUTES = [(method, re.compile(pattern), name) for method, pattern, name in [
+    ("GET", r"/user", "get_current_user"),
+    ("GET", r"/users", "list_users"),
+    ("POST", r"/groups", "create_group"),
+    ("GET", r"/groups/([^/]+)", "get_group"),
+    ("PUT", r"/groups/([^/]+)", "update_group"),
+    ("DELETE", r"/groups/([^/]+)", "delete_group"),
+    ("GET", r"/groups/([^/]+)/subgroups", "list_subgroups"),
+    ("GET", r"/groups/([^/]+)/projects", "list_group_projects"),
+    ("GET", r"/groups/([^/]+)/members(?:/all)?", "list_group_members"),
+    ("GET", r"/groups/([^/]+)/hooks", "list_group_hooks"),
+    ("POST", r"/groups/([^/]+)/hooks", "create_group_hook"),
+    ("POST", r"/groups/([^/]+)/members", "add_group_members"),
+    ("DELETE", r"/groups/([^/]+)/members/(\d+)", "remove_group_member"),
+    ("GET", r"/projects/([^/]+)", "get_project"),
+    ("POST", r"/projects/([^/]+)/fork", "fork_project"),
+    ("POST", r"/projects/([^/]+)/members", "add_project_member"),
+    ("GET", r"/projects/([^/]+)/repository/commits", "list_commits"),
+    ("GET", r"/projects/([^/]+)/repository/archive(?:\.(tar\.gz|zip|tar\.bz2|tar))?", "get_archive"),
+    ("GET", r"/projects/([^/]+)/pipelines", "list_pipelines"),
+]]
@@ -0,0 +1,135 @@
+"""Forking an assignment template into one project per student.
+
+The forks are created from a thread pool so a whole section is handled in
+parallel instead of one student after another. Every HTTP call made here goes
+through a semaphore shared by all fork runs of this process that talk to the
+same GitLab instance, so two teachers forking at once cannot flood it.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+import gitlab
+from django.conf import settings
+
+from gitlab_classroom.instrumentation import propagate
+
+
+CREATED = "created"
+EXISTED = "existed"
+FAILED = "failed"
+
+_instance_limits = {}
+_instance_limits_lock = threading.Lock()
+
+
+def instance_limit(url):
+    """Return the semaphore capping in-flight requests to one GitLab instance."""
+    with _instance_limits_lock:
+        if url not in _instance_limits:
+            _instance_limits[url] = threading.BoundedSemaphore(settings.GITLAB_MAX_CONCURRENCY)
+        return _instance_limits[url]
+
+
+@dataclass
+class ForkResult:
+    username: str
+    status: str
+    project_id: int = None
+    reason: str = ""
+
+
+@dataclass
+class ForkReport:
+    results: list = field(default_factory=list)
+
+    def with_status(self, status):
+        return [result for result in self.results if result.status == status]
+
+    @property
+    def created(self):
+        return self.with_status(CREATED)
+
+    @property
+    def existed(self):
+        return self.with_status(EXISTED)
+
+    @property
+    def failed(self):
+        return self.with_status(FAILED)
+
+    def summary(self):
+        return (f"{len(self.created)} project(s) forked, "
+                f"{len(self.existed)} already existed, "
+                f"{len(self.failed)} failed.")
+
+
+def project_path(assignments_group, username):
+    return f"{assignments_group.name}_{username}_project"
+
+
+def existing_project_paths(gl, assignments_group):
+    """Return the paths of all projects directly inside ``assignments_group``.
+
+    One paginated listing of the group replaces an instance-wide search per
+    student, and isn't affected by search results being truncated.
+    """
+    with instance_limit(gl.url):
+        return {project.path for project in assignments_group.projects.list(iterator=True, per_page=100)}
+
+
+def fork_for_student(gl, assignments_group, base_project, student, existing_paths):
+    """Fork the template for a single student and give them developer access."""
+    limit = instance_limit(gl.url)
+    path = project_path(assignments_group, student.username)
+    if path in existing_paths:
+        return ForkResult(student.username, EXISTED)
+    try:
+        with limit:
+            forked_project_data = base_project.forks.create({
+                'namespace': assignments_group.id,
+                'name': path,
+                'path': path
+            })
+        # the fork response already carries the id, no need to fetch the project again
+        forked_project = gl.projects.get(forked_project_data.id, lazy=True)
+        with limit:
+            forked_project.members.create({
+                'user_id': student.id,
+                'access_level': gitlab.const.AccessLevel.DEVELOPER
+            })
+        return ForkResult(student.username, CREATED, project_id=forked_project_data.id)
+    except gitlab.exceptions.GitlabError as e:
+        return ForkResult(student.username, FAILED, reason=e.error_message or str(e))
+    except Exception as e:
+        return ForkResult(student.username, FAILED, reason=str(e))
+
+
+def fork_projects(gl, assignments_group, base_project_id, students, skip_user_id=None, max_workers=None,
+                  on_progress=None):
+    """Fork ``base_project_id`` into ``assignments_group`` for every student.
+
+    ``students`` are GitLab members (anything with ``id`` and ``username``);
+    the member whose id equals ``skip_user_id`` (the teacher) is left out.
+    ``on_progress(done, total)`` is called each time a student is finished.
+    Returns a :class:`ForkReport` with one result per student, in input order.
+    """
+    with instance_limit(gl.url):
+        base_project = gl.projects.get(base_project_id)
+    students = [student for student in students if str(student.id) != str(skip_user_id)]
+    report = ForkReport()
+    if not students:
+        return report
+
+    existing_paths = existing_project_paths(gl, assignments_group)
+    max_workers = max_workers or settings.GITLAB_FORK_WORKERS
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(students))) as executor:
+        fork = propagate(fork_for_student)
+        futures = [executor.submit(fork, gl, assignments_group, base_project, student, existing_paths)
+                   for student in students]
+        if on_progress:
+            on_progress(0, len(futures))
+            for done, _ in enumerate(as_completed(futures), start=1):
+                on_progress(done, len(futures))
+        report.results = [future.result() for future in futures]
+    return report
@@ -1,4 +1,5 @@
 from django import forms
+from django.urls import reverse
 from gitlab_classroom.models import Assignment, Student, Classroom
 
 class AssignmentForm(forms.ModelForm):
@@ -12,20 +13,44 @@ class AssignmentForm(forms.ModelForm):
         input_formats = ['%Y-%m-%dT%H:%M']
 
 
+class StudentAutocompleteWidget(forms.SelectMultiple):
+    """Multi-select that only renders the chosen students.
+
+    The other options are fetched from the student autocomplete endpoint as
+    the teacher types, so the page doesn't grow with the Student table.
+    """
+
+    class Media:
+        js = ["js/student_autocomplete.js"]
+
+    def optgroups(self, name, value, attrs=None):
+        chosen = [v for v in value if str(v).isdigit()]
+        all_choices = self.choices
+        self.choices = [(student.pk, str(student))
+                        for student in all_choices.queryset.filter(pk__in=chosen)] if chosen else []
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = all_choices
+
+
 class AddStudentToClassroomForm(forms.Form):
-    student = forms.ModelChoiceField(
+    students = forms.ModelMultipleChoiceField(
         queryset=Student.objects.none(),  # Start with an empty queryset
         label="",
-        required=True
+        required=True,
+        widget=StudentAutocompleteWidget(attrs={"size": 8})
     )
 
     def __init__(self, *args, **kwargs):
         classroom_id = kwargs.pop('classroom_id', None)
         super(AddStudentToClassroomForm, self).__init__(*args, **kwargs)
         if classroom_id:
-            classroom = Classroom.objects.get(pk=classroom_id)
             # Exclude students who are already in this classroom
-            self.fields['student'].queryset = Student.objects.exclude(id__in=classroom.students.all())
+            self.fields['students'].queryset = Student.objects.exclude(classroom=classroom_id)
+            self.fields['students'].widget.attrs["data-autocomplete-url"] = (
+                reverse("gitlab_classroom:student-autocomplete") + f"?classroom={classroom_id}"
+            )
 
 
 class RemoveStudentFromClassroomForm(forms.Form):
@@ -38,7 +63,7 @@ class ClassroomSearchForm(forms.Form):
                             label="",
                             widget=forms.TextInput(
                                 attrs={
-                                    "placeholder": "search by title"
+                                    "placeholder": "search by title or description"
                                 }
                             )
                         )
@@ -50,25 +75,32 @@ class AssignmentSearchForm(forms.Form):
                             label="",
                             widget=forms.TextInput(
                                 attrs={
-                                    "placeholder": "search by title"
+                                    "placeholder": "search by title or description"
                                 }
                             )
                         )
 
 
 class StudentSearchForm(forms.Form):
-    gitlab_username = forms.CharField(max_length=255,
-                                      required=False,
-                                      label="",
-                                      widget=forms.TextInput(
-                                          attrs={
-                                              "placeholder":"search by username"
-                                          }
-                                    )
-                                )
+    query = forms.CharField(max_length=255,
+                            required=False,
+                            label="",
+                            widget=forms.TextInput(
+                                attrs={
+                                    "placeholder":"search by username, name, email or student ID"
+                                }
+                            )
+                        )
 
 class ForkProjectsForm(forms.Form):
     gitlab_template_id = forms.CharField(
         label="GitLab Template ID",
         help_text="Enter the GitLab ID of the template project to fork."
-    )
\ No newline at end of file
+    )
+
+
+class RosterImportForm(forms.Form):
+    roster = forms.FileField(
+        label="Roster CSV",
+        help_text="Columns: username, first_name, second_name, email, student_id."
+    )
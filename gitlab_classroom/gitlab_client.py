@@ -0,0 +1,89 @@
+"""Process-wide registry of python-gitlab clients.
+
+Building a ``gitlab.Gitlab`` per view means a new ``requests`` session, and
+with it a new TLS handshake, on every request. The registry hands out one
+client per (instance URL, token) instead, so its keep-alive connections are
+reused by the following requests and by the worker threads of a fork run.
+
+Tokens are only kept as SHA-256 digests in the registry keys. The number of
+clients is capped (least recently used ones are dropped first) and clients
+that haven't been used for ``GITLAB_CLIENT_IDLE_TIMEOUT`` seconds are dropped.
+Their sessions time out and fail fast through ``breaker``, pace calls through
+``ratelimit`` and record them for ``instrumentation``.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import gitlab
+import requests
+from django.conf import settings
+
+from gitlab_classroom.breaker import CircuitBreakerSession, timeout
+
+
+_clients = OrderedDict()  # (url, token digest) -> (client, last used)
+_lock = threading.Lock()
+
+
+def _key(url, token):
+    return url, hashlib.sha256(token.encode()).hexdigest()
+
+
+def _build(url, token):
+    session = CircuitBreakerSession()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=settings.GITLAB_CLIENT_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return gitlab.Gitlab(url, private_token=token, session=session, timeout=timeout())
+
+
+def _close(client):
+    try:
+        client.session.close()
+    except Exception:
+        pass
+
+
+def _evict_idle(now):
+    idle_timeout = settings.GITLAB_CLIENT_IDLE_TIMEOUT
+    while _clients:
+        key, (_, last_used) = next(iter(_clients.items()))
+        if now - last_used < idle_timeout:
+            return
+        # a long job may still be using it, so it's left to the GC like the ones over the cap
+        del _clients[key]
+
+
+def get_client(token, url=None):
+    """Return the pooled client for ``token``, creating it on first use."""
+    url = url or settings.GITLAB_URL
+    key = _key(url, token)
+    now = time.monotonic()
+    with _lock:
+        _evict_idle(now)
+        entry = _clients.pop(key, None)
+        client = entry[0] if entry else _build(url, token)
+        _clients[key] = (client, now)
+        while len(_clients) > settings.GITLAB_CLIENTS_MAX:
+            # may still be in use by another thread, let the GC close it
+            _clients.popitem(last=False)
+    return client
+
+
+def discard(token, url=None):
+    """Drop the client for ``token``, e.g. after logout or a rejected token."""
+    with _lock:
+        entry = _clients.pop(_key(url or settings.GITLAB_URL, token), None)
+    if entry:
+        _close(entry[0])
+
+
+def clear():
+    with _lock:
+        entries = list(_clients.values())
+        _clients.clear()
+    for client, _ in entries:
+        _close(client)
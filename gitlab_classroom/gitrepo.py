@@ -0,0 +1,116 @@
+"""Running git for the bare mirrors of mirrors.py.
+
+Kept free of Django so that the fetches can run in spawned processes, which
+start without a configured Django.
+"""
+import base64
+import os
+import shutil
+import subprocess
+import tempfile
+
+
+class GitError(Exception):
+    pass
+
+
+def environment(token=None):
+    env = {**os.environ, "GIT_TERMINAL_PROMPT": "0"}  # fail instead of asking for a password
+    if token:
+        #passed in the environment, so it is neither stored in the mirror's config nor shown by ps
+        credentials = base64.b64encode(f"oauth2:{token}".encode()).decode()
+        env.update(GIT_CONFIG_COUNT="1", GIT_CONFIG_KEY_0="http.extraHeader",
+                   GIT_CONFIG_VALUE_0=f"Authorization: Basic {credentials}")
+    return env
+
+
+def git(*args, env=None, timeout=None):
+    try:
+        result = subprocess.run(["git", *args], env=env, capture_output=True, text=True, timeout=timeout,
+                                check=True)
+    except subprocess.CalledProcessError as e:
+        raise GitError(e.stderr.strip() or f"git {args[2] if args[0] == '-C' else args[0]} failed") from None
+    except subprocess.TimeoutExpired:
+        raise GitError(f"git timed out after {timeout}s") from None
+    return result.stdout
+
+
+def head(path):
+    """The commit HEAD of the repository at ``path`` points at, "" if it has none."""
+    try:
+        return git("-C", path, "rev-parse", "--verify", "--quiet", "HEAD^{commit}").strip()
+    except GitError:
+        return ""
+
+
+def has_commit(path, sha):
+    try:
+        git("-C", path, "cat-file", "-e", f"{sha}^{{commit}}")
+    except GitError:
+        return False
+    return True
+
+
+def size(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            total += os.lstat(os.path.join(root, name)).st_size
+    return total
+
+
+def create(path, url, env, timeout):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = tempfile.mkdtemp(dir=os.path.dirname(path), suffix=".part")
+    try:
+        git("init", "--bare", "--quiet", partial, env=env)
+        git("-C", partial, "remote", "add", "origin", url, env=env)
+        #branches and tags only, GitLab's merge request and pipeline refs aren't needed
+        git("-C", partial, "config", "--replace-all", "remote.origin.fetch", "+refs/heads/*:refs/heads/*", env=env)
+        git("-C", partial, "config", "--add", "remote.origin.fetch", "+refs/tags/*:refs/tags/*", env=env)
+        git("-C", partial, "fetch", "--prune", "--quiet", "origin", env=env, timeout=timeout)
+        #HEAD of a new repository is whatever init.defaultBranch says, make it the remote's default branch
+        for line in git("-C", partial, "ls-remote", "--symref", "origin", "HEAD", env=env, timeout=timeout).splitlines():
+            if line.startswith("ref: "):
+                git("-C", partial, "symbolic-ref", "HEAD", line[5:].split("\t")[0], env=env)
+        os.rename(partial, path)  # only complete mirrors are ever seen at path
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+
+
+def fetch(path, url, token=None, timeout=None):
+    """Create or update the bare mirror of ``url`` at ``path``; returns ``(HEAD commit, size in bytes)``."""
+    env = environment(token)
+    if os.path.isdir(path):
+        git("-C", path, "remote", "set-url", "origin", url, env=env)
+        git("-C", path, "fetch", "--prune", "--quiet", "origin", env=env, timeout=timeout)
+    else:
+        create(path, url, env, timeout)
+    return head(path), size(path)
+
+
+def blobs(path, sha, max_bytes=None):
+    """``(file path, content)`` of the files of commit ``sha``, without those over ``max_bytes``."""
+    entries = []
+    for entry in git("-C", path, "ls-tree", "-r", "-z", "--long", sha).split("\0"):
+        if not entry:
+            continue
+        meta, name = entry.split("\t", 1)
+        mode, kind, obj, length = meta.split()
+        # symbolic links and submodules have no content of their own
+        if kind == "blob" and mode != "120000" and (max_bytes is None or int(length) <= max_bytes):
+            entries.append((name, obj))
+    if not entries:
+        return
+    try:
+        output = subprocess.run(["git", "-C", path, "cat-file", "--batch"], capture_output=True, check=True,
+                                input="".join(f"{obj}\n" for _, obj in entries).encode()).stdout
+    except subprocess.CalledProcessError as e:
+        raise GitError(e.stderr.decode(errors="replace").strip() or "git cat-file failed") from None
+    position = 0
+    for name, _ in entries:
+        header_end = output.index(b"\n", position)  # "<object> blob <size>"
+        length = int(output[position:header_end].split()[2])
+        yield name, output[header_end + 1:header_end + 1 + length]
+        position = header_end + 1 + length + 1
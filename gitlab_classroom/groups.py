@@ -0,0 +1,102 @@
+"""Helpers for the GitLab group layout of a classroom.
+
+Every classroom group has a MEMBERS subgroup holding the students and an
+ASSIGNMENTS subgroup holding one subgroup per assignment. Their ids are kept
+on the ``Classroom`` row, so later operations can address them directly with
+a lazy group object instead of listing the classroom's subgroups first.
+"""
+import re
+
+import gitlab
+from django.conf import settings
+
+from gitlab_classroom.models import Classroom
+
+
+MEMBERS = "MEMBERS"
+ASSIGNMENTS = "ASSIGNMENTS"
+
+SUBGROUPS = {
+    MEMBERS: ("members_gitlab_id", "Classroom Members"),
+    ASSIGNMENTS: ("assignments_gitlab_id", "Assignments folder"),
+}
+
+
+def sanitize_path(title):
+    return re.sub(r'[^a-zA-Z0-9_\-.]', '_', title.lower()).strip('-.')
+
+
+def create_subgroup(gl, classroom, parent_id, name):
+    field, description = SUBGROUPS[name]
+    subgroup_data = {
+        "name": name,
+        "path": f"{sanitize_path(classroom.title)}_{name}".strip('-.'),
+        "description": description,
+        "parent_id": parent_id
+    }
+    return gl.groups.create(subgroup_data)
+
+
+def resolve_subgroup_ids(gl, classroom):
+    """Look the subgroups up by name, create missing ones and store their ids."""
+    parent = gl.groups.get(classroom.gitlab_id, lazy=True)
+    found = {subgroup.name: subgroup.id for subgroup in parent.subgroups.list(all=True)}
+    ids = {}
+    for name, (field, _) in SUBGROUPS.items():
+        if name not in found:
+            found[name] = create_subgroup(gl, classroom, classroom.gitlab_id, name).id
+        ids[field] = found[name]
+        setattr(classroom, field, found[name])
+    Classroom.objects.filter(pk=classroom.pk).update(**ids)
+    return ids
+
+
+def subgroup(gl, classroom, name):
+    """Return a lazy group object for the classroom's ``name`` subgroup."""
+    field, _ = SUBGROUPS[name]
+    if not getattr(classroom, field):
+        resolve_subgroup_ids(gl, classroom)
+    return gl.groups.get(getattr(classroom, field), lazy=True)
+
+
+def add_members(gl, group, students, access_level=gitlab.const.DEVELOPER_ACCESS, batch_size=None):
+    """Add ``students`` to ``group`` with one request per batch of users.
+
+    GitLab's members endpoint takes a comma separated ``user_id`` list and
+    reports the users it couldn't add by username. Returns the students that
+    are members afterwards and a ``{student: reason}`` dict of failures.
+    """
+    batch_size = batch_size or settings.GITLAB_MEMBERS_BATCH_SIZE
+    added, failures, candidates = [], {}, []
+    for student in students:
+        if student.gitlab_id:
+            candidates.append(student)
+        else:
+            failures[student] = "Student has no account on GitLab."
+
+    for start in range(0, len(candidates), batch_size):
+        batch = candidates[start:start + batch_size]
+        try:
+            result = gl.http_post(f"/groups/{group.id}/members",
+                                  post_data={"user_id": ",".join(str(student.gitlab_id) for student in batch),
+                                             "access_level": access_level})
+        except gitlab.exceptions.GitlabHttpError as e:
+            if len(batch) == 1 and e.response_code == 409:  # already a member
+                added.extend(batch)
+                continue
+            for student in batch:
+                failures[student] = str(e.error_message)
+            continue
+
+        errors = {}
+        if isinstance(result, dict) and result.get("status") == "error":
+            errors = result.get("message") or {}
+            if not isinstance(errors, dict):
+                errors = {str(student.gitlab_id): errors for student in batch}
+        for student in batch:
+            reason = errors.get(student.gitlab_username) or errors.get(str(student.gitlab_id))
+            if reason and "already" not in str(reason).lower():
+                failures[student] = str(reason)
+            else:
+                added.append(student)
+    return added, failures
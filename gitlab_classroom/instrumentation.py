@@ -0,0 +1,154 @@
+"""Counting and timing the GitLab API calls made while serving a request.
+
+Every client from ``gitlab_client`` talks through an :class:`InstrumentedSession`,
+which records each HTTP call (endpoint template such as ``groups/:id/members``,
+status and duration) into the :class:`CallStats` of the current context and
+logs the calls slower than ``GITLAB_SLOW_CALL_MS``. They also go to ``metrics``.
+
+``GitlabTimingMiddleware`` opens a ``CallStats`` per request, keeps it as
+``request.gitlab_stats`` and reports it in a ``Server-Timing`` header, which
+the browser's developer tools show next to the request. Outside of requests,
+e.g. in tests, ``capture()`` collects the calls of a block of code. Worker
+threads only count towards the request that started them when their function
+is wrapped with ``propagate()``.
+"""
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+
+from gitlab_classroom import metrics
+
+
+logger = logging.getLogger("gitlab_classroom.gitlab")
+
+_current = ContextVar("gitlab_call_stats", default=None)
+
+ID_SEGMENT = re.compile(r"^(\d+|[^/]*%2[fF][^/]*)$")
+# whatever follows them is an id or a path (groups/prog_1) or a SHA, never part of the endpoint
+COLLECTIONS = frozenset({"groups", "projects", "users", "namespaces", "commits", "branches", "tags"})
+
+
+def endpoint_template(url):
+    """``https://host/api/v4/groups/12/members/7`` -> ``groups/:id/members/:id``.
+
+    Kept to a fixed set of values, they are labels of the metrics.
+    """
+    path = urlsplit(url).path
+    segments = path.split("/api/v4/", 1)[-1].strip("/").split("/")
+    return "/".join(":id" if ID_SEGMENT.match(segment) or (i and segments[i - 1] in COLLECTIONS) else segment
+                    for i, segment in enumerate(segments))
+
+
+@dataclass
+class Call:
+    method: str
+    endpoint: str
+    status: int  # 0 when no response came back
+    duration: float  # seconds
+
+
+@dataclass
+class CallStats:
+    calls: list = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, call):
+        with self._lock:
+            self.calls.append(call)
+
+    @property
+    def count(self):
+        return len(self.calls)
+
+    @property
+    def duration(self):
+        return sum(call.duration for call in self.calls)
+
+    def by_endpoint(self):
+        """``{"METHOD endpoint": (calls, seconds)}``, slowest first."""
+        totals = defaultdict(lambda: [0, 0.0])
+        for call in self.calls:
+            total = totals[f"{call.method} {call.endpoint}"]
+            total[0] += 1
+            total[1] += call.duration
+        return dict(sorted(((key, tuple(value)) for key, value in totals.items()),
+                           key=lambda item: -item[1][1]))
+
+    def server_timing(self, limit=10):
+        entries = [f'gitlab;dur={self.duration * 1000:.1f};desc="{self.count} GitLab calls"']
+        for i, (key, (count, seconds)) in enumerate(list(self.by_endpoint().items())[:limit]):
+            entries.append(f'gitlab-{i};dur={seconds * 1000:.1f};desc="{key} x{count}"')
+        return ", ".join(entries)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def capture():
+    stats = CallStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def propagate(func):
+    """Wrap ``func`` so that its calls count towards the caller's stats in any thread."""
+    stats = _current.get()
+
+    def wrapper(*args, **kwargs):
+        token = _current.set(stats)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return wrapper
+
+
+def record(method, url, duration, response=None):
+    call = Call(method, endpoint_template(url), response.status_code if response is not None else 0, duration)
+    metrics.observe_gitlab_call(call, url, response)
+    stats = _current.get()
+    if stats is not None:
+        stats.add(call)
+    if duration * 1000 >= settings.GITLAB_SLOW_CALL_MS:
+        logger.warning("slow GitLab call %s %s: %.0f ms, status %s", call.method, call.endpoint,
+                       duration * 1000, call.status,
+                       extra={"gitlab_method": call.method, "gitlab_endpoint": call.endpoint,
+                              "gitlab_status": call.status, "duration_ms": round(duration * 1000, 1)})
+    return call
+
+
+class InstrumentedSession(requests.Session):
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        response = None
+        try:
+            response = super().send(request, **kwargs)
+            return response
+        finally:
+            record(request.method, request.url, time.perf_counter() - start, response)
+
+
+class GitlabTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with capture() as stats:
+            request.gitlab_stats = stats
+            response = self.get_response(request)
+        response["Server-Timing"] = stats.server_timing()
+        return response
@@ -0,0 +1,264 @@
+"""Database-backed queue for GitLab operations that are too slow for a request.
+
+Views call :func:`enqueue` and return straight away; the ``gitlab_worker``
+management command picks the jobs up and runs the handler registered for
+their kind. A job is claimed with a conditional UPDATE, so any number of
+worker processes can poll the same table without running a job twice. A job
+still running ``GITLAB_JOB_STALE_TIMEOUT`` seconds after it was claimed is
+taken to have lost its worker and is put back into the queue (:func:`reclaim`).
+"""
+import logging
+import time
+from datetime import timedelta
+
+import gitlab
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from gitlab_classroom.breaker import GitlabUnavailable
+from gitlab_classroom.forking import fork_projects
+from gitlab_classroom.gitlab_client import get_client
+from gitlab_classroom.groups import MEMBERS, sanitize_path, resolve_subgroup_ids, subgroup
+from gitlab_classroom.models import GitlabJob, Classroom
+from gitlab_classroom import metrics, mirrors, similarity, submissions, user_cache
+
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register the decorated function as the handler for jobs of ``kind``."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, teacher, access_token, classroom=None, assignment=None, run_after=None, **payload):
+    return GitlabJob.objects.create(kind=kind,
+                                    teacher=teacher,
+                                    access_token=access_token,
+                                    classroom=classroom,
+                                    assignment=assignment,
+                                    run_after=run_after,
+                                    payload=payload)
+
+
+def claim_next(worker_name):
+    """Mark the oldest queued job as running for ``worker_name`` and return it."""
+    while True:
+        job = (GitlabJob.objects.filter(status=GitlabJob.QUEUED)
+               .filter(Q(run_after__isnull=True) | Q(run_after__lte=timezone.now()))
+               .order_by("creation_date", "id").first())
+        if job is None:
+            return None
+        claimed = GitlabJob.objects.filter(pk=job.pk, status=GitlabJob.QUEUED).update(
+            status=GitlabJob.RUNNING, worker=worker_name, started_at=timezone.now()
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+        #another worker was faster, try the next one
+
+
+def reclaim():
+    """Put back into the queue the jobs whose worker died while running them; returns how many."""
+    stale = GitlabJob.objects.filter(status=GitlabJob.RUNNING,
+                                     started_at__lt=timezone.now() - timedelta(seconds=settings.GITLAB_JOB_STALE_TIMEOUT))
+    error = "The worker running the job stopped."
+    # conditional on the status too, so that a job is reclaimed by one worker only
+    failed = stale.filter(attempts__gte=settings.GITLAB_JOB_MAX_ATTEMPTS - 1).update(
+        status=GitlabJob.FAILED, error=error, access_token="", finished_at=timezone.now())
+    requeued = stale.update(status=GitlabJob.QUEUED, error=error, worker="", started_at=None,
+                            attempts=F("attempts") + 1)
+    if failed or requeued:
+        logger.warning("Reclaimed %s stale GitLab job(s), %s of them gave up", failed + requeued, failed)
+    return failed + requeued
+
+
+def run_job(job):
+    start = time.monotonic()
+    try:
+        job.result = HANDLERS[job.kind](job) or {}
+        job.status = GitlabJob.DONE
+    except GitlabUnavailable as e:
+        if job.attempts + 1 < settings.GITLAB_JOB_MAX_ATTEMPTS:
+            return retry_later(job, e)
+        logger.warning("GitLab job %s (%s) gave up: %s", job.pk, job.kind, e)
+        job.status = GitlabJob.FAILED
+        job.error = str(e)
+    except Exception as e:
+        logger.exception("GitLab job %s (%s) failed", job.pk, job.kind)
+        job.status = GitlabJob.FAILED
+        job.error = str(e)
+    job.access_token = ""
+    job.finished_at = timezone.now()
+    # the handler may have deleted the job's classroom, so don't go through save()
+    GitlabJob.objects.filter(pk=job.pk).update(result=job.result, status=job.status, error=job.error,
+                                               access_token="", finished_at=job.finished_at)
+    metrics.observe_job(job, time.monotonic() - start)
+    return job
+
+
+def retry_later(job, error):
+    """Put ``job`` back into the queue until GitLab's breaker may have closed again."""
+    job.status = GitlabJob.QUEUED
+    job.error = str(error)
+    job.run_after = timezone.now() + timedelta(seconds=settings.GITLAB_BREAKER_RESET_TIMEOUT)
+    GitlabJob.objects.filter(pk=job.pk).update(status=job.status, error=job.error, run_after=job.run_after,
+                                               attempts=F("attempts") + 1, worker="", started_at=None)
+    return job
+
+
+def run_pending(worker_name="inline"):
+    """Run queued jobs in this process until the queue is empty."""
+    reclaim()
+    processed = 0
+    while (job := claim_next(worker_name)) is not None:
+        run_job(job)
+        processed += 1
+    return processed
+
+
+def client_for(job):
+    return get_client(job.access_token)
+
+
+@handler(GitlabJob.CREATE_CLASSROOM)
+def create_classroom_groups(job):
+    classroom = job.classroom
+    if classroom is None:
+        return {"skipped": "Classroom was deleted before its group was created."}
+    gl = client_for(job)
+
+    group_data = {
+        'name': classroom.title,
+        'path': sanitize_path(classroom.title),
+        'description': classroom.description
+    }
+
+    # the group id is stored as soon as the group exists, so a retried job only creates the missing
+    # subgroups. On failure the job fails, the classroom stays.
+    if not classroom.gitlab_id:
+        try:
+            group = gl.groups.create(group_data)
+        except gitlab.exceptions.GitlabCreateError as e:
+            if e.response_code != 400 or "taken" not in str(e.error_message):
+                raise
+            #another title with the same path ("Prog 1" and "prog 1") or a group that isn't ours
+            group = gl.groups.create({**group_data, 'path': f"{group_data['path']}_{classroom.pk}"})
+        classroom.gitlab_id = group.id
+        Classroom.objects.filter(pk=classroom.pk).update(gitlab_id=group.id)
+
+    return {"gitlab_id": classroom.gitlab_id, **resolve_subgroup_ids(gl, classroom)}
+
+
+@handler(GitlabJob.DELETE_GROUP)
+def delete_group(job):
+    gl = client_for(job)
+    try:
+        gl.groups.get(job.payload["group_id"], lazy=True).delete()
+    except gitlab.exceptions.GitlabDeleteError as e:
+        if e.response_code != 404:
+            raise
+        return {"deleted": False, "reason": "GitLab group could not be found."}
+    return {"deleted": True}
+
+
+@handler(GitlabJob.FORK_PROJECTS)
+def fork_assignment_projects(job):
+    assignment = job.assignment
+    if assignment is None:
+        return {"skipped": "Assignment was deleted before the projects were forked."}
+    gl = client_for(job)
+    assignments_group = gl.groups.get(assignment.gitlab_id)
+    members_group = subgroup(gl, assignment.classroom, MEMBERS)
+    students = members_group.members.list(all=True)
+    try:
+        report = fork_projects(gl, assignments_group, job.payload["template_id"], students,
+                               skip_user_id=job.teacher.gitlab_id, on_progress=job.set_progress)
+    except gitlab.exceptions.GitlabGetError as e:
+        if e.response_code != 404:
+            raise
+        raise ValueError(f"There is no template with ID {job.payload['template_id']}.") from e
+    return {
+        "summary": report.summary(),
+        "created": [result.username for result in report.created],
+        "existed": [result.username for result in report.existed],
+        "failed": [{"username": result.username, "reason": result.reason} for result in report.failed],
+    }
+
+
+@handler(GitlabJob.REFRESH_USERS)
+def refresh_users(job):
+    found = user_cache.refresh(client_for(job), job.payload["usernames"])
+    return {"refreshed": len(found)}
+
+
+@handler(GitlabJob.SYNC_GROUP)
+def sync_group(job):
+    # the object is read when the job runs, so the latest edit wins
+    obj = job.assignment or job.classroom
+    if obj is None:
+        return {"skipped": "It was deleted before its group was updated."}
+    group = client_for(job).groups.get(obj.gitlab_id, lazy=True)
+    group.name = obj.title
+    group.description = obj.description
+    group.save()
+    return {"synced": obj.gitlab_id}
+
+
+@handler(GitlabJob.COLLECT_SUBMISSIONS)
+def collect_submissions(job):
+    assignment = job.assignment
+    if assignment is None:
+        return {"skipped": "Assignment was deleted before its submissions were collected."}
+    # the next sweep is queued first, while this job still has the token, so that a sweep that fails
+    # doesn't end the schedule; a retry of this job finds it already queued
+    next_sweep = submissions.next_sweep(assignment)
+    if next_sweep and not submissions.scheduled(assignment).filter(status=GitlabJob.QUEUED).exclude(pk=job.pk).exists():
+        enqueue(GitlabJob.COLLECT_SUBMISSIONS, job.teacher, job.access_token, assignment=assignment,
+                run_after=next_sweep, incremental=True)
+    report = submissions.collect(client_for(job), assignment, incremental=job.payload.get("incremental", True),
+                                 on_progress=job.set_progress)
+    return {
+        "summary": report.summary() + (f" Next sweep at {timezone.localtime(next_sweep):%Y-%m-%d %H:%M}."
+                                       if next_sweep else ""),
+        "failed": [{"username": username, "reason": reason} for username, reason in report.failed],
+    }
+
+
+def sync_mirrors(job, assignment, gl):
+    if assignment.submissions_collected_at is None:
+        submissions.collect(gl, assignment)  # the forks are found by collecting the submissions
+    return mirrors.sync(assignment, gl=gl, token=job.access_token, force=job.payload.get("force", False),
+                        on_progress=job.set_progress)
+
+
+@handler(GitlabJob.MIRROR_REPOSITORIES)
+def mirror_repositories(job):
+    assignment = job.assignment
+    if assignment is None:
+        return {"skipped": "Assignment was deleted before its repositories were mirrored."}
+    report = sync_mirrors(job, assignment, client_for(job))
+    return {
+        "summary": report.summary(),
+        "failed": [{"username": username, "reason": reason} for username, reason in report.failed],
+    }
+
+
+@handler(GitlabJob.CHECK_SIMILARITY)
+def check_similarity(job):
+    assignment = job.assignment
+    if assignment is None:
+        return {"skipped": "Assignment was deleted before its submissions were compared."}
+    mirror_report = sync_mirrors(job, assignment, client_for(job))
+    report = similarity.update(assignment, force=job.payload.get("force", False), on_progress=job.set_progress)
+    return {
+        "summary": report.summary(),
+        "failed": [{"username": username, "reason": reason}
+                   for username, reason in mirror_report.failed + report.failed],
+    }
@@ -0,0 +1,352 @@
+"""Replaying term-start week: many teachers using the app at the same time.
+
+Every simulated teacher logs in through the login page with an access token
+of its own, creates a classroom and an assignment, and then keeps browsing
+the lists and detail pages, adding students and queueing forks, with a
+random think time between actions. Each request is timed under its URL name
+and :meth:`LoadTest.run` returns the throughput, p50/p95/p99 latency and
+error rate of every one.
+
+The teachers are threads. :class:`InProcessClient` calls the app in this
+process through Django's test client (see :func:`fake_gitlab` for the GitLab
+it needs), :class:`HttpClient` talks HTTP to a running deployment, which
+must then point at a fake GitLab itself (``manage.py fake_gitlab``).
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from gitlab_classroom import jobs
+from gitlab_classroom.fake_gitlab import FakeGitlab
+from gitlab_classroom.models import GitlabJob
+
+
+CLASSROOM_LINK = re.compile(r'href="/classrooms/(\d+)/"')
+ASSIGNMENT_LINK = re.compile(r'href="/assignments/(\d+)/"')
+ERROR_MESSAGE = re.compile(r'class="alert alert-danger[^>]*>\s*([^<:]*)')
+
+# seconds a teacher waits for the GitLab groups of its classroom
+SETUP_TIMEOUT = 60
+
+
+@dataclass
+class Response:
+    status: int
+    text: str
+
+
+def local_host():
+    """A host name the app accepts, for requests that never leave the process."""
+    for host in settings.ALLOWED_HOSTS:
+        if host not in ("*", ".localhost"):
+            return host.lstrip(".")
+    return "localhost"
+
+
+class InProcessClient:
+    def __init__(self):
+        #not one of INTERNAL_IPS, or the debug toolbar would be rendered into every page
+        self.client = Client(raise_request_exception=False, HTTP_HOST=local_host(), REMOTE_ADDR="192.0.2.1")
+
+    def request(self, method, path, data=None):
+        if method == "POST":
+            response = self.client.post(path, data or {})
+        else:
+            response = self.client.get(path, data or {})
+        return Response(response.status_code, response.content.decode(errors="replace"))
+
+    def close(self):
+        connections.close_all()  # the connections of this thread
+
+
+class HttpClient:
+    def __init__(self, base_url, timeout=60):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def request(self, method, path, data=None):
+        url = self.base_url + path
+        if method == "POST":
+            if "csrftoken" not in self.session.cookies:
+                self.session.get(url, timeout=self.timeout)  # the form sets the CSRF cookie
+            data = {**(data or {}), "csrfmiddlewaretoken": self.session.cookies.get("csrftoken", "")}
+            response = self.session.post(url, data=data, headers={"Referer": url},
+                                         allow_redirects=False, timeout=self.timeout)
+        else:
+            response = self.session.get(url, params=data, allow_redirects=False, timeout=self.timeout)
+        return Response(response.status_code, response.text)
+
+    def close(self):
+        self.session.close()
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted ``values``."""
+    if not values:
+        return 0
+    return values[max(math.ceil(q / 100 * len(values)) - 1, 0)]
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+
+    def add(self, name, duration, error=None):
+        with self.lock:
+            self.latencies[name].append(duration)
+            if error:
+                self.errors[name][error] += 1
+
+    def report(self, elapsed):
+        urls = {}
+        for name, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            errors = sum(self.errors[name].values())
+            urls[name] = {
+                "requests": len(latencies),
+                "throughput": len(latencies) / elapsed,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "max_ms": latencies[-1] * 1000,
+                "errors": errors,
+                "error_rate": errors / len(latencies),
+                "error_reasons": dict(self.errors[name]),
+            }
+        total = sum(url["requests"] for url in urls.values())
+        errors = sum(url["errors"] for url in urls.values())
+        return {
+            "duration": elapsed,
+            "requests": total,
+            "throughput": total / elapsed if elapsed else 0,
+            "errors": errors,
+            "error_rate": errors / total if total else 0,
+            "urls": urls,
+        }
+
+
+class Teacher:
+    """One simulated teacher, run in a thread of its own."""
+
+    def __init__(self, number, load_test):
+        self.number = number
+        self.test = load_test
+        self.client = load_test.client_factory()
+        self.token = f"loadtest-{load_test.run_id}-{number}"
+        self.classroom_id = self.assignment_id = None
+        self.students = iter(range(number + 1, load_test.students + 1, load_test.teachers))
+
+    def call(self, view, method="GET", data=None, expect=None, **kwargs):
+        name = view.split(":")[-1] + (" (POST)" if method == "POST" else "")
+        start = time.perf_counter()
+        try:
+            response = self.client.request(method, reverse(view, kwargs=kwargs or None), data)
+        except Exception as e:  # connection errors, timeouts
+            self.test.stats.add(name, time.perf_counter() - start, type(e).__name__)
+            return None
+        duration = time.perf_counter() - start
+        message = ERROR_MESSAGE.search(response.text)
+        if response.status >= 400:
+            error = f"HTTP {response.status}"
+        elif message:
+            error = f"error message: {message.group(1).strip()}"  # without the details after a colon
+        elif expect and response.status not in expect:
+            error = f"HTTP {response.status}, expected {'/'.join(map(str, expect))}"
+        else:
+            error = None
+        self.test.stats.add(name, duration, error)
+        return None if error else response
+
+    def think(self):
+        if self.test.think_time:
+            time.sleep(random.uniform(0, self.test.think_time))
+
+    def run(self):
+        try:
+            if self.setup():
+                actions = [self.browse] * 6 + [self.add_student] * 2 + [self.fork]
+                for _ in range(self.test.iterations):
+                    self.think()
+                    random.choice(actions)()
+        finally:
+            self.client.close()
+
+    def setup(self):
+        self.call("accounts:login")
+        if not self.call("accounts:login", "POST", {"access_token": self.token}, expect={302}):
+            return False
+        self.think()
+        self.call("gitlab_classroom:classroom-create")
+        if not self.call("gitlab_classroom:classroom-create", "POST", {
+            "title": f"Load test {self.test.run_id} {self.number}",
+            "description": "Created by the load test",
+            "organization": "Load test",
+        }, expect={302}):
+            return False
+        # the teacher's own classrooms, newest first
+        response = self.call("gitlab_classroom:classroom-list")
+        match = response and CLASSROOM_LINK.search(response.text)
+        if not match:
+            return False
+        self.classroom_id = int(match.group(1))
+
+        #the page reloads itself until the worker has created the GitLab groups
+        deadline = time.monotonic() + SETUP_TIMEOUT
+        while True:
+            response = self.call("gitlab_classroom:classroom-detail", pk=self.classroom_id)
+            if response and "location.reload" not in response.text:
+                break
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(1)
+
+        self.think()
+        self.call("gitlab_classroom:assignment-create", pk=self.classroom_id)
+        deadline = (timezone.now() + timedelta(days=14)).strftime("%Y-%m-%dT%H:%M")
+        if not self.call("gitlab_classroom:assignment-create", "POST", {
+            "title": f"Lab {self.test.run_id} {self.number}",  # titles are unique
+            "description": "Created by the load test",
+            "deadline": deadline,
+        }, expect={302}, pk=self.classroom_id):
+            return False
+        response = self.call("gitlab_classroom:assignment-list")
+        match = response and ASSIGNMENT_LINK.search(response.text)
+        if not match:
+            return False
+        self.assignment_id = int(match.group(1))
+        return True
+
+    def browse(self):
+        view, data, kwargs = random.choice([
+            ("gitlab_classroom:index", None, {}),
+            ("gitlab_classroom:classroom-list", None, {}),
+            ("gitlab_classroom:assignment-list", None, {}),
+            ("gitlab_classroom:student-list", None, {}),
+            ("gitlab_classroom:student-list", {"page": "last"}, {}),
+            ("gitlab_classroom:student-autocomplete", {"q": "student1"}, {}),
+            ("gitlab_classroom:classroom-detail", None, {"pk": self.classroom_id}),
+            ("gitlab_classroom:assignment-detail", None, {"pk": self.assignment_id}),
+        ])
+        self.call(view, data=data, **kwargs)
+
+    def add_student(self):
+        number = next(self.students, None)
+        if number is None:
+            return self.browse()  # every student of this teacher was added
+        username = f"student{number}"
+        self.call("gitlab_classroom:student-create")
+        #already there if an earlier run created it, which is fine
+        self.call("gitlab_classroom:student-create", "POST", {
+            "gitlab_username": username,
+            "first_name": f"First{number}",
+            "second_name": f"Second{number}",
+            "student_id": str(400000 + number),
+            "email": f"{username}@example.com",
+        })
+        response = self.call("gitlab_classroom:student-autocomplete",
+                             data={"q": username, "classroom": self.classroom_id})
+        if not response:
+            return
+        ids = [result["id"] for result in json.loads(response.text)["results"]
+               if result["text"].startswith(f"{username} ")]
+        if ids:
+            self.think()
+            self.call("gitlab_classroom:classroom-detail", "POST", {"add_student": "", "students": ids[0]},
+                      expect={302}, pk=self.classroom_id)
+
+    def fork(self):
+        if not self.test.template_id:
+            return self.browse()
+        self.call("gitlab_classroom:assignment-detail", "POST", {"gitlab_template_id": self.test.template_id},
+                  expect={302}, pk=self.assignment_id)
+
+
+class LoadTest:
+    """``teachers`` teachers doing ``iterations`` actions each after setting up.
+
+    ``ramp_up`` spreads their logins over that many seconds instead of
+    starting them all at once. With ``workers`` above 0 queued GitLab jobs are
+    processed by that many threads of this process, for in-process runs.
+    """
+
+    def __init__(self, client_factory, teachers=10, iterations=20, think_time=1.0, ramp_up=0,
+                 template_id=None, students=100, workers=0):
+        self.client_factory = client_factory
+        self.teachers = teachers
+        self.iterations = iterations
+        self.think_time = think_time
+        self.ramp_up = ramp_up
+        self.template_id = template_id
+        self.students = students
+        self.workers = workers
+        self.run_id = uuid.uuid4().hex[:8]
+        self.stats = Stats()
+
+    def start_teacher(self, number):
+        time.sleep(self.ramp_up * number / self.teachers)
+        Teacher(number, self).run()
+
+    def work(self, name, stop):
+        try:
+            while not (jobs.run_pending(name) == 0 and stop.is_set()):
+                time.sleep(0.2)
+        finally:
+            connections.close_all()
+
+    def run(self):
+        started_at = timezone.now()
+        start = time.perf_counter()
+        stop = threading.Event()
+        workers = [threading.Thread(target=self.work, args=(f"loadtest-{i}", stop), daemon=True)
+                   for i in range(self.workers)]
+        teachers = [threading.Thread(target=self.start_teacher, args=(i,), daemon=True)
+                    for i in range(self.teachers)]
+        for thread in workers + teachers:
+            thread.start()
+        for thread in teachers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for thread in workers:
+            thread.join()  # the jobs queued last still count, but not in the throughput
+
+        report = self.stats.report(elapsed)
+        report["teachers"] = self.teachers
+        if self.workers:
+            report["jobs"] = dict(Counter(GitlabJob.objects.filter(creation_date__gte=started_at)
+                                          .values_list("status", flat=True)))
+        return report
+
+
+@contextmanager
+def fake_gitlab(students=100, faults=None):
+    """Run the block against a fake GitLab with ``students`` student users.
+
+    Yields the fake and the ID of a template project to fork.
+    """
+    with FakeGitlab(faults=faults) as fake:
+        for i in range(1, students + 1):
+            fake.add_user(f"student{i}")
+        templates = fake.add_group("templates")
+        template = fake.add_project("template", namespace_id=templates["id"])
+        fake.add_commit(template["id"], "Initial commit")
+        with override_settings(GITLAB_URL=fake.url):
+            yield fake, template["id"]
@@ -0,0 +1,41 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from gitlab_classroom.gitlab_client import get_client
+from gitlab_classroom.groups import resolve_subgroup_ids
+from gitlab_classroom.models import Classroom
+
+
+class Command(BaseCommand):
+    help = "Store the MEMBERS/ASSIGNMENTS subgroup ids of classrooms created before they were kept locally."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--token", default=os.environ.get("GITLAB_TOKEN"),
+                            help="GitLab access token able to read the classroom groups "
+                                 "(defaults to the GITLAB_TOKEN environment variable).")
+        parser.add_argument("--all", action="store_true",
+                            help="Resolve the ids again for every classroom, not only the missing ones.")
+
+    def handle(self, *args, **options):
+        if not options["token"]:
+            raise CommandError("A GitLab access token is required (--token or GITLAB_TOKEN).")
+        gl = get_client(options["token"])
+
+        classrooms = Classroom.objects.exclude(gitlab_id=0)
+        if not options["all"]:
+            classrooms = classrooms.filter(Q(members_gitlab_id=0) | Q(assignments_gitlab_id=0))
+
+        updated = failed = 0
+        for classroom in classrooms.iterator():
+            try:
+                ids = resolve_subgroup_ids(gl, classroom)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"{classroom.title}: {e}")
+                continue
+            updated += 1
+            self.stdout.write(f"{classroom.title}: members={ids['members_gitlab_id']} "
+                              f"assignments={ids['assignments_gitlab_id']}")
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} classroom(s), {failed} failed."))
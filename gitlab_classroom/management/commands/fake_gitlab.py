@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from gitlab_classroom.fake_gitlab import FakeGitlab, Faults
+
+
+def endpoint_values(values, option):
+    parsed = {}
+    for value in values:
+        endpoint, _, number = value.rpartition("=")
+        try:
+            parsed[endpoint.strip() or "*"] = float(number)
+        except ValueError:
+            raise CommandError(f"{option} expects ENDPOINT=NUMBER, e.g. \"POST projects/:id/fork=0.2\", not {value!r}.")
+    return parsed
+
+
+class Command(BaseCommand):
+    help = "Serve an in-memory fake of the GitLab API for offline load tests and benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8081)
+        parser.add_argument("--students", type=int, default=100,
+                            help="Number of student users (student1, student2, ...) to create.")
+        parser.add_argument("--latency", type=float, default=0.0,
+                            help="Seconds added to every call.")
+        parser.add_argument("--endpoint-latency", action="append", default=[], metavar="ENDPOINT=SECONDS",
+                            help="Latency of one endpoint, e.g. \"POST projects/:id/fork=0.5\". Repeatable.")
+        parser.add_argument("--error-rate", action="append", default=[], metavar="ENDPOINT=PROBABILITY",
+                            help="Share of calls failing, \"*=0.01\" for every endpoint. Repeatable.")
+        parser.add_argument("--error-status", type=int, default=500)
+        parser.add_argument("--rate-limit", type=int, default=0,
+                            help="Calls per minute and token before answering 429, 0 for no limit.")
+        parser.add_argument("--strict-tokens", action="store_true",
+                            help="Reject tokens that weren't seeded instead of creating a user for them.")
+
+    def handle(self, *args, **options):
+        faults = Faults(latency=options["latency"],
+                        endpoint_latency=endpoint_values(options["endpoint_latency"], "--endpoint-latency"),
+                        error_rate=endpoint_values(options["error_rate"], "--error-rate"),
+                        error_status=options["error_status"],
+                        rate_limit=options["rate_limit"])
+        fake = FakeGitlab(options["host"], options["port"], faults=faults, strict_tokens=options["strict_tokens"])
+        for i in range(1, options["students"] + 1):
+            fake.add_user(f"student{i}")
+        templates = fake.add_group("templates")
+        template = fake.add_project("template", namespace_id=templates["id"])
+        fake.add_commit(template["id"], "Initial commit")
+
+        self.stdout.write(f"Fake GitLab listening on {fake.url} with {options['students']} students.")
+        self.stdout.write(f"Template project id: {template['id']}")
+        self.stdout.write(f"Point the app at it with GITLAB_URL={fake.url}")
+        try:
+            fake.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            fake.server.server_close()
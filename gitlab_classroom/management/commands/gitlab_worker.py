@@ -0,0 +1,62 @@
+import multiprocessing
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+
+def work(worker_name, poll_interval, once):
+    # spawned processes (Windows, macOS) start without a configured Django
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    from gitlab_classroom import jobs, webhooks
+
+    while True:
+        processed = jobs.run_pending(worker_name) + webhooks.process_pending(worker_name)
+        if once:
+            return processed
+        if not processed:
+            time.sleep(poll_interval)
+
+
+class Command(BaseCommand):
+    help = "Process queued GitLab jobs (group creation, deletion, forking) and webhook events."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=1,
+                            help="Number of worker processes to start.")
+        parser.add_argument("--poll-interval", type=float, default=2.0,
+                            help="Seconds to wait before polling an empty queue again.")
+        parser.add_argument("--once", action="store_true",
+                            help="Process the jobs that are queued now and exit.")
+
+    def handle(self, *args, **options):
+        base_name = f"{socket.gethostname()}-{os.getpid()}"
+        processes = max(1, options["processes"])
+        if processes == 1:
+            processed = work(base_name, options["poll_interval"], options["once"])
+            if options["once"]:
+                self.stdout.write(self.style.SUCCESS(f"Processed {processed} job(s)."))
+            return
+
+        # children must open their own database connections
+        from django.db import connections
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=work,
+                                    args=(f"{base_name}-{i}", options["poll_interval"], options["once"]),
+                                    daemon=True)
+            for i in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Started {processes} GitLab worker processes.")
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
@@ -0,0 +1,31 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gitlab_classroom.gitlab_client import get_client
+from gitlab_classroom.roster import import_roster
+
+
+class Command(BaseCommand):
+    help = "Import students from a CSV roster (username, first_name, second_name, email, student_id)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Path of the CSV file.")
+        parser.add_argument("--token", default=os.environ.get("GITLAB_TOKEN"),
+                            help="GitLab access token used to look the users up "
+                                 "(defaults to the GITLAB_TOKEN environment variable).")
+        parser.add_argument("--chunk-size", type=int, default=None,
+                            help="Rows written per bulk insert.")
+
+    def handle(self, *args, **options):
+        if not options["token"]:
+            raise CommandError("A GitLab access token is required (--token or GITLAB_TOKEN).")
+        gl = get_client(options["token"])
+        try:
+            with open(options["path"], encoding="utf-8-sig", newline="") as roster:
+                report = import_roster(gl, roster, chunk_size=options["chunk_size"])
+        except OSError as e:
+            raise CommandError(str(e))
+        if report.invalid_rows:
+            self.stderr.write("Invalid rows on lines: " + ", ".join(map(str, report.invalid_rows)))
+        self.stdout.write(self.style.SUCCESS(report.summary()))
@@ -0,0 +1,83 @@
+import json
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gitlab_classroom.fake_gitlab import Faults
+from gitlab_classroom.loadtest import LoadTest, InProcessClient, HttpClient, fake_gitlab
+from gitlab_classroom.management.commands.fake_gitlab import endpoint_values
+
+
+class Command(BaseCommand):
+    help = ("Simulate teachers logging in, browsing, adding students and forking at the same time, "
+            "and report throughput, latency percentiles and error rates per URL name. "
+            "Without --url the app runs in this process against a fake GitLab and writes "
+            "to the configured database, so point it at a scratch one.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--teachers", type=int, default=10)
+        parser.add_argument("--iterations", type=int, default=20,
+                            help="Actions of every teacher after it has set up its classroom.")
+        parser.add_argument("--think-time", type=float, default=1.0,
+                            help="Maximum seconds a teacher waits between actions.")
+        parser.add_argument("--ramp-up", type=float, default=0,
+                            help="Seconds over which the teachers log in, 0 for all at once.")
+        parser.add_argument("--url",
+                            help="Load test a running deployment, e.g. http://127.0.0.1:8000. It must use a "
+                                 "fake GitLab (manage.py fake_gitlab) and have gitlab_worker running.")
+        parser.add_argument("--template-id", type=int,
+                            help="Project the teachers fork, printed by fake_gitlab. Needed with --url.")
+        parser.add_argument("--students", type=int, default=100,
+                            help="Student users (student1, student2, ...) the fake GitLab has.")
+        parser.add_argument("--workers", type=int, default=2,
+                            help="Threads processing queued GitLab jobs, without --url.")
+        parser.add_argument("--latency", type=float, default=0.0,
+                            help="Seconds the fake GitLab adds to every call, without --url.")
+        parser.add_argument("--endpoint-latency", action="append", default=[], metavar="ENDPOINT=SECONDS")
+        parser.add_argument("--error-rate", action="append", default=[], metavar="ENDPOINT=PROBABILITY")
+        parser.add_argument("--json", metavar="FILE", help="Also write the report to FILE as JSON.")
+
+    def handle(self, *args, **options):
+        if options["teachers"] < 1:
+            raise CommandError("--teachers must be at least 1.")
+        if options["url"]:
+            if not options["template_id"]:
+                self.stderr.write("No --template-id given, the teachers won't fork.")
+            environment = nullcontext((None, options["template_id"]))
+            client_factory = lambda: HttpClient(options["url"])
+            workers = 0
+        else:
+            faults = Faults(latency=options["latency"],
+                            endpoint_latency=endpoint_values(options["endpoint_latency"], "--endpoint-latency"),
+                            error_rate=endpoint_values(options["error_rate"], "--error-rate"))
+            environment = fake_gitlab(options["students"], faults)
+            client_factory = InProcessClient
+            workers = options["workers"]
+
+        with environment as (fake, template_id):
+            load_test = LoadTest(client_factory, teachers=options["teachers"], iterations=options["iterations"],
+                                 think_time=options["think_time"], ramp_up=options["ramp_up"],
+                                 template_id=template_id, students=options["students"], workers=workers)
+            self.stdout.write(f"Running {options['teachers']} teachers"
+                              + (f" against {options['url']}" if options["url"] else f", fake GitLab at {fake.url}"))
+            report = load_test.run()
+
+        self.write_report(report)
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump(report, f, indent=2)
+
+    def write_report(self, report):
+        self.stdout.write(f"\n{'URL name':<32}{'requests':>9}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}"
+                          f"{'p99 ms':>9}{'errors':>9}")
+        for name, url in report["urls"].items():
+            self.stdout.write(f"{name:<32}{url['requests']:>9}{url['throughput']:>8.1f}{url['p50_ms']:>9.0f}"
+                              f"{url['p95_ms']:>9.0f}{url['p99_ms']:>9.0f}{url['error_rate']:>9.1%}")
+        self.stdout.write(f"\n{report['requests']} requests in {report['duration']:.1f}s, "
+                          f"{report['throughput']:.1f} req/s, {report['error_rate']:.1%} errors.")
+        for name, url in report["urls"].items():
+            for reason, count in url["error_reasons"].items():
+                self.stdout.write(self.style.ERROR(f"  {name}: {count} x {reason}"))
+        if "jobs" in report:
+            self.stdout.write("GitLab jobs: " + ", ".join(f"{count} {status}"
+                                                          for status, count in sorted(report["jobs"].items())))
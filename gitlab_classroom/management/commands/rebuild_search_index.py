@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from gitlab_classroom import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of students, classrooms and assignments."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        backend = search.get_backend(options["database"])
+        search.rebuild(options["database"])
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt ({type(backend).__name__})."))
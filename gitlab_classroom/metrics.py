@@ -0,0 +1,96 @@
+"""Prometheus metrics of the views, GitLab calls and background jobs.
+
+``/metrics`` serves them in the Prometheus text format. When several processes
+serve the app (gunicorn workers, the GitLab worker's processes) every process
+has to write its samples to files in a shared directory, which ``/metrics``
+then adds up: set the ``PROMETHEUS_MULTIPROC_DIR`` environment variable to an
+empty directory before starting them, and clear it on every deploy.
+"""
+import os
+import time
+from contextlib import ExitStack
+from urllib.parse import urlsplit
+
+from django.db import connections
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+                               CONTENT_TYPE_LATEST, generate_latest, multiprocess)
+
+
+REQUEST_LATENCY = Histogram(
+    "gitlab_classroom_request_duration_seconds", "Time spent serving a request.",
+    ["view", "method", "status"],
+)
+REQUEST_QUERIES = Histogram(
+    "gitlab_classroom_request_db_queries", "SQL queries run while serving a request.",
+    ["view"], buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+GITLAB_CALLS = Counter(
+    "gitlab_classroom_gitlab_calls_total", "GitLab API calls made.",
+    ["method", "endpoint", "status"],
+)
+GITLAB_LATENCY = Histogram(
+    "gitlab_classroom_gitlab_call_duration_seconds", "Duration of GitLab API calls.",
+    ["method", "endpoint", "status"],
+)
+GITLAB_RATELIMIT_REMAINING = Gauge(
+    "gitlab_classroom_gitlab_ratelimit_remaining", "RateLimit-Remaining of the last GitLab response.",
+    ["instance"], multiprocess_mode="mostrecent",
+)
+JOBS = Counter(
+    "gitlab_classroom_jobs_total", "GitLab jobs run by the worker.",
+    ["kind", "status"],
+)
+JOB_DURATION = Histogram(
+    "gitlab_classroom_job_duration_seconds", "Time spent running a GitLab job.",
+    ["kind"], buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+
+
+def observe_gitlab_call(call, url, response=None):
+    GITLAB_CALLS.labels(call.method, call.endpoint, call.status).inc()
+    GITLAB_LATENCY.labels(call.method, call.endpoint, call.status).observe(call.duration)
+    remaining = response.headers.get("RateLimit-Remaining") if response is not None else None
+    if remaining is not None and remaining.isdigit():
+        GITLAB_RATELIMIT_REMAINING.labels(urlsplit(url).netloc).set(int(remaining))
+
+
+def observe_job(job, duration):
+    JOBS.labels(job.kind, job.status).inc()
+    JOB_DURATION.labels(job.kind).observe(duration)
+
+
+def render():
+    """Return ``(body, content type)`` of the metrics of every process."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+        REQUEST_LATENCY.labels(view, request.method, response.status_code).observe(time.perf_counter() - start)
+        REQUEST_QUERIES.labels(view).observe(counter.count)
+        return response
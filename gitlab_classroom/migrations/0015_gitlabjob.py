@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitlab_classroom', '0014_alter_classroom_teacher'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GitlabJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('create_classroom', 'Create classroom groups'), ('delete_group', 'Delete group'), ('fork_projects', 'Fork projects')], max_length=50)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('access_token', models.CharField(blank=True, max_length=255)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('result', models.JSONField(blank=True, default=dict)),
+                ('progress_done', models.PositiveIntegerField(default=0)),
+                ('progress_total', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('worker', models.CharField(blank=True, max_length=255)),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('assignment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='gitlab_job', to='gitlab_classroom.assignment')),
+                ('classroom', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='gitlab_job', to='gitlab_classroom.classroom')),
+                ('teacher', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gitlab_job', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-creation_date'],
+                'indexes': [models.Index(fields=['status', 'creation_date'], name='gitlab_clas_status_a9d0eb_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitlab_classroom', '0015_gitlabjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classroom',
+            name='assignments_gitlab_id',
+            field=models.IntegerField(blank=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='classroom',
+            name='members_gitlab_id',
+            field=models.IntegerField(blank=True, default=0),
+        ),
+    ]
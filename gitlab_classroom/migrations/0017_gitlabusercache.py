@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitlab_classroom', '0016_classroom_subgroup_ids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GitlabUserCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=255, unique=True)),
+                ('gitlab_id', models.CharField(blank=True, max_length=255)),
+                ('state', models.CharField(max_length=50)),
+                ('last_verified', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['username'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='gitlabjob',
+            name='kind',
+            field=models.CharField(choices=[('create_classroom', 'Create classroom groups'), ('delete_group', 'Delete group'), ('fork_projects', 'Fork projects'), ('refresh_users', 'Refresh GitLab users')], max_length=50),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:25
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitlab_classroom', '0017_gitlabusercache'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(django.db.models.functions.text.Lower('gitlab_username'), name='student_username_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(django.db.models.functions.text.Lower('first_name'), name='student_first_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(django.db.models.functions.text.Lower('second_name'), name='student_second_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['student_id'], name='student_student_id_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitlab_classroom', '0018_student_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(fields=['teacher', '-creation_date', '-id'], name='assignment_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='classroom',
+            index=models.Index(fields=['teacher', '-creation_date', '-id'], name='classroom_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['-first_name', '-id'], name='student_keyset_idx'),
+        ),
+    ]
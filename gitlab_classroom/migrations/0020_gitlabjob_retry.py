@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitlab_classroom', '0019_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gitlabjob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='gitlabjob',
+            name='run_after',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='gitlabjob',
+            name='kind',
+            field=models.CharField(choices=[('create_classroom', 'Create classroom groups'), ('delete_group', 'Delete group'), ('fork_projects', 'Fork projects'), ('refresh_users', 'Refresh GitLab users'), ('sync_group', 'Update GitLab group')], max_length=50),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitlab_classroom', '0020_gitlabjob_retry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='submissions_collected_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='gitlabjob',
+            name='kind',
+            field=models.CharField(choices=[('create_classroom', 'Create classroom groups'), ('delete_group', 'Delete group'), ('fork_projects', 'Fork projects'), ('refresh_users', 'Refresh GitLab users'), ('sync_group', 'Update GitLab group'), ('collect_submissions', 'Collect submissions')], max_length=50),
+        ),
+        migrations.CreateModel(
+            name='Submission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('project_id', models.IntegerField()),
+                ('commit_sha', models.CharField(blank=True, max_length=64)),
+                ('commit_date', models.DateTimeField(blank=True, null=True)),
+                ('pipeline_status', models.CharField(blank=True, max_length=20)),
+                ('last_activity_at', models.DateTimeField(blank=True, null=True)),
+                ('collected_at', models.DateTimeField(auto_now=True)),
+                ('assignment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='submission', to='gitlab_classroom.assignment')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='submission', to='gitlab_classroom.student')),
+            ],
+            options={
+                'ordering': ['student__gitlab_username'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='submission',
+            constraint=models.UniqueConstraint(fields=('assignment', 'student'), name='submission_unique_student'),
+        ),
+    ]
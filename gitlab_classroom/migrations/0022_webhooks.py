@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitlab_classroom', '0021_submission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='webhook_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='pipeline_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True)),
+                ('kind', models.CharField(choices=[('push', 'Push'), ('pipeline', 'Pipeline')], max_length=20)),
+                ('payload', models.JSONField()),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('worker', models.CharField(blank=True, max_length=255)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('assignment', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='webhook_event', to='gitlab_classroom.assignment')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['worker', 'id'], name='webhook_event_queue_idx')],
+            },
+        ),
+    ]
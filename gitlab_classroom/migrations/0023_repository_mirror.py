@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitlab_classroom', '0022_webhooks'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='gitlabjob',
+            name='kind',
+            field=models.CharField(choices=[('create_classroom', 'Create classroom groups'), ('delete_group', 'Delete group'), ('fork_projects', 'Fork projects'), ('refresh_users', 'Refresh GitLab users'), ('sync_group', 'Update GitLab group'), ('collect_submissions', 'Collect submissions'), ('mirror_repositories', 'Mirror repositories')], max_length=50),
+        ),
+        migrations.CreateModel(
+            name='RepositoryMirror',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('project_id', models.IntegerField()),
+                ('url', models.CharField(max_length=2048)),
+                ('head_sha', models.CharField(blank=True, max_length=64)),
+                ('size_bytes', models.BigIntegerField(default=0)),
+                ('fetched_at', models.DateTimeField(blank=True, null=True)),
+                ('used_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('assignment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mirror', to='gitlab_classroom.assignment')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mirror', to='gitlab_classroom.student')),
+            ],
+            options={
+                'ordering': ['student__gitlab_username'],
+                'indexes': [models.Index(fields=['used_at'], name='mirror_used_at_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='repositorymirror',
+            constraint=models.UniqueConstraint(fields=('assignment', 'student'), name='mirror_unique_student'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitlab_classroom', '0023_repository_mirror'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='fingerprint_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='fingerprint_sha',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='gitlabjob',
+            name='kind',
+            field=models.CharField(choices=[('create_classroom', 'Create classroom groups'), ('delete_group', 'Delete group'), ('fork_projects', 'Fork projects'), ('refresh_users', 'Refresh GitLab users'), ('sync_group', 'Update GitLab group'), ('collect_submissions', 'Collect submissions'), ('mirror_repositories', 'Mirror repositories'), ('check_similarity', 'Check similarity')], max_length=50),
+        ),
+        migrations.CreateModel(
+            name='Fingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.BigIntegerField()),
+                ('assignment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint', to='gitlab_classroom.assignment')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fingerprint', to='gitlab_classroom.student')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SimilarPair',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shared', models.IntegerField()),
+                ('score', models.FloatField()),
+                ('assignment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_pair', to='gitlab_classroom.assignment')),
+                ('student_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='gitlab_classroom.student')),
+                ('student_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='gitlab_classroom.student')),
+            ],
+            options={
+                'ordering': ['-score', '-shared'],
+                'indexes': [models.Index(fields=['assignment', '-score'], name='similar_pair_rank_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='similarpair',
+            constraint=models.UniqueConstraint(fields=('assignment', 'student_a', 'student_b'), name='similar_pair_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='fingerprint',
+            index=models.Index(fields=['assignment', 'hash'], name='fingerprint_hash_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fingerprint',
+            index=models.Index(fields=['assignment', 'student'], name='fingerprint_student_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:23
+
+from django.db import migrations, models
+
+
+def set_lower_fields(apps, schema_editor):
+    Student = apps.get_model('gitlab_classroom', 'Student')
+    students = list(Student.objects.all())
+    for student in students:
+        student.gitlab_username_lower = student.gitlab_username.lower()
+        student.first_name_lower = student.first_name.lower()
+        student.second_name_lower = student.second_name.lower()
+    Student.objects.bulk_update(students, ['gitlab_username_lower', 'first_name_lower', 'second_name_lower'],
+                                batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gitlab_classroom', '0024_similarity'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='student',
+            name='student_username_lower_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='student',
+            name='student_first_name_lower_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='student',
+            name='student_second_name_lower_idx',
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='first_name_lower',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='gitlab_username_lower',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='student',
+            name='second_name_lower',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.RunPython(set_lower_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['gitlab_username_lower'], name='student_username_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['first_name_lower'], name='student_first_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['second_name_lower'], name='student_second_name_lower_idx'),
+        ),
+    ]
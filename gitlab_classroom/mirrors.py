@@ -0,0 +1,177 @@
+"""Local bare mirrors of the students' forks, for anything that analyses their code.
+
+Every fork of an assignment with a recorded submission gets a bare repository
+at ``MIRROR_DIR/<assignment id>/<project id>.git`` holding its branches and
+tags, tracked by a :class:`RepositoryMirror`. :func:`sync` brings the mirrors
+of an assignment up to date with ``git fetch``, which only transfers what the
+mirror doesn't have yet, and only for the forks that were active since they
+were last fetched (``Submission.last_activity_at``), so syncing a course that
+hardly changed runs no git at all. The fetches run in a pool of
+``MIRROR_PROCESSES`` processes (see gitrepo.py).
+
+After every sync the least recently used mirrors (see :func:`use`) are
+removed until all of them fit in ``MIRROR_MAX_BYTES``; they are fetched in
+full again the next time they are needed.
+
+A mirror's remote can be any URL git understands, ``file://`` ones included.
+Forks of GitLab projects are mirrored from their ``http_url_to_repo`` with
+the teacher's token.
+"""
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+import gitlab
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from gitlab_classroom import gitrepo
+from gitlab_classroom.breaker import GitlabUnavailable
+from gitlab_classroom.forking import instance_limit
+from gitlab_classroom.instrumentation import propagate
+from gitlab_classroom.models import Assignment, RepositoryMirror
+
+
+@dataclass
+class SyncReport:
+    fetched: int = 0
+    up_to_date: int = 0
+    evicted: int = 0
+    failed: list = field(default_factory=list)  # (username, reason)
+
+    def summary(self):
+        return (f"{self.fetched} repositories fetched, {self.up_to_date} up to date, "
+                f"{len(self.failed)} failed.")
+
+
+def mirror_path(mirror):
+    return os.path.join(settings.MIRROR_DIR, str(mirror.assignment_id), f"{mirror.project_id}.git")
+
+
+def use(mirror):
+    """Path of ``mirror``'s repository, marking it as recently used."""
+    touch([mirror])
+    return mirror_path(mirror)
+
+
+def touch(mirrors):
+    now = timezone.now()
+    for mirror in mirrors:
+        mirror.used_at = now
+    RepositoryMirror.objects.filter(pk__in=[mirror.pk for mirror in mirrors]).update(used_at=now)
+
+
+def remote_url(gl, project_id):
+    with instance_limit(gl.url):
+        return gl.projects.get(project_id).http_url_to_repo
+
+
+def add_forks(gl, assignment, report):
+    """Create the mirrors of submissions that have none, or whose fork was replaced."""
+    mirrors = {mirror.student_id: mirror for mirror in assignment.mirror.all()}
+    new = [submission for submission in assignment.submission.select_related("student").exclude(commit_sha="")
+           if submission.student_id not in mirrors or mirrors[submission.student_id].project_id != submission.project_id]
+    if not new:
+        return
+    for submission in new:
+        if submission.student_id in mirrors:  # the student forked again
+            shutil.rmtree(mirror_path(mirrors[submission.student_id]), ignore_errors=True)
+    created = []
+    with ThreadPoolExecutor(max_workers=min(settings.GITLAB_FORK_WORKERS, len(new))) as executor:
+        futures = {executor.submit(propagate(remote_url), gl, submission.project_id): submission
+                   for submission in new}
+        for future in as_completed(futures):
+            submission = futures[future]
+            try:
+                url = future.result()
+            except GitlabUnavailable:
+                raise
+            except gitlab.exceptions.GitlabError as e:
+                report.failed.append((submission.student.gitlab_username, e.error_message or str(e)))
+                continue
+            created.append(RepositoryMirror(student=submission.student, assignment=assignment,
+                                            project_id=submission.project_id, url=url))
+    RepositoryMirror.objects.bulk_create(created, update_conflicts=True, unique_fields=["assignment", "student"],
+                                         update_fields=["project_id", "url", "head_sha", "size_bytes", "fetched_at"])
+
+
+def stale(mirrors, assignment):
+    """The mirrors whose fork was active since they were last fetched, or that aren't on disk."""
+    activity = dict(assignment.submission.values_list("student_id", "last_activity_at"))
+    return [mirror for mirror in mirrors
+            if mirror.fetched_at is None or activity.get(mirror.student_id) is None
+            or activity[mirror.student_id] >= mirror.fetched_at or not os.path.isdir(mirror_path(mirror))]
+
+
+def fetch(mirrors, token=None, processes=None, report=None, on_progress=None):
+    """Fetch ``mirrors`` in a process pool and record the outcome."""
+    report = report or SyncReport()
+    if not mirrors:
+        return report
+    started = timezone.now()  # activity during the fetch makes the mirror stale again
+    processes = min(processes or settings.MIRROR_PROCESSES, len(mirrors))
+    #spawned, so that the processes don't inherit the worker's threads and connections
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(gitrepo.fetch, mirror_path(mirror), mirror.url, token,
+                                   settings.MIRROR_FETCH_TIMEOUT): mirror
+                   for mirror in mirrors}
+        for done, future in enumerate(as_completed(futures), start=1):
+            mirror = futures[future]
+            try:
+                mirror.head_sha, mirror.size_bytes = future.result()
+            except gitrepo.GitError as e:
+                mirror.error = str(e)
+                report.failed.append((mirror.student.gitlab_username, mirror.error))
+            else:
+                mirror.fetched_at = mirror.used_at = started
+                mirror.error = ""
+                report.fetched += 1
+            if on_progress:
+                on_progress(done, len(futures))
+    RepositoryMirror.objects.bulk_update(mirrors, ["head_sha", "size_bytes", "fetched_at", "used_at", "error"])
+    return report
+
+
+def evict(max_bytes, keep=()):
+    """Remove the least recently used mirrors until all of them take up at most ``max_bytes``.
+
+    The mirrors in ``keep`` stay, even if they don't fit. Returns how many were removed.
+    """
+    on_disk = RepositoryMirror.objects.filter(fetched_at__isnull=False)
+    total = on_disk.aggregate(total=Sum("size_bytes"))["total"] or 0
+    evicted = []
+    for mirror in on_disk.exclude(pk__in=keep).order_by("used_at").iterator():
+        if total <= max_bytes:
+            break
+        shutil.rmtree(mirror_path(mirror), ignore_errors=True)
+        total -= mirror.size_bytes
+        evicted.append(mirror.pk)
+    RepositoryMirror.objects.filter(pk__in=evicted).update(fetched_at=None, head_sha="", size_bytes=0)
+
+    #the mirrors of deleted assignments
+    if os.path.isdir(settings.MIRROR_DIR):
+        assignments = set(Assignment.objects.values_list("pk", flat=True))
+        for name in os.listdir(settings.MIRROR_DIR):
+            if name.isdigit() and int(name) not in assignments:
+                shutil.rmtree(os.path.join(settings.MIRROR_DIR, name), ignore_errors=True)
+    return len(evicted)
+
+
+def sync(assignment, gl=None, token=None, force=False, processes=None, on_progress=None):
+    """Bring the mirrors of ``assignment`` up to date and return a :class:`SyncReport`.
+
+    With ``gl`` mirrors are first added for the forks of new submissions;
+    ``force`` fetches every mirror, changed or not.
+    """
+    report = SyncReport()
+    if gl is not None:
+        add_forks(gl, assignment, report)
+    mirrors = list(assignment.mirror.select_related("student"))
+    changed = mirrors if force else stale(mirrors, assignment)
+    report.up_to_date = len(mirrors) - len(changed)
+    fetch(changed, token, processes, report, on_progress)
+    report.evicted = evict(settings.MIRROR_MAX_BYTES, keep=[mirror.pk for mirror in changed])
+    return report
@@ -1,9 +1,18 @@
 from django.db import models
+from django.db.models import F, Func, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 from gitlab_service import settings
 from django.urls import reverse
 
 
+def subquery_count(queryset):
+    #correlated COUNT(*) of a queryset filtered on an OuterRef, only computed for the rows actually fetched
+    count = queryset.order_by().annotate(count=Func(F("pk"), function="COUNT")).values("count")
+    return Coalesce(Subquery(count), 0)
+
+
 class Teacher(AbstractUser): #teacher database model
     gitlab_id = models.CharField(max_length=255, unique=True)
 
@@ -19,12 +28,39 @@ class Student(models.Model): #student database model
     email = models.EmailField()
     student_id = models.CharField(max_length=255, default="0")
     gl_flag = models.BooleanField(default=False)
+    #lowercased copies for the prefix search of the student autocomplete, set in save(): SQLite's LOWER() only
+    #knows ASCII, so "Łukasz" couldn't be found as "łuk"
+    gitlab_username_lower = models.CharField(max_length=255, blank=True, editable=False)
+    first_name_lower = models.CharField(max_length=100, blank=True, editable=False)
+    second_name_lower = models.CharField(max_length=100, blank=True, editable=False)
+
+    LOWER_FIELDS = {"gitlab_username": "gitlab_username_lower",
+                    "first_name": "first_name_lower",
+                    "second_name": "second_name_lower"}
 
     class Meta:
         ordering = ["-first_name"]
+        indexes = [ #prefix search of the student autocomplete
+            models.Index(fields=["gitlab_username_lower"], name="student_username_lower_idx"),
+            models.Index(fields=["first_name_lower"], name="student_first_name_lower_idx"),
+            models.Index(fields=["second_name_lower"], name="student_second_name_lower_idx"),
+            models.Index(fields=["student_id"], name="student_student_id_idx"),
+            models.Index(fields=["-first_name", "-id"], name="student_keyset_idx"), #cursor pagination
+        ]
 
     def __str__(self):
         return f"{self.gitlab_username} - {self.gitlab_id}"
+
+    def set_lower_fields(self):
+        #also called before bulk_create, which doesn't go through save()
+        for field, lower in self.LOWER_FIELDS.items():
+            setattr(self, lower, getattr(self, field).lower())
+
+    def save(self, *args, **kwargs):
+        self.set_lower_fields()
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], *self.LOWER_FIELDS.values()}
+        super().save(*args, **kwargs)
     
     def get_absolute_url(self):#getting the url
         return reverse("gitlab_classroom:student-detail", args=[str(self.id)])
@@ -36,6 +72,8 @@ class Classroom(models.Model): #classroom database model
     description = models.TextField()
     organization = models.CharField(max_length=255, blank=False)
     gitlab_id = models.IntegerField(default=0, blank=True)
+    members_gitlab_id = models.IntegerField(default=0, blank=True) #MEMBERS subgroup
+    assignments_gitlab_id = models.IntegerField(default=0, blank=True) #ASSIGNMENTS subgroup
     teacher = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE, 
@@ -45,6 +83,7 @@ class Classroom(models.Model): #classroom database model
 
     class Meta:#ordering
         ordering = ["-creation_date"]
+        indexes = [models.Index(fields=["teacher", "-creation_date", "-id"], name="classroom_keyset_idx")]
 
     def __str__(self):
         return self.title
@@ -61,6 +100,8 @@ class Assignment(models.Model): #assigment database model
     repo_url = models.URLField()
     gitlab_id = models.IntegerField(default=0, blank=True)
     students = models.ManyToManyField(Student, related_name="assignment")
+    submissions_collected_at = models.DateTimeField(null=True, blank=True) #start of the last complete submission sweep
+    webhook_id = models.IntegerField(null=True, blank=True) #group webhook reporting pushes and pipelines, see webhooks.py
     teacher = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -74,9 +115,264 @@ class Assignment(models.Model): #assigment database model
 
     class Meta:
         ordering = ['-creation_date']
+        indexes = [models.Index(fields=["teacher", "-creation_date", "-id"], name="assignment_keyset_idx")]
 
     def __str__(self):
         return self.title
     
     def get_absolute_url(self):#getting the url
         return reverse("gitlab_classroom:assignment-detail", args=[str(self.id)])
+
+
+class Submission(models.Model): #state of a student's fork at the deadline, see submissions.collect
+    PIPELINE_UNFINISHED = ["created", "waiting_for_resource", "preparing", "pending", "running", "scheduled"]
+
+    student = models.ForeignKey(
+        Student,
+        on_delete=models.CASCADE,
+        related_name="submission"
+        )
+    assignment = models.ForeignKey(
+        Assignment,
+        on_delete=models.CASCADE,
+        related_name="submission"
+        )
+    project_id = models.IntegerField()
+    commit_sha = models.CharField(max_length=64, blank=True) #last commit before the deadline, empty if none
+    commit_date = models.DateTimeField(null=True, blank=True)
+    pipeline_id = models.IntegerField(null=True, blank=True) #latest pipeline of that commit
+    pipeline_status = models.CharField(max_length=20, blank=True)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+    collected_at = models.DateTimeField(auto_now=True)
+    fingerprint_sha = models.CharField(max_length=64, blank=True) #commit the fingerprints in the index are of, see similarity.py
+    fingerprint_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ["student__gitlab_username"]
+        constraints = [models.UniqueConstraint(fields=["assignment", "student"], name="submission_unique_student")]
+
+    def __str__(self):
+        return f"{self.student} - {self.assignment}: {self.commit_sha[:8] or 'nothing'}"
+
+    @property
+    def pipeline_finished(self):
+        return self.pipeline_status not in self.PIPELINE_UNFINISHED
+
+
+class WebhookEvent(models.Model): #push or pipeline event received from GitLab, applied by the worker
+    PUSH = "push"
+    PIPELINE = "pipeline"
+    KIND_CHOICES = [
+        (PUSH, "Push"),
+        (PIPELINE, "Pipeline"),
+    ]
+
+    event_id = models.CharField(max_length=255, unique=True) #GitLab's idempotency key, deliveries are retried
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    assignment = models.ForeignKey(
+        Assignment,
+        on_delete=models.CASCADE,
+        db_constraint=False, #the receiver doesn't look the assignment up
+        related_name="webhook_event"
+        )
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    worker = models.CharField(max_length=255, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True) #by the worker, released if it never finishes
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [models.Index(fields=["worker", "id"], name="webhook_event_queue_idx")]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} - {self.event_id}"
+
+
+class RepositoryMirror(models.Model): #local bare repository of a student's fork, see mirrors.py
+    student = models.ForeignKey(
+        Student,
+        on_delete=models.CASCADE,
+        related_name="mirror"
+        )
+    assignment = models.ForeignKey(
+        Assignment,
+        on_delete=models.CASCADE,
+        related_name="mirror"
+        )
+    project_id = models.IntegerField()
+    url = models.CharField(max_length=2048) #git remote, without credentials
+    head_sha = models.CharField(max_length=64, blank=True) #HEAD when last fetched
+    size_bytes = models.BigIntegerField(default=0)
+    fetched_at = models.DateTimeField(null=True, blank=True) #start of the last fetch, None while not on disk
+    used_at = models.DateTimeField(null=True, blank=True) #mirrors used least recently are removed first
+    error = models.TextField(blank=True) #of the last fetch
+
+    class Meta:
+        ordering = ["student__gitlab_username"]
+        constraints = [models.UniqueConstraint(fields=["assignment", "student"], name="mirror_unique_student")]
+        indexes = [models.Index(fields=["used_at"], name="mirror_used_at_idx")]
+
+    def __str__(self):
+        return f"{self.student} - {self.assignment}: {self.head_sha[:8] or 'not fetched'}"
+
+
+class Fingerprint(models.Model): #winnowing fingerprint of a submission, the inverted index of similarity.py
+    assignment = models.ForeignKey(
+        Assignment,
+        on_delete=models.CASCADE,
+        related_name="fingerprint"
+        )
+    student = models.ForeignKey(
+        Student,
+        on_delete=models.CASCADE,
+        related_name="fingerprint"
+        )
+    hash = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["assignment", "hash"], name="fingerprint_hash_idx"),
+            models.Index(fields=["assignment", "student"], name="fingerprint_student_idx"),
+        ]
+
+
+class SimilarPair(models.Model): #two submissions of an assignment sharing fingerprints, see similarity.py
+    assignment = models.ForeignKey(
+        Assignment,
+        on_delete=models.CASCADE,
+        related_name="similar_pair"
+        )
+    student_a = models.ForeignKey(
+        Student,
+        on_delete=models.CASCADE,
+        related_name="+"
+        )
+    student_b = models.ForeignKey(
+        Student,
+        on_delete=models.CASCADE,
+        related_name="+"
+        )
+    shared = models.IntegerField() #fingerprints in common, without the ones most submissions have
+    score = models.FloatField() #shared fingerprints / fingerprints of the smaller submission
+
+    class Meta:
+        ordering = ["-score", "-shared"]
+        constraints = [models.UniqueConstraint(fields=["assignment", "student_a", "student_b"],
+                                               name="similar_pair_unique")]
+        indexes = [models.Index(fields=["assignment", "-score"], name="similar_pair_rank_idx")]
+
+    def __str__(self):
+        return f"{self.student_a} - {self.student_b}: {self.score:.0%}"
+
+
+class GitlabUserCache(models.Model): #gitlab username -> id resolutions shared by every teacher
+    MISSING = "missing" #no gitlab account with this username
+
+    username = models.CharField(max_length=255, unique=True)
+    gitlab_id = models.CharField(max_length=255, blank=True)
+    state = models.CharField(max_length=50) #gitlab user state (active, blocked, ...) or MISSING
+    last_verified = models.DateTimeField()
+
+    class Meta:
+        ordering = ["username"]
+
+    def __str__(self):
+        return f"{self.username} - {self.gitlab_id or self.state}"
+
+    @property
+    def is_missing(self):
+        return self.state == self.MISSING
+
+
+class GitlabJob(models.Model): #long-running gitlab operation processed by the worker command
+    CREATE_CLASSROOM = "create_classroom"
+    DELETE_GROUP = "delete_group"
+    FORK_PROJECTS = "fork_projects"
+    REFRESH_USERS = "refresh_users"
+    SYNC_GROUP = "sync_group"
+    COLLECT_SUBMISSIONS = "collect_submissions"
+    MIRROR_REPOSITORIES = "mirror_repositories"
+    CHECK_SIMILARITY = "check_similarity"
+    KIND_CHOICES = [
+        (CREATE_CLASSROOM, "Create classroom groups"),
+        (DELETE_GROUP, "Delete group"),
+        (FORK_PROJECTS, "Fork projects"),
+        (REFRESH_USERS, "Refresh GitLab users"),
+        (SYNC_GROUP, "Update GitLab group"),
+        (COLLECT_SUBMISSIONS, "Collect submissions"),
+        (MIRROR_REPOSITORIES, "Mirror repositories"),
+        (CHECK_SIMILARITY, "Check similarity"),
+    ]
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    teacher = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="gitlab_job"
+        )
+    classroom = models.ForeignKey(
+        Classroom,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="gitlab_job"
+        )
+    assignment = models.ForeignKey(
+        Assignment,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="gitlab_job"
+        )
+    access_token = models.CharField(max_length=255, blank=True) #cleared once the job has finished
+    payload = models.JSONField(default=dict, blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    progress_done = models.PositiveIntegerField(default=0)
+    progress_total = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=255, blank=True)
+    creation_date = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    run_after = models.DateTimeField(null=True, blank=True) #not run before, e.g. put back in the queue while GitLab was down
+    attempts = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["-creation_date"]
+        indexes = [models.Index(fields=["status", "creation_date"])]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} - {self.status}"
+
+    @property
+    def scheduled(self):
+        #waiting for its time, e.g. the next submission sweep, nothing to watch until then
+        return self.status == self.QUEUED and self.run_after is not None and self.run_after > timezone.now()
+
+    @property
+    def is_active(self):
+        return self.status in (self.QUEUED, self.RUNNING) and not self.scheduled
+
+    @property
+    def progress_percent(self):
+        if not self.progress_total:
+            return 100 if self.status == self.DONE else 0
+        return int(100 * self.progress_done / self.progress_total)
+
+    def set_progress(self, done, total):
+        #update only the counters so concurrent writers don't overwrite each other
+        self.progress_done, self.progress_total = done, total
+        GitlabJob.objects.filter(pk=self.pk).update(progress_done=done, progress_total=total)
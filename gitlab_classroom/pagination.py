@@ -0,0 +1,171 @@
+"""Keyset (cursor) pagination for the list views.
+
+Django's paginator reads a page with ``OFFSET`` and counts the whole result
+with ``COUNT(*)``, so deep pages get slower the further they are. With
+``LIST_PAGINATION = "cursor"`` the list views instead continue from the
+ordering values of the last (or first) row shown, which the database finds
+through an index whatever the page. ``PAGINATION_EXACT_COUNT = False`` also
+skips the ``COUNT(*)``.
+
+A cursor is the url-safe base64 of ``[direction, value, value, ...]`` where
+the values are the row's values of the ordering fields, the last of which
+must be unique (``id``) so that the order is total.
+"""
+import base64
+import datetime
+import json
+from collections.abc import Sequence
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404
+
+
+NEXT = "n"
+PREVIOUS = "p"
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder cuts datetimes to milliseconds, which would skip or repeat rows
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(direction, values):
+    data = json.dumps([direction] + list(values), cls=CursorEncoder, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        direction, values = data[0], data[1:]
+    except (ValueError, TypeError, IndexError):
+        raise InvalidCursor(cursor)
+    if direction not in (NEXT, PREVIOUS):
+        raise InvalidCursor(cursor)
+    return direction, values
+
+
+class KeysetPage(Sequence):
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next:
+            return self.paginator.cursor_for(NEXT, self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous:
+            return self.paginator.cursor_for(PREVIOUS, self.object_list[0])
+        return None
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, per_page, ordering, count=True):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = list(ordering)
+        self.fields = [field.lstrip("-") for field in self.ordering]
+        self.exact_count = count
+
+    @property
+    def count(self):
+        """Number of rows, or None when exact counts are turned off."""
+        if not self.exact_count:
+            return None
+        if not hasattr(self, "_count"):
+            self._count = self.queryset.count()
+        return self._count
+
+    def cursor_for(self, direction, obj):
+        return encode_cursor(direction, [getattr(obj, field) for field in self.fields])
+
+    def after(self, values, forward):
+        """Q for the rows coming after ``values`` (before them if not ``forward``)."""
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            descending = field.startswith("-")
+            lookup = "lt" if descending == forward else "gt"
+            step = Q(**{f"{self.fields[i]}__{lookup}": values[i]})
+            for j in range(i):
+                step &= Q(**{self.fields[j]: values[j]})
+            condition |= step
+        return condition
+
+    def parse_values(self, values):
+        if len(values) != len(self.fields):
+            raise InvalidCursor(values)
+        opts = self.queryset.model._meta
+        try:
+            return [opts.get_field(field).to_python(value) for field, value in zip(self.fields, values)]
+        except Exception:
+            raise InvalidCursor(values)
+
+    def page(self, cursor=None):
+        direction, values = NEXT, None
+        if cursor:
+            direction, values = decode_cursor(cursor)
+            values = self.parse_values(values)
+
+        forward = direction == NEXT
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self.after(values, forward))
+        if forward:
+            queryset = queryset.order_by(*self.ordering)
+        else:
+            queryset = queryset.order_by(*[f[1:] if f.startswith("-") else "-" + f for f in self.ordering])
+
+        # one extra row tells whether there is more in this direction
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if forward:
+            return KeysetPage(rows, self, has_next=more, has_previous=values is not None)
+        rows.reverse()
+        return KeysetPage(rows, self, has_next=True, has_previous=more)
+
+
+class KeysetPaginationMixin:
+    """ListView mixin switching to keyset pagination when ``LIST_PAGINATION`` is "cursor"."""
+    keyset_ordering = None
+
+    def paginate_queryset(self, queryset, page_size):
+        if settings.LIST_PAGINATION != "cursor":
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size, self.keyset_ordering,
+                                    count=settings.PAGINATION_EXACT_COUNT)
+        try:
+            page = paginator.page(self.request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404("Invalid page cursor.")
+        return paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,157 @@
+"""Pacing GitLab API calls so that large fork runs don't get throttled.
+
+Every process calling a GitLab instance shares one token bucket, kept in a
+small JSON file under ``GITLAB_RATELIMIT_DIR`` and updated under an exclusive
+file lock, so the web processes and all ``gitlab_worker`` processes together
+stay under ``GITLAB_RATELIMIT_RATE`` calls per second (bursts of up to
+``GITLAB_RATELIMIT_BURST``).
+
+The rate adapts to what GitLab reports: with ``RateLimit-Remaining`` calls
+left until ``RateLimit-Reset``, calls are spread evenly over the rest of the
+window. A 429 response blocks the instance for every process until its
+``Retry-After`` (or ``RateLimit-Reset``) has passed, after which the call is
+retried with a jittered exponential backoff, up to ``GITLAB_RATELIMIT_RETRIES``
+times.
+"""
+import hashlib
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from gitlab_classroom.instrumentation import InstrumentedSession
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# never slow down below one call per this many seconds, whatever the headers say
+MAX_INTERVAL = 10
+
+
+@contextmanager
+def locked(path):
+    with open(path, "a+") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            f.seek(0)
+            yield f
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def header_number(headers, name):
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Token bucket of one GitLab instance, shared by every process through a file."""
+
+    def __init__(self, instance, rate=None, burst=None, directory=None):
+        self.rate = rate or settings.GITLAB_RATELIMIT_RATE
+        self.burst = burst or settings.GITLAB_RATELIMIT_BURST
+        directory = directory or settings.GITLAB_RATELIMIT_DIR
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, hashlib.sha256(instance.encode()).hexdigest()[:16] + ".json")
+
+    @contextmanager
+    def state(self):
+        with locked(self.path) as f:
+            try:
+                state = json.loads(f.read() or "{}")
+            except ValueError:
+                state = {}
+            now = time.time()
+            state.setdefault("tokens", self.burst)
+            state.setdefault("rate", self.rate)
+            state.setdefault("blocked_until", 0)
+            # refill for the time since the last call
+            elapsed = max(now - state.get("updated", now), 0)
+            state["tokens"] = min(self.burst, state["tokens"] + elapsed * state["rate"])
+            state["updated"] = now
+            yield state, now
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+
+    def acquire(self):
+        """Take a token and return the number of seconds to wait before using it."""
+        with self.state() as (state, now):
+            state["tokens"] -= 1
+            wait = -state["tokens"] / state["rate"] if state["tokens"] < 0 else 0
+            return max(wait, state["blocked_until"] - now)
+
+    def wait(self):
+        delay = self.acquire()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def update(self, response):
+        """Adjust the rate to the RateLimit-* headers of ``response``."""
+        headers = response.headers
+        remaining = header_number(headers, "RateLimit-Remaining")
+        reset = header_number(headers, "RateLimit-Reset")
+        retry_after = header_number(headers, "Retry-After")
+        if remaining is None and response.status_code != 429:
+            return
+        with self.state() as (state, now):
+            window = reset - now if reset and reset > now else None
+            if remaining is not None:
+                state["tokens"] = min(state["tokens"], remaining)
+                if window:
+                    state["rate"] = min(self.rate, max(remaining / window, 1 / MAX_INTERVAL))
+                else:
+                    state["rate"] = self.rate
+            if response.status_code == 429 or remaining == 0:
+                pause = retry_after or window or settings.GITLAB_RATELIMIT_BACKOFF
+                state["blocked_until"] = max(state["blocked_until"], now + pause)
+                state["tokens"] = min(state["tokens"], 0)
+
+
+_limiters = {}
+
+
+def limiter_for(url):
+    instance = urlsplit(url).netloc
+    if instance not in _limiters:
+        _limiters[instance] = RateLimiter(instance)
+    return _limiters[instance]
+
+
+def backoff(attempt):
+    # full jitter, so processes throttled together don't retry together
+    return random.uniform(0, settings.GITLAB_RATELIMIT_BACKOFF * 2 ** attempt)
+
+
+class RateLimitedSession(InstrumentedSession):
+    def send(self, request, **kwargs):
+        limiter = limiter_for(request.url)
+        attempt = 0
+        while True:
+            limiter.wait()
+            response = super().send(request, **kwargs)
+            limiter.update(response)
+            if response.status_code != 429 or attempt >= settings.GITLAB_RATELIMIT_RETRIES:
+                return response
+            response.close()
+            time.sleep(backoff(attempt))
+            attempt += 1
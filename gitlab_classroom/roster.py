@@ -0,0 +1,136 @@
+"""Importing students from a CSV roster.
+
+The file is read row by row and handled in chunks of ``ROSTER_IMPORT_CHUNK_SIZE``
+rows, so memory use doesn't depend on the size of the roster. For every chunk
+the GitLab ids of the new usernames are resolved (concurrently, for those not
+in the user cache) and the students are written with a single ``bulk_create``.
+"""
+import csv
+from dataclasses import dataclass, field
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from gitlab_classroom import user_cache
+from gitlab_classroom.models import Student
+
+
+FIELDS = ("gitlab_username", "first_name", "second_name", "email", "student_id")
+
+# accepted spellings of the column headers
+HEADER_ALIASES = {
+    "username": "gitlab_username",
+    "gitlab_username": "gitlab_username",
+    "first_name": "first_name",
+    "firstname": "first_name",
+    "name": "first_name",
+    "second_name": "second_name",
+    "last_name": "second_name",
+    "surname": "second_name",
+    "email": "email",
+    "student_id": "student_id",
+    "index": "student_id",
+}
+
+
+@dataclass
+class ImportReport:
+    created: int = 0
+    without_gitlab_account: list = field(default_factory=list)
+    skipped: list = field(default_factory=list)  # usernames already imported
+    invalid_rows: list = field(default_factory=list)  # line numbers
+    last_line: int = 0  # of the rows handled so far
+
+    def summary(self):
+        return (f"{self.created} student(s) imported "
+                f"({len(self.without_gitlab_account)} without a GitLab account), "
+                f"{len(self.skipped)} duplicate(s) skipped, "
+                f"{len(self.invalid_rows)} invalid row(s).")
+
+
+def read_roster(text_file):
+    """Yield ``(line number, row)`` pairs with the row keys mapped to ``FIELDS``."""
+    reader = csv.DictReader(text_file)
+    columns = {name: HEADER_ALIASES.get(name.strip().lower().replace(" ", "_"))
+               for name in reader.fieldnames or []}
+    for row in reader:
+        yield reader.line_num, {columns[name]: (value or "").strip()
+                                for name, value in row.items() if columns.get(name)}
+
+
+def is_valid(row):
+    if not row.get("gitlab_username") or not row.get("first_name"):
+        return False
+    try:
+        if row.get("email"):
+            validate_email(row["email"])
+    except ValidationError:
+        return False
+    return True
+
+
+def import_chunk(gl, rows, report, max_workers=None, teacher=None, access_token=None):
+    by_username = {}
+    for line, row in rows:
+        username = row.get("gitlab_username")
+        if not is_valid(row):
+            report.invalid_rows.append(line)
+        elif username in by_username:
+            report.skipped.append(username)
+        else:
+            by_username[username] = row
+
+    existing = set(Student.objects.filter(gitlab_username__in=by_username)
+                                  .values_list("gitlab_username", flat=True))
+    report.skipped.extend(sorted(existing))
+    new_rows = {username: row for username, row in by_username.items() if username not in existing}
+
+    gitlab_ids = user_cache.resolve(gl, new_rows, teacher, access_token, max_workers)
+    taken_ids = set(Student.objects.filter(gitlab_id__in=[i for i in gitlab_ids.values() if i])
+                                   .values_list("gitlab_id", flat=True))
+    students = []
+    for username, row in new_rows.items():
+        gitlab_id = gitlab_ids[username]
+        if gitlab_id in taken_ids:
+            # the same GitLab account is already imported under another username
+            report.skipped.append(username)
+            continue
+        if gitlab_id is None:
+            report.without_gitlab_account.append(username)
+        else:
+            taken_ids.add(gitlab_id)
+        students.append(Student(gitlab_username=username,
+                                first_name=row.get("first_name", ""),
+                                second_name=row.get("second_name", ""),
+                                email=row.get("email", ""),
+                                student_id=row.get("student_id") or "0",
+                                gitlab_id=gitlab_id or "",
+                                gl_flag=gitlab_id is not None))
+    for student in students:
+        student.set_lower_fields()
+    usernames = [student.gitlab_username for student in students]
+    with transaction.atomic():
+        # rows conflicting with students imported meanwhile are dropped by the INSERT, count the ones that aren't
+        before = set(Student.objects.filter(gitlab_username__in=usernames).values_list("gitlab_username", flat=True))
+        Student.objects.bulk_create(students, ignore_conflicts=True)
+        inserted = set(Student.objects.filter(gitlab_username__in=usernames)
+                                      .values_list("gitlab_username", flat=True)) - before
+    report.created += len(inserted)
+    report.skipped.extend(username for username in usernames if username not in inserted)
+    report.last_line = rows[-1][0]
+
+
+def import_roster(gl, text_file, chunk_size=None, max_workers=None, teacher=None, access_token=None, report=None):
+    """Import every student listed in the CSV ``text_file`` and return an :class:`ImportReport`.
+
+    ``report`` is filled in as the chunks are imported, so it tells how far an import that raised got.
+    """
+    chunk_size = chunk_size or settings.ROSTER_IMPORT_CHUNK_SIZE
+    report = report or ImportReport()
+    rows = read_roster(text_file)
+    while chunk := list(islice(rows, chunk_size)):
+        import_chunk(gl, chunk, report, max_workers, teacher, access_token)
+    return report
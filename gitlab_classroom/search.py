@@ -0,0 +1,174 @@
+"""Searching students, classrooms and assignments.
+
+The list views search through a backend picked for the configured database:
+
+* SQLite: an FTS5 table per model, using the model's table as external
+  content. Triggers keep it up to date on every insert, update and delete,
+  including ``bulk_create`` and ``QuerySet.update``.
+* PostgreSQL: trigram GIN indexes on ``UPPER(column)``, which serve the
+  ``icontains`` lookups without scanning the table and need no upkeep.
+* Anything else: plain ``icontains``.
+
+The tables, triggers and indexes are (re)installed after every ``migrate``,
+since SQLite drops the triggers whenever a migration rebuilds a table.
+``manage.py rebuild_search_index`` rebuilds them from scratch.
+"""
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from gitlab_classroom.models import Student, Classroom, Assignment
+
+
+SEARCH_FIELDS = {
+    Student: ("gitlab_username", "first_name", "second_name", "email", "student_id"),
+    Classroom: ("title", "description"),
+    Assignment: ("title", "description"),
+}
+
+def student_prefix_search(queryset, term):
+    """Filter ``queryset`` to students whose username, names or student id start with ``term``.
+
+    The prefix is matched as a range on the lowercased copies of the columns
+    (see ``Student.LOWER_FIELDS``) rather than with ``istartswith``, so the
+    database answers it from their indexes instead of scanning the table, and
+    non-ASCII names are matched regardless of case on SQLite too.
+    """
+    term = term.strip().lower()
+    if not term:
+        return queryset
+    upper = term + "\U0010ffff"
+    condition = Q(student_id__gte=term, student_id__lt=upper)
+    for lower in Student.LOWER_FIELDS.values():
+        condition |= Q(**{f"{lower}__gte": term, f"{lower}__lt": upper})
+    return queryset.filter(condition)
+
+
+class LikeBackend:
+    """Every search term must be contained in one of the model's search fields."""
+
+    def install(self, connection):
+        pass
+
+    def rebuild(self, connection):
+        pass
+
+    def search(self, queryset, term):
+        fields = SEARCH_FIELDS[queryset.model]
+        for word in term.split():
+            condition = Q()
+            for field in fields:
+                condition |= Q(**{f"{field}__icontains": word})
+            queryset = queryset.filter(condition)
+        return queryset
+
+
+class Fts5Backend(LikeBackend):
+    """SQLite FTS5 tables kept in sync by triggers; terms match word prefixes."""
+
+    @staticmethod
+    def fts_table(model):
+        return f"{model._meta.db_table}_fts"
+
+    def install(self, connection):
+        with connection.cursor() as cursor:
+            for model, fields in SEARCH_FIELDS.items():
+                table, fts = model._meta.db_table, self.fts_table(model)
+                columns = ", ".join(fields)
+                new = ", ".join(f"new.{field}" for field in fields)
+                old = ", ".join(f"old.{field}" for field in fields)
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({columns}, "
+                    f"content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+                    f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new}); END"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old}); END"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE ON {table} BEGIN "
+                    f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old}); "
+                    f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new}); END"
+                )
+
+    def rebuild(self, connection):
+        self.install(connection)
+        with connection.cursor() as cursor:
+            for model in SEARCH_FIELDS:
+                fts = self.fts_table(model)
+                cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+    @staticmethod
+    def match_expression(term):
+        # every word is quoted (so FTS5 syntax in it is taken literally) and matched as a prefix
+        return " ".join('"{}"*'.format(word.replace('"', '""')) for word in term.split())
+
+    def search(self, queryset, term):
+        fts = self.fts_table(queryset.model)
+        return queryset.filter(pk__in=RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s",
+                                             [self.match_expression(term)]))
+
+
+class TrigramBackend(LikeBackend):
+    """PostgreSQL pg_trgm GIN indexes matching the SQL of the ``icontains`` lookups."""
+
+    @staticmethod
+    def index_name(model, field):
+        return f"{model._meta.db_table}_{field}_trgm"[:63]
+
+    def install(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            for model, fields in SEARCH_FIELDS.items():
+                for field in fields:
+                    cursor.execute(
+                        f'CREATE INDEX IF NOT EXISTS "{self.index_name(model, field)}" '
+                        f'ON "{model._meta.db_table}" USING gin (UPPER("{field}"::text) gin_trgm_ops)'
+                    )
+
+    def rebuild(self, connection):
+        self.install(connection)
+        with connection.cursor() as cursor:
+            for model, fields in SEARCH_FIELDS.items():
+                for field in fields:
+                    cursor.execute(f'REINDEX INDEX "{self.index_name(model, field)}"')
+
+
+BACKENDS = {
+    "like": LikeBackend,
+    "fts5": Fts5Backend,
+    "trigram": TrigramBackend,
+}
+
+VENDOR_BACKENDS = {
+    "sqlite": "fts5",
+    "postgresql": "trigram",
+}
+
+
+def get_backend(using="default"):
+    name = settings.SEARCH_BACKEND
+    if name == "auto":
+        name = VENDOR_BACKENDS.get(connections[using].vendor, "like")
+    return BACKENDS[name]()
+
+
+def search(queryset, term):
+    """Filter ``queryset`` (of a model in ``SEARCH_FIELDS``) by the search ``term``."""
+    if not term or not term.strip():
+        return queryset
+    return get_backend(queryset.db).search(queryset, term)
+
+
+def install(using="default", **kwargs):
+    """post_migrate receiver creating the search tables, triggers and indexes."""
+    get_backend(using).install(connections[using])
+
+
+def rebuild(using="default"):
+    get_backend(using).rebuild(connections[using])
@@ -0,0 +1,161 @@
+"""Finding submissions of an assignment that share code, without comparing every pair.
+
+The submitted commit of every student is fingerprinted from its mirror (see
+mirrors.py and winnowing.py) in a pool of ``SIMILARITY_PROCESSES`` processes,
+and the fingerprints are kept in the database as an inverted index,
+:class:`Fingerprint` rows looked up by hash. A submission is compared by
+looking its fingerprints up in the index, which finds every other submission
+sharing one at the cost of the matches rather than of the number of
+submissions. Only submissions whose commit changed since they were
+fingerprinted are fingerprinted and looked up again, so a late submission
+costs one fingerprinting and one lookup.
+
+Fingerprints held by more than ``SIMILARITY_MAX_OCCURRENCES`` submissions come
+from the template or are boilerplate and aren't counted. A pair's score is
+the share of the smaller submission's remaining fingerprints the other one
+has too; pairs scoring at least ``SIMILARITY_MIN_SCORE`` are kept as
+:class:`SimilarPair` rows. Pairs of submissions that didn't change aren't
+recomputed as the set of boilerplate fingerprints grows, ``force`` does that.
+"""
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from gitlab_classroom import gitrepo, mirrors, winnowing
+from gitlab_classroom.models import Fingerprint, SimilarPair, Submission
+
+
+# hashes per query, under SQLite's limit on parameters
+CHUNK_SIZE = 500
+
+
+@dataclass
+class SimilarityReport:
+    fingerprinted: int = 0
+    compared: int = 0
+    pairs: int = 0
+    not_mirrored: list = field(default_factory=list)  # usernames
+    failed: list = field(default_factory=list)  # (username, reason)
+
+    def summary(self):
+        return (f"{self.fingerprinted} submission(s) fingerprinted, {self.compared} compared, "
+                f"{self.pairs} similar pair(s) found, {len(self.not_mirrored) + len(self.failed)} skipped.")
+
+
+def chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def fingerprint(submissions, repositories, processes=None, report=None, on_progress=None):
+    """``{student id: fingerprints}`` of ``submissions``, from their mirrors in ``repositories``."""
+    report = report or SimilarityReport()
+    results = {}
+    if not submissions:
+        return results
+    mirrors.touch([repositories[submission.student_id] for submission in submissions])
+    processes = min(processes or settings.SIMILARITY_PROCESSES, len(submissions))
+    # spawned for the same reason as the fetches of mirrors.py
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(winnowing.fingerprint, mirrors.mirror_path(repositories[submission.student_id]),
+                                   submission.commit_sha, settings.SIMILARITY_KGRAM, settings.SIMILARITY_WINDOW,
+                                   settings.SIMILARITY_MAX_FILE_BYTES): submission
+                   for submission in submissions}
+        for done, future in enumerate(as_completed(futures), start=1):
+            submission = futures[future]
+            try:
+                results[submission.student_id] = future.result()
+            except gitrepo.GitError as e:
+                report.failed.append((submission.student.gitlab_username, str(e)))
+            if on_progress:
+                on_progress(done, len(futures))
+    return results
+
+
+def store(assignment, submissions, fingerprints):
+    """Replace the fingerprints of ``submissions`` in the index."""
+    changed = [submission for submission in submissions if submission.student_id in fingerprints]
+    with transaction.atomic():
+        Fingerprint.objects.filter(assignment=assignment,
+                                   student_id__in=[submission.student_id for submission in changed]).delete()
+        Fingerprint.objects.bulk_create([Fingerprint(assignment=assignment, student_id=student_id, hash=value)
+                                         for student_id, values in fingerprints.items() for value in values],
+                                        batch_size=5000)
+        for submission in changed:
+            submission.fingerprint_sha = submission.commit_sha
+            submission.fingerprint_count = len(fingerprints[submission.student_id])
+        Submission.objects.bulk_update(changed, ["fingerprint_sha", "fingerprint_count"])
+
+
+def common_hashes(assignment):
+    """Fingerprints too many submissions have to say anything about a pair."""
+    return set(Fingerprint.objects.filter(assignment=assignment).values("hash")
+               .annotate(submissions=Count("id")).filter(submissions__gt=settings.SIMILARITY_MAX_OCCURRENCES)
+               .values_list("hash", flat=True))
+
+
+def compare(assignment, student_ids, known=None):
+    """Recompute the pairs of the students in ``student_ids`` with anyone, using the index.
+
+    ``known`` has the fingerprints of some of them already, the others are read from the index.
+    """
+    known = known or {}
+    common = common_hashes(assignment)
+    sizes = dict(assignment.submission.values_list("student_id", "fingerprint_count"))
+    for chunk in chunks(common):
+        for student_id, count in (Fingerprint.objects.filter(assignment=assignment, hash__in=chunk)
+                                  .values("student").annotate(count=Count("id")).values_list("student", "count")):
+            sizes[student_id] = sizes.get(student_id, 0) - count
+
+    pairs = {}
+    for student_id in student_ids:
+        own = known.get(student_id)
+        if own is None:
+            own = Fingerprint.objects.filter(assignment=assignment, student_id=student_id).values_list("hash", flat=True)
+        shared = Counter()
+        for chunk in chunks(set(own) - common):
+            shared.update(Fingerprint.objects.filter(assignment=assignment, hash__in=chunk)
+                          .exclude(student_id=student_id).values_list("student_id", flat=True))
+        for other_id, count in shared.items():
+            smaller = min(sizes.get(student_id, 0), sizes.get(other_id, 0))
+            if smaller > 0 and count / smaller >= settings.SIMILARITY_MIN_SCORE:
+                a, b = sorted((student_id, other_id))
+                pairs[a, b] = SimilarPair(assignment=assignment, student_a_id=a, student_b_id=b, shared=count,
+                                          score=min(count / smaller, 1.0))
+    with transaction.atomic():
+        SimilarPair.objects.filter(Q(student_a__in=student_ids) | Q(student_b__in=student_ids),
+                                   assignment=assignment).delete()
+        SimilarPair.objects.bulk_create(pairs.values())
+    return len(pairs)
+
+
+def update(assignment, force=False, processes=None, on_progress=None):
+    """Fingerprint the changed submissions of ``assignment`` and rank the pairs; returns a :class:`SimilarityReport`."""
+    report = SimilarityReport()
+    repositories = {mirror.student_id: mirror for mirror in assignment.mirror.filter(fetched_at__isnull=False)}
+    submitted = list(assignment.submission.select_related("student").exclude(commit_sha=""))
+    report.not_mirrored = [submission.student.gitlab_username for submission in submitted
+                           if submission.student_id not in repositories]
+    changed = [submission for submission in submitted
+               if submission.student_id in repositories and submission.fingerprint_sha != submission.commit_sha]
+
+    fingerprints = fingerprint(changed, repositories, processes, report, on_progress)
+    store(assignment, changed, fingerprints)
+    report.fingerprinted = len(fingerprints)
+
+    if force:
+        student_ids = [submission.student_id for submission in submitted
+                       if submission.fingerprint_sha or submission.student_id in fingerprints]
+    else:
+        student_ids = list(fingerprints)
+    if student_ids:
+        compare(assignment, student_ids, {student_id: set(values) for student_id, values in fingerprints.items()})
+    report.compared = len(student_ids)
+    report.pairs = assignment.similar_pair.count()
+    return report
@@ -0,0 +1,174 @@
+"""Recording what every student had handed in at an assignment's deadline.
+
+A sweep lists the projects of the assignment's GitLab group and, for every
+student fork, records the last commit of the default branch made before the
+deadline and the status of that commit's latest pipeline in a
+:class:`Submission`. The forks are looked at from a thread pool that shares
+the fork engine's cap on in-flight requests per GitLab instance.
+
+Sweeps after the first one are incremental. The group's projects are listed
+most recently active first and the listing stops at the first project that
+hasn't been active since the previous sweep, so re-syncing a large course
+that hardly changed costs a handful of calls. GitLab updates
+``last_activity_at`` at most once an hour, so the previous sweep is moved back
+by ``SUBMISSION_ACTIVITY_SLACK`` seconds first. A pipeline finishing isn't
+project activity, so submissions whose pipeline was still running are looked
+at again in any case.
+
+The ``collect_submissions`` job runs a sweep and queues the next one
+``SUBMISSION_SWEEP_INTERVAL`` seconds later, until ``SUBMISSION_SWEEP_GRACE``
+seconds after the deadline. Assignments with a webhook (see webhooks.py) are
+kept current by GitLab's events instead and only swept once more after the
+deadline.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+import gitlab
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from gitlab_classroom.breaker import GitlabUnavailable
+from gitlab_classroom.forking import instance_limit, project_path
+from gitlab_classroom.instrumentation import propagate
+from gitlab_classroom.models import Assignment, GitlabJob, Submission
+
+
+@dataclass
+class SweepReport:
+    projects: int = 0  # projects looked at
+    collected: int = 0
+    unmatched: list = field(default_factory=list)  # project paths that aren't a student's fork
+    failed: list = field(default_factory=list)  # (username, reason)
+
+    def summary(self):
+        return (f"{self.collected} submission(s) collected from {self.projects} changed project(s), "
+                f"{len(self.failed)} failed.")
+
+
+def changed_projects(gl, assignments_group, since=None):
+    """Projects of ``assignments_group`` active since ``since``, all of them if it is None."""
+    projects = []
+    with instance_limit(gl.url):
+        for project in assignments_group.projects.list(iterator=True, per_page=100,
+                                                        order_by="last_activity_at", sort="desc"):
+            if since and parse_datetime(project.last_activity_at) < since:
+                break  # the rest are older still, and their pages are never fetched
+            projects.append(project)
+    return projects
+
+
+def latest_pipeline(gl, project_id, sha):
+    """``(id, status)`` of the newest pipeline of commit ``sha``."""
+    project = gl.projects.get(project_id, lazy=True)
+    with instance_limit(gl.url):
+        pipelines = project.pipelines.list(sha=sha, per_page=1, get_all=False)  # newest first
+    return (pipelines[0].id, pipelines[0].status) if pipelines else (None, "")
+
+
+def snapshot(gl, project, student, assignment):
+    """The :class:`Submission` of ``student`` as its fork ``project`` is now."""
+    with instance_limit(gl.url):
+        commits = gl.projects.get(project.id, lazy=True).commits.list(
+            ref_name=project.default_branch, until=assignment.deadline.isoformat(), per_page=1, get_all=False)
+    commit = commits[0] if commits else None
+    pipeline_id, status = latest_pipeline(gl, project.id, commit.id) if commit else (None, "")
+    return Submission(student=student,
+                      assignment=assignment,
+                      project_id=project.id,
+                      commit_sha=commit.id if commit else "",
+                      commit_date=parse_datetime(commit.committed_date) if commit else None,
+                      pipeline_id=pipeline_id,
+                      pipeline_status=status,
+                      last_activity_at=parse_datetime(project.last_activity_at))
+
+
+def refresh_pipeline(gl, submission):
+    submission.pipeline_id, submission.pipeline_status = latest_pipeline(gl, submission.project_id,
+                                                                         submission.commit_sha)
+    return submission
+
+
+def save(submissions):
+    """Insert or update ``submissions`` in one query, by assignment and student."""
+    submissions = list(submissions)
+    for submission in submissions:
+        submission.pk = None  # so that the known ones don't conflict on the primary key instead
+    Submission.objects.bulk_create(submissions, update_conflicts=True, unique_fields=["assignment", "student"],
+                                   update_fields=["project_id", "commit_sha", "commit_date", "pipeline_id",
+                                                  "pipeline_status", "last_activity_at", "collected_at"])
+
+
+def collect(gl, assignment, incremental=True, max_workers=None, on_progress=None):
+    """Record the submissions of ``assignment`` and return a :class:`SweepReport`.
+
+    ``on_progress(done, total)`` is called each time a project is finished.
+    """
+    started = timezone.now()
+    since = None
+    if incremental and assignment.submissions_collected_at:
+        since = assignment.submissions_collected_at - timedelta(seconds=settings.SUBMISSION_ACTIVITY_SLACK)
+
+    with instance_limit(gl.url):
+        assignments_group = gl.groups.get(assignment.gitlab_id)
+    projects = changed_projects(gl, assignments_group, since)
+    students = {student.gitlab_username.lower(): student for student in assignment.classroom.students.all()}
+    paths = {project_path(assignments_group, username).lower(): student for username, student in students.items()}
+
+    report = SweepReport(projects=len(projects))
+    tasks = []
+    for project in projects:
+        student = paths.get(project.path.lower())
+        if student is None:
+            report.unmatched.append(project.path)
+        else:
+            tasks.append((student.gitlab_username, snapshot, project, student, assignment))
+    visited = {project.id for project in projects}
+    for submission in assignment.submission.select_related("student").exclude(project_id__in=visited):
+        if not submission.pipeline_finished:
+            tasks.append((submission.student.gitlab_username, refresh_pipeline, submission))
+
+    submissions = []
+    if tasks:
+        max_workers = max_workers or settings.GITLAB_FORK_WORKERS
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+            futures = {executor.submit(propagate(func), gl, *args): username for username, func, *args in tasks}
+            for done, future in enumerate(as_completed(futures), start=1):
+                try:
+                    submissions.append(future.result())
+                except GitlabUnavailable:
+                    raise  # the job is retried later
+                except gitlab.exceptions.GitlabError as e:
+                    report.failed.append((futures[future], e.error_message or str(e)))
+                if on_progress:
+                    on_progress(done, len(futures))
+
+    save(submissions)
+    report.collected = len(submissions)
+    if not report.failed:
+        # the projects that failed have to be looked at again next time, active or not
+        Assignment.objects.filter(pk=assignment.pk).update(submissions_collected_at=started)
+        assignment.submissions_collected_at = started
+    return report
+
+
+def next_sweep(assignment, now=None):
+    """When to sweep ``assignment`` again, None once its deadline is long gone.
+
+    With a webhook keeping the submissions current only the sweep after the
+    deadline is left, to make up for events that never arrived.
+    """
+    now = now or timezone.now()
+    last = assignment.deadline + timedelta(seconds=settings.SUBMISSION_SWEEP_GRACE)
+    if now >= last:
+        return None
+    if assignment.webhook_id:
+        return last
+    return min(now + timedelta(seconds=settings.SUBMISSION_SWEEP_INTERVAL), last)
+
+
+def scheduled(assignment):
+    return GitlabJob.objects.filter(assignment=assignment, kind=GitlabJob.COLLECT_SUBMISSIONS,
+                                    status__in=[GitlabJob.QUEUED, GitlabJob.RUNNING])
@@ -0,0 +1,9 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def any_active(jobs):
+    #one reload timer for the whole list, however many jobs are running
+    return any(job.is_active for job in jobs)
@@ -11,4 +11,10 @@ def query_transform(request, **kwargs):
             updated[k] = v
         else:
             updated.pop(k, 0)
-    return updated.urlencode()
\ No newline at end of file
+    return updated.urlencode()
+
+
+@register.simple_tag
+def cursor_transform(request, cursor):
+    #same as query_transform but for cursor pages, dropping a leftover page number
+    return query_transform(request, cursor=cursor, page=None)
@@ -1,16 +1,37 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.http import HttpResponse
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 
 from gitlab_classroom.forms import ForkProjectsForm
-from .models import Teacher, Student, Classroom, Assignment
-from datetime import datetime
+from gitlab_classroom.forking import fork_projects
+from gitlab_classroom.roster import import_roster
+from gitlab_classroom.fake_gitlab import FakeGitlab, Faults
+from gitlab_classroom.groups import add_members
+from gitlab_classroom import user_cache, search
+from gitlab_classroom import jobs, gitlab_client, dashboard, instrumentation, ratelimit, breaker, loadtest, submissions, webhooks, export, mirrors, gitrepo, similarity, winnowing
+from .models import (Teacher, Student, Classroom, Assignment, GitlabJob, GitlabUserCache, Submission, WebhookEvent,
+                     RepositoryMirror, SimilarPair)
+from datetime import datetime, timedelta
+from django.core.cache import cache
 from django.utils import timezone
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from unittest.mock import patch, MagicMock
+from io import StringIO
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
 import gitlab
+import io
+import os
 import re
+import requests
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from prometheus_client import REGISTRY
 
 
 
@@ -126,6 +147,7 @@ User = get_user_model()
 
 class ClassroomCreateViewTest(TestCase):
     def setUp(self):
+        gitlab_client.clear()
         self.client = Client()
         self.user = User.objects.create_user(username='testuser', password='12345')
         self.client.login(username='testuser', password='12345')
@@ -209,6 +231,7 @@ User = get_user_model()
 
 class AssignmentsDetailViewTest(TestCase):
     def setUp(self):
+        gitlab_client.clear()
         self.client = Client()
         self.user = User.objects.create_user(username='testuser', password='12345')
         self.client.login(username='testuser', password='12345')
@@ -253,6 +276,7 @@ class AssignmentsDetailViewTest(TestCase):
         mock_gl_instance.groups.get.return_value = mock_group
         mock_group.subgroups.list.return_value = []
         mock_group.id = 789
+        mock_gl_instance.groups.create.return_value.id = 790
         mock_gl_instance.projects.get.return_value.forks.create.return_value.id = 101112
 
         data = {
@@ -262,6 +286,14 @@ class AssignmentsDetailViewTest(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertRedirects(response, self.assignment.get_absolute_url())
 
+        job = GitlabJob.objects.get()
+        self.assertEqual(job.kind, GitlabJob.FORK_PROJECTS)
+        self.assertEqual(job.payload, {'template_id': '789'})
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, GitlabJob.DONE)
+        self.assertEqual(job.access_token, '')
+
     @patch('gitlab.Gitlab')
     def test_post_invalid_form(self, mock_gitlab):
         session = self.client.session
@@ -281,6 +313,7 @@ User = get_user_model()
 
 class ClassroomCreateViewTest(TestCase):
     def setUp(self):
+        gitlab_client.clear()
         self.user = User.objects.create_user(username='testuser', password='testpass')
         self.client.login(username='testuser', password='testpass')
         self.url = reverse('gitlab_classroom:classroom-create')
@@ -304,6 +337,9 @@ class ClassroomCreateViewTest(TestCase):
         
         self.assertEqual(response.status_code, 302)
         self.assertTrue(Classroom.objects.filter(title='Test Classroom').exists())
+        MockGitlab.return_value.groups.create.assert_not_called()
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(Classroom.objects.get(title='Test Classroom').gitlab_id, 1)
         mock_gl_instance.groups.create.assert_any_call({
             'name': 'Test Classroom',
             'path': 'test_classroom',
@@ -329,5 +365,1589 @@ class ClassroomCreateViewTest(TestCase):
         mock_gl_instance.groups.create.side_effect = gitlab.exceptions.GitlabCreateError
 
         response = self.client.post(self.url, self.data)
-        self.assertEqual(response.status_code, 500)
-        self.assertFalse(Classroom.objects.filter(title='Test Classroom').exists())
\ No newline at end of file
+        self.assertEqual(response.status_code, 302)
+        jobs.run_pending()
+        self.assertTrue(Classroom.objects.filter(title='Test Classroom', gitlab_id=0).exists())
+        self.assertEqual(GitlabJob.objects.get().status, GitlabJob.FAILED)
+
+    def test_create_classroom_again_reuses_groups(self):
+        self.client.post(self.url, self.data)
+        classroom = Classroom.objects.get()
+        with FakeGitlab() as fake, override_settings(GITLAB_URL=fake.url):
+            #an earlier attempt got as far as the MEMBERS subgroup
+            group = fake.add_group('Test Classroom', path='test_classroom')
+            members = fake.add_group('MEMBERS', path='test_classroom_MEMBERS', parent_id=group['id'])
+            Classroom.objects.filter(pk=classroom.pk).update(gitlab_id=group['id'])
+            jobs.run_pending()
+            groups = len(fake.groups)
+
+        job = GitlabJob.objects.get()
+        self.assertEqual(job.status, GitlabJob.DONE)
+        classroom.refresh_from_db()
+        self.assertEqual((classroom.gitlab_id, classroom.members_gitlab_id), (group['id'], members['id']))
+        self.assertEqual(groups, 3)
+
+    def test_titles_with_the_same_path_get_their_own_groups(self):
+        self.client.post(self.url, {**self.data, 'title': 'Prog 1'})
+        self.client.post(self.url, {**self.data, 'title': 'prog 1'})
+        with FakeGitlab() as fake, override_settings(GITLAB_URL=fake.url):
+            other = fake.add_group('Someone else', path='prog_1')
+            jobs.run_pending()
+
+        self.assertEqual(set(GitlabJob.objects.values_list('status', flat=True)), {GitlabJob.DONE})
+        upper, lower = Classroom.objects.get(title='Prog 1'), Classroom.objects.get(title='prog 1')
+        self.assertEqual(len({other['id'], upper.gitlab_id, lower.gitlab_id}), 3)
+        self.assertNotEqual(upper.members_gitlab_id, lower.members_gitlab_id)
+        self.assertEqual(fake.groups[upper.gitlab_id]['path'], f'prog_1_{upper.pk}')
+
+
+class ForkProjectsTest(TestCase):
+    def setUp(self):
+        self.gl = MagicMock()
+        self.assignments_group = MagicMock(id=456)
+        self.assignments_group.name = "lab1"
+        self.teacher = MagicMock(id=1, username="teacher")
+        self.students = [MagicMock(id=i, username=f"student{i}") for i in (2, 3, 4)]
+
+    def test_report_per_student(self):
+        self.assignments_group.projects.list.return_value = [MagicMock(path="lab1_student3_project"),
+                                                             MagicMock(path="other_project")]
+        base_project = self.gl.projects.get.return_value
+        base_project.forks.create.side_effect = [
+            MagicMock(id=100),
+            gitlab.exceptions.GitlabCreateError("409 Conflict"),
+        ]
+
+        report = fork_projects(self.gl, self.assignments_group, 789,
+                               [self.teacher] + self.students, skip_user_id="1", max_workers=1)
+
+        self.assertEqual([r.username for r in report.results], ["student2", "student3", "student4"])
+        self.assertEqual([r.username for r in report.created], ["student2"])
+        self.assertEqual(report.created[0].project_id, 100)
+        self.assertEqual([r.username for r in report.existed], ["student3"])
+        self.assertEqual([r.username for r in report.failed], ["student4"])
+        self.assertEqual(report.failed[0].reason, "409 Conflict")
+        self.assertEqual(base_project.forks.create.call_count, 2)
+        self.assertEqual(report.summary(), "1 project(s) forked, 1 already existed, 1 failed.")
+        # existence is answered from one listing of the group, not a search per student
+        self.assignments_group.projects.list.assert_called_once_with(iterator=True, per_page=100)
+        self.gl.projects.list.assert_not_called()
+
+    def test_concurrent_run_forks_every_student(self):
+        self.assignments_group.projects.list.return_value = []
+        self.gl.projects.get.return_value.forks.create.return_value = MagicMock(id=100)
+
+        report = fork_projects(self.gl, self.assignments_group, 789, self.students, max_workers=3)
+
+        self.assertEqual(len(report.created), 3)
+        self.assertEqual(self.gl.projects.get.return_value.members.create.call_count, 3)
+
+
+class GitlabJobQueueTest(TestCase):
+    def setUp(self):
+        gitlab_client.clear()
+        self.teacher = User.objects.create_user(username='teacher', password='12345', gitlab_id='1')
+        self.classroom = Classroom.objects.create(title='Jobs Classroom', description='', organization='Org',
+                                                  teacher=self.teacher, gitlab_id=123)
+
+    def test_claimed_job_is_not_claimed_again(self):
+        job = jobs.enqueue(GitlabJob.DELETE_GROUP, self.teacher, 'token', group_id=5)
+        self.assertEqual(jobs.claim_next('worker-1'), job)
+        self.assertIsNone(jobs.claim_next('worker-2'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, GitlabJob.RUNNING)
+        self.assertEqual(job.worker, 'worker-1')
+
+    @override_settings(GITLAB_JOB_MAX_ATTEMPTS=5)
+    def test_job_of_a_dead_worker_is_reclaimed(self):
+        job = jobs.enqueue(GitlabJob.DELETE_GROUP, self.teacher, 'token', group_id=5)
+        jobs.claim_next('worker-1')
+        self.assertEqual(jobs.reclaim(), 0)
+
+        GitlabJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=4))
+        self.assertEqual(jobs.reclaim(), 1)
+        self.assertEqual(jobs.claim_next('worker-2'), job)
+        job.refresh_from_db()
+        self.assertEqual((job.worker, job.attempts, job.access_token), ('worker-2', 1, 'token'))
+
+        GitlabJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=4),
+                                                   attempts=4)
+        jobs.reclaim()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.access_token), (GitlabJob.FAILED, ''))
+
+    @patch('gitlab.Gitlab')
+    def test_delete_group_job_tolerates_missing_group(self, MockGitlab):
+        group = MockGitlab.return_value.groups.get.return_value
+        group.delete.side_effect = gitlab.exceptions.GitlabDeleteError(response_code=404)
+        job = jobs.enqueue(GitlabJob.DELETE_GROUP, self.teacher, 'token', group_id=5)
+
+        jobs.run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, GitlabJob.DONE)
+        self.assertFalse(job.result['deleted'])
+
+    def test_classroom_delete_enqueues_group_deletion(self):
+        self.client.login(username='teacher', password='12345')
+        session = self.client.session
+        session['access_token'] = 'token'
+        session.save()
+
+        response = self.client.post(reverse('gitlab_classroom:classroom-delete', args=[self.classroom.pk]))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Classroom.objects.exists())
+        job = GitlabJob.objects.get()
+        self.assertEqual(job.kind, GitlabJob.DELETE_GROUP)
+        self.assertEqual(job.payload, {'group_id': 123})
+
+
+class GitlabClientRegistryTest(TestCase):
+    def setUp(self):
+        gitlab_client.clear()
+
+    def tearDown(self):
+        gitlab_client.clear()
+
+    def test_client_is_reused_per_token(self):
+        client = gitlab_client.get_client('token-a')
+        self.assertIs(gitlab_client.get_client('token-a'), client)
+        self.assertIsNot(gitlab_client.get_client('token-b'), client)
+        self.assertEqual(client.url, 'https://gitlab-stud.elka.pw.edu.pl')
+
+    @override_settings(GITLAB_CLIENTS_MAX=2)
+    def test_least_recently_used_client_is_dropped(self):
+        client_a = gitlab_client.get_client('token-a')
+        gitlab_client.get_client('token-b')
+        gitlab_client.get_client('token-a')
+        gitlab_client.get_client('token-c')
+        self.assertIs(gitlab_client.get_client('token-a'), client_a)
+        self.assertEqual(len(gitlab_client._clients), 2)
+        self.assertNotIn(gitlab_client._key('https://gitlab-stud.elka.pw.edu.pl', 'token-b'), gitlab_client._clients)
+
+    @override_settings(GITLAB_CLIENT_IDLE_TIMEOUT=0)
+    def test_idle_clients_are_rebuilt(self):
+        client = gitlab_client.get_client('token-a')
+        with patch.object(client.session, 'close') as close:
+            self.assertIsNot(gitlab_client.get_client('token-a'), client)
+        close.assert_not_called()  # another thread may still be using it
+
+    def test_tokens_are_not_kept_in_plain_text(self):
+        gitlab_client.get_client('secret-token')
+        self.assertNotIn('secret-token', repr(list(gitlab_client._clients)))
+
+
+class ClassroomSubgroupsTest(TestCase):
+    def setUp(self):
+        gitlab_client.clear()
+        self.teacher = User.objects.create_user(username='teacher', password='12345', gitlab_id='1')
+        self.classroom = Classroom.objects.create(title='Subgroups Classroom', description='', organization='Org',
+                                                  teacher=self.teacher, gitlab_id=10)
+        self.student = Student.objects.create(gitlab_id='77', gitlab_username='student', first_name='S',
+                                              second_name='T', email='s@example.com')
+        self.client.login(username='teacher', password='12345')
+        session = self.client.session
+        session['access_token'] = 'token'
+        session.save()
+
+    @patch('gitlab.Gitlab')
+    def test_add_student_uses_stored_members_group(self, MockGitlab):
+        Classroom.objects.filter(pk=self.classroom.pk).update(members_gitlab_id=11, assignments_gitlab_id=12)
+        gl = MockGitlab.return_value
+
+        gl.groups.get.return_value.id = 11
+        gl.http_post.return_value = {'status': 'success'}
+
+        response = self.client.post(self.classroom.get_absolute_url(),
+                                    {'add_student': '', 'students': [self.student.pk]})
+
+        self.assertEqual(response.status_code, 302)
+        gl.groups.get.assert_called_once_with(11, lazy=True)
+        gl.groups.get.return_value.subgroups.list.assert_not_called()
+        gl.http_post.assert_called_once_with(
+            '/groups/11/members', post_data={'user_id': '77', 'access_level': gitlab.const.DEVELOPER_ACCESS})
+        self.assertIn(self.student, self.classroom.students.all())
+
+    @patch('gitlab.Gitlab')
+    def test_bulk_add_reports_partial_failures(self, MockGitlab):
+        Classroom.objects.filter(pk=self.classroom.pk).update(members_gitlab_id=11, assignments_gitlab_id=12)
+        gl = MockGitlab.return_value
+        gl.groups.get.return_value.id = 11
+        others = [Student.objects.create(gitlab_id=str(100 + i), gitlab_username=f'bulk{i}', first_name=f'B{i}',
+                                         second_name='S', email='b@example.com') for i in range(3)]
+        no_account = Student.objects.create(gitlab_id='', gitlab_username='ghost', first_name='G',
+                                            second_name='H', email='g@example.com')
+        gl.users.list.return_value = []
+        gl.http_post.side_effect = [
+            {'status': 'error', 'message': {'bulk1': 'Member already exists', 'bulk2': 'User is blocked'}},
+            {'status': 'success'},
+        ]
+
+        with self.settings(GITLAB_MEMBERS_BATCH_SIZE=3):
+            response = self.client.post(self.classroom.get_absolute_url(), {
+                'add_student': '',
+                'students': [self.student.pk, no_account.pk] + [student.pk for student in others],
+            })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(gl.http_post.call_count, 2)
+        self.assertEqual(set(self.classroom.students.all()), {self.student, others[0], others[1]})
+        messages = [str(m) for m in response.wsgi_request._messages]
+        self.assertIn('Student bulk2 was not added: User is blocked', messages)
+        self.assertIn('Student ghost was not added: Student has no account on GitLab.', messages)
+
+    @patch('gitlab.Gitlab')
+    def test_backfill_resolves_subgroups_by_name(self, MockGitlab):
+        gl = MockGitlab.return_value
+        assignments, members = MagicMock(id=12), MagicMock(id=11)
+        assignments.name, members.name = 'ASSIGNMENTS', 'MEMBERS'
+        gl.groups.get.return_value.subgroups.list.return_value = [assignments, members]
+
+        call_command('backfill_subgroup_ids', token='token', stdout=StringIO())
+
+        self.classroom.refresh_from_db()
+        self.assertEqual(self.classroom.members_gitlab_id, 11)
+        self.assertEqual(self.classroom.assignments_gitlab_id, 12)
+        gl.groups.create.assert_not_called()
+
+
+class RosterImportTest(TestCase):
+    ROSTER = (
+        "username,first_name,second_name,email,student_id\n"
+        "alice,Alice,A,alice@example.com,1001\n"
+        "bob,Bob,B,bob@example.com,1002\n"
+        "ghost,Ghost,G,ghost@example.com,1003\n"
+        "alice,Alice,A,alice@example.com,1001\n"
+        ",Nameless,N,n@example.com,1004\n"
+        "carol,Carol,C,not-an-email,1005\n"
+        "existing,Existing,E,e@example.com,1006\n"
+        "alias,Alias,A,alias@example.com,1007\n"
+    )
+
+    def setUp(self):
+        Student.objects.create(gitlab_id='50', gitlab_username='existing', first_name='Existing',
+                               second_name='E', email='e@example.com')
+        self.gl = MagicMock()
+        ids = {'alice': 10, 'bob': 11, 'alias': 50}
+        self.gl.users.list.side_effect = lambda username: (
+            [MagicMock(id=ids[username], state='active')] if username in ids else [])
+
+    def test_import_roster(self):
+        report = import_roster(self.gl, StringIO(self.ROSTER), chunk_size=3, max_workers=4)
+
+        self.assertEqual(report.created, 3)
+        self.assertEqual(report.without_gitlab_account, ['ghost'])
+        self.assertEqual(sorted(report.skipped), ['alias', 'alice', 'existing'])
+        self.assertEqual(report.invalid_rows, [6, 7])
+        alice = Student.objects.get(gitlab_username='alice')
+        self.assertEqual((alice.gitlab_id, alice.gl_flag, alice.student_id), ('10', True, '1001'))
+        self.assertFalse(Student.objects.get(gitlab_username='ghost').gl_flag)
+        # existing usernames are never looked up on GitLab
+        looked_up = {call.kwargs['username'] for call in self.gl.users.list.call_args_list}
+        self.assertEqual(looked_up, {'alice', 'bob', 'ghost', 'alias'})
+
+    @patch('gitlab.Gitlab')
+    def test_import_view(self, MockGitlab):
+        gitlab_client.clear()
+        MockGitlab.return_value.users.list.side_effect = self.gl.users.list.side_effect
+        User.objects.create_user(username='teacher', password='12345')
+        self.client.login(username='teacher', password='12345')
+        session = self.client.session
+        session['access_token'] = 'token'
+        session.save()
+
+        roster = SimpleUploadedFile('roster.csv', self.ROSTER.encode('utf-8-sig'), content_type='text/csv')
+        response = self.client.post(reverse('gitlab_classroom:student-import'), {'roster': roster})
+
+        self.assertRedirects(response, reverse('gitlab_classroom:student-list'))
+        self.assertEqual(Student.objects.count(), 4)
+
+    def test_students_imported_meanwhile_are_not_counted(self):
+        def resolve(gl, usernames, *args):
+            # bob is imported by someone else while the GitLab ids are looked up
+            Student.objects.create(gitlab_username='bob', gitlab_id='11', email='b@example.com')
+            return {'alice': '10', 'bob': '11'}
+
+        with patch('gitlab_classroom.user_cache.resolve', side_effect=resolve):
+            report = import_roster(self.gl, StringIO("username,first_name\nalice,Alice\nbob,Bob\n"))
+        self.assertEqual((report.created, report.skipped), (1, ['bob']))
+
+    @patch('gitlab.Gitlab')
+    def test_import_view_reports_how_far_it_got(self, MockGitlab):
+        gitlab_client.clear()
+        breaker._breakers.clear()
+        def lookup(username, found=self.gl.users.list.side_effect):
+            if username == 'alias':  # in the third chunk
+                raise breaker.GitlabUnavailable('down')
+            return found(username)
+        MockGitlab.return_value.users.list.side_effect = lookup
+        User.objects.create_user(username='teacher', password='12345')
+        self.client.login(username='teacher', password='12345')
+        session = self.client.session
+        session['access_token'] = 'token'
+        session.save()
+
+        roster = SimpleUploadedFile('roster.csv', self.ROSTER.encode(), content_type='text/csv')
+        with self.settings(ROSTER_IMPORT_CHUNK_SIZE=3):
+            response = self.client.post(reverse('gitlab_classroom:student-import'), {'roster': roster})
+
+        self.assertRedirects(response, reverse('gitlab_classroom:student-list'))
+        messages = [str(m) for m in response.wsgi_request._messages]
+        self.assertIn('The import stopped after line 7, GitLab accounts could not be looked up: down', messages)
+        self.assertIn('3 student(s) imported', messages[1])
+        self.assertEqual(Student.objects.count(), 4)
+
+
+class GitlabUserCacheTest(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='12345')
+        self.gl = MagicMock()
+        self.gl.users.list.side_effect = lambda username: (
+            [] if username == 'ghost' else [MagicMock(id=len(username), state='active')])
+
+    def test_repeated_lookups_are_answered_from_the_cache(self):
+        self.assertEqual(user_cache.resolve(self.gl, ['alice', 'ghost']), {'alice': '5', 'ghost': None})
+        self.assertEqual(user_cache.resolve(self.gl, ['alice', 'ghost']), {'alice': '5', 'ghost': None})
+        self.assertEqual(self.gl.users.list.call_count, 2)
+        self.assertTrue(GitlabUserCache.objects.get(username='ghost').is_missing)
+
+    def test_stale_entries_are_revalidated_in_the_background(self):
+        old = timezone.now() - timezone.timedelta(days=30)
+        GitlabUserCache.objects.create(username='alice', gitlab_id='99', state='active', last_verified=old)
+        GitlabUserCache.objects.create(username='ghost', gitlab_id='', state='missing', last_verified=old)
+        student = Student.objects.create(gitlab_id='99', gitlab_username='alice', first_name='A',
+                                         second_name='B', email='a@example.com', gl_flag=True)
+
+        resolved = user_cache.resolve(self.gl, ['alice', 'ghost'], self.teacher, 'token')
+
+        # the known user is served from the cache, the missing one is looked up again
+        self.assertEqual(resolved, {'alice': '99', 'ghost': None})
+        self.gl.users.list.assert_called_once_with(username='ghost')
+        job = GitlabJob.objects.get()
+        self.assertEqual((job.kind, job.payload), (GitlabJob.REFRESH_USERS, {'usernames': ['alice']}))
+
+        with patch('gitlab_classroom.jobs.client_for', return_value=self.gl):
+            jobs.run_pending()
+        student.refresh_from_db()
+        self.assertEqual(student.gitlab_id, '5')
+        entry = GitlabUserCache.objects.get(username='alice')
+        self.assertEqual(entry.gitlab_id, '5')
+        self.assertFalse(user_cache.is_stale(entry, timezone.now()))
+
+    def test_stale_entries_are_queued_once(self):
+        old = timezone.now() - timezone.timedelta(days=30)
+        for username in ('alice', 'bob', 'carol'):
+            GitlabUserCache.objects.create(username=username, gitlab_id='9', state='active', last_verified=old)
+
+        user_cache.resolve(self.gl, ['alice', 'bob'], self.teacher, 'token')
+        user_cache.resolve(self.gl, ['alice'], self.teacher, 'token')
+        user_cache.resolve(self.gl, ['carol'], self.teacher, 'token')
+        job = GitlabJob.objects.get()
+        self.assertEqual(job.payload, {'usernames': ['alice', 'bob', 'carol']})
+
+        jobs.claim_next('worker')
+        user_cache.resolve(self.gl, ['alice'], self.teacher, 'token')
+        self.assertEqual(GitlabJob.objects.filter(status=GitlabJob.QUEUED).count(), 1)
+
+    def test_fill_student_ids(self):
+        student = Student.objects.create(gitlab_id='', gitlab_username='bob', first_name='B',
+                                         second_name='C', email='b@example.com')
+        user_cache.fill_student_ids(self.gl, [student])
+        student.refresh_from_db()
+        self.assertEqual((student.gitlab_id, student.gl_flag), ('3', True))
+
+
+class StudentAutocompleteTest(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='12345')
+        self.client.login(username='teacher', password='12345')
+        self.classroom = Classroom.objects.create(title='Autocomplete Classroom', description='',
+                                                  organization='Org', teacher=self.teacher)
+        for i in range(25):
+            Student.objects.create(gitlab_id=str(i), gitlab_username=f'anna{i:02d}', first_name='Anna',
+                                   second_name='Nowak', email='a@example.com', student_id=f'3{i:05d}')
+        self.bob = Student.objects.create(gitlab_id='100', gitlab_username='bob', first_name='Robert',
+                                          second_name='Annanowicz', email='b@example.com', student_id='400001')
+        self.url = reverse('gitlab_classroom:student-autocomplete')
+
+    def test_prefix_search_is_paginated(self):
+        response = self.client.get(self.url, {'q': 'ANNA'})
+        data = response.json()
+        self.assertEqual(len(data['results']), 20)
+        self.assertTrue(data['pagination']['more'])
+        self.assertEqual(data['results'][0]['text'], 'anna00 - Anna Nowak (300000)')
+
+        data = self.client.get(self.url, {'q': 'anna', 'page': 2}).json()
+        # 25 annas by username plus bob by second name
+        self.assertEqual(len(data['results']), 6)
+        self.assertFalse(data['pagination']['more'])
+
+    def test_search_by_student_id_excludes_classroom_members(self):
+        self.assertEqual(self.client.get(self.url, {'q': '4000'}).json()['results'][0]['id'], self.bob.pk)
+        self.classroom.students.add(self.bob)
+        data = self.client.get(self.url, {'q': '4000', 'classroom': self.classroom.pk}).json()
+        self.assertEqual(data['results'], [])
+
+    def test_prefix_search_matches_non_ascii_names(self):
+        lukasz = Student.objects.create(gitlab_id='101', gitlab_username='lukasz', first_name='Łukasz',
+                                        second_name='Żółć', email='l@example.com', student_id='400002')
+        for query in ('łuk', 'ŁUK', 'żół'):
+            data = self.client.get(self.url, {'q': query}).json()
+            self.assertEqual([result['id'] for result in data['results']], [lukasz.pk], query)
+
+        lukasz.first_name = 'Ósmy'
+        lukasz.save(update_fields=['first_name'])
+        self.assertEqual(self.client.get(self.url, {'q': 'ósm'}).json()['results'][0]['id'], lukasz.pk)
+
+    def test_classroom_page_does_not_render_every_student(self):
+        session = self.client.session
+        session['access_token'] = 'token'
+        session.save()
+        response = self.client.get(self.classroom.get_absolute_url())
+        self.assertNotContains(response, 'anna00')
+        self.assertContains(response, 'data-autocomplete-url')
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.jozef = Student.objects.create(gitlab_id='1', gitlab_username='jkowal', first_name='Józef',
+                                            second_name='Kowalski', email='jozef@pw.edu.pl', student_id='301234')
+        Student.objects.bulk_create([
+            Student(gitlab_id='2', gitlab_username='anowak', first_name='Anna', second_name='Nowak',
+                    email='anna@example.com', student_id='305555'),
+        ])
+
+    def usernames(self, term):
+        return sorted(search.search(Student.objects.all(), term).values_list('gitlab_username', flat=True))
+
+    def test_fts_search_over_all_student_fields(self):
+        self.assertEqual(search.get_backend().__class__, search.Fts5Backend)
+        self.assertEqual(self.usernames('jozef'), ['jkowal'])
+        self.assertEqual(self.usernames('kowal'), ['jkowal'])
+        self.assertEqual(self.usernames('3055'), ['anowak'])
+        self.assertEqual(self.usernames('example.com'), ['anowak'])
+        self.assertEqual(self.usernames('anna nowak'), ['anowak'])
+        self.assertEqual(self.usernames('anna kowalski'), [])
+        self.assertEqual(self.usernames('"unbalanced AND'), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.jozef.second_name = 'Malinowski'
+        self.jozef.save()
+        self.assertEqual(self.usernames('kowalski'), [])
+        self.assertEqual(self.usernames('malinowski'), ['jkowal'])
+        self.jozef.delete()
+        self.assertEqual(self.usernames('malinowski'), [])
+
+    @override_settings(SEARCH_BACKEND='like')
+    def test_like_backend(self):
+        self.assertEqual(self.usernames('nowa'), ['anowak'])
+
+    def test_rebuild_command(self):
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.usernames('anna'), ['anowak'])
+
+    def test_list_views_search_descriptions(self):
+        teacher = User.objects.create_user(username='teacher', password='12345')
+        self.client.login(username='teacher', password='12345')
+        Classroom.objects.create(title='Databases', description='SQL and query planning', organization='Org',
+                                 teacher=teacher)
+        Classroom.objects.create(title='Compilers', description='Parsing', organization='Org', teacher=teacher)
+
+        response = self.client.get(reverse('gitlab_classroom:classroom-list'), {'title': 'query'})
+        self.assertEqual([c.title for c in response.context['classroom_list']], ['Databases'])
+        response = self.client.get(reverse('gitlab_classroom:student-list'), {'query': 'kowalski'})
+        self.assertEqual(list(response.context['student_list']), [self.jozef])
+
+
+@override_settings(LIST_PAGINATION='cursor')
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        User.objects.create_user(username='teacher', password='12345')
+        self.client.login(username='teacher', password='12345')
+        #two students share a first name, so the id has to break the tie
+        Student.objects.bulk_create([
+            Student(gitlab_id=str(i), gitlab_username=f'user{i}', first_name='Same' if i in (3, 4) else f'Name{i}',
+                    email=f'user{i}@pw.edu.pl')
+            for i in range(12)
+        ])
+        self.expected = list(Student.objects.order_by('-first_name', '-id'))
+
+    def walk(self, name, **params):
+        url = reverse(f'gitlab_classroom:{name}')
+        response = self.client.get(url, params)
+        pages = [list(response.context['object_list'])]
+        while response.context['page_obj'].has_next():
+            response = self.client.get(url, dict(params, cursor=response.context['page_obj'].next_cursor))
+            pages.append(list(response.context['object_list']))
+        return response, pages
+
+    def test_pages_follow_the_ordering(self):
+        response, pages = self.walk('student-list')
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertContains(response, '12 total')
+
+        previous = response.context['page_obj'].previous_cursor
+        response = self.client.get(reverse('gitlab_classroom:student-list'), {'cursor': previous})
+        self.assertEqual(list(response.context['student_list']), self.expected[5:10])
+        self.assertTrue(response.context['page_obj'].has_previous())
+
+    def test_cursor_links_keep_the_search(self):
+        response = self.client.get(reverse('gitlab_classroom:student-list'), {'query': 'pw.edu.pl', 'page': '2'})
+        cursor = response.context['page_obj'].next_cursor
+        self.assertContains(response, f'?query=pw.edu.pl&amp;cursor={cursor}"')
+
+    @override_settings(PAGINATION_EXACT_COUNT=False)
+    def test_without_count(self):
+        with self.assertNumQueries(3):  # session, user, page
+            response = self.client.get(reverse('gitlab_classroom:student-list'))
+        self.assertNotContains(response, 'total')
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('gitlab_classroom:student-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_classrooms_by_creation_date(self):
+        teacher = User.objects.get(username='teacher')
+        for i in range(7):
+            Classroom.objects.create(title=f'Classroom {i}', description='d', organization='Org', teacher=teacher)
+        _, pages = self.walk('classroom-list')
+        self.assertEqual([len(page) for page in pages], [5, 2])
+        self.assertEqual(sum(pages, []), list(Classroom.objects.order_by('-creation_date', '-id')))
+
+
+class ListCountsTest(TestCase):
+    def test_lists_show_counts_without_loading_students(self):
+        teacher = User.objects.create_user(username='teacher', password='12345')
+        self.client.login(username='teacher', password='12345')
+        full = Classroom.objects.create(title='Full', description='d', organization='Org', teacher=teacher)
+        Classroom.objects.create(title='Empty', description='d', organization='Org', teacher=teacher)
+        full.students.add(*Student.objects.bulk_create([
+            Student(gitlab_id=str(i), gitlab_username=f'user{i}', first_name='Name', email=f'user{i}@pw.edu.pl')
+            for i in range(3)
+        ]))
+        for i in range(2):
+            Assignment.objects.create(title=f'Lab {i}', description='d', deadline=timezone.now(),
+                                      repo_url='https://gitlab.example.com/lab', teacher=teacher, classroom=full)
+
+        response = self.client.get(reverse('gitlab_classroom:classroom-list'))
+        counts = {c.title: (c.student_count, c.assignment_count) for c in response.context['classroom_list']}
+        self.assertEqual(counts, {'Full': (3, 2), 'Empty': (0, 0)})
+        self.assertFalse(hasattr(response.context['classroom_list'][0], '_prefetched_objects_cache'))
+
+        response = self.client.get(reverse('gitlab_classroom:assignment-list'))
+        self.assertEqual([a.student_count for a in response.context['assignment_list']], [3, 3])
+
+
+class DashboardTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher', password='12345')
+        self.client.login(username='teacher', password='12345')
+        session = self.client.session
+        session.update({'name': 'Teacher', 'email': 'teacher@pw.edu.pl'})
+        session.save()
+        self.students = Student.objects.bulk_create([
+            Student(gitlab_id=str(i), gitlab_username=f'user{i}', first_name='Name', email=f'user{i}@pw.edu.pl',
+                    gl_flag=i != 0)
+            for i in range(4)
+        ])
+        for i in range(20):
+            classroom = Classroom.objects.create(title=f'Section {i}', description='d', organization='Org',
+                                                 teacher=self.teacher)
+            classroom.students.add(*self.students[:2 + i % 2])
+            Assignment.objects.create(title=f'Lab {i}', description='d', repo_url='https://gitlab.example.com/lab',
+                                      deadline=timezone.now() + timedelta(days=i + 1),
+                                      teacher=self.teacher, classroom=classroom)
+        self.classroom = classroom
+
+    def summary(self):
+        return dashboard.get_summary(self.teacher)
+
+    def test_summary_in_fixed_number_of_queries(self):
+        with self.assertNumQueries(3):
+            summary = self.summary()
+        self.assertEqual(len(summary['classrooms']), 20)
+        self.assertEqual((summary['students'], summary['without_gitlab_account'], summary['assignments']), (3, 1, 20))
+        self.assertEqual([a['title'] for a in summary['deadlines']], [f'Lab {i}' for i in range(5)])
+        with self.assertNumQueries(0):
+            self.summary()
+
+        response = self.client.get(reverse('gitlab_classroom:index'))
+        self.assertContains(response, 'Section 19')
+        self.assertContains(response, 'Without a GitLab account: 1')
+
+    def test_invalidated_by_changes(self):
+        self.summary()
+        self.classroom.students.add(self.students[3])
+        self.assertEqual(self.summary()['students'], 4)
+
+        self.students[3].classroom.remove(self.classroom)
+        self.assertEqual(self.summary()['students'], 3)
+
+        self.students[0].gl_flag = True
+        self.students[0].save()
+        self.assertEqual(self.summary()['without_gitlab_account'], 0)
+
+        self.students[2].delete()
+        self.assertEqual(self.summary()['students'], 2)
+
+        Assignment.objects.filter(classroom=self.classroom).first().delete()
+        self.assertEqual(self.summary()['assignments'], 19)
+
+        self.classroom.delete()
+        self.assertEqual(len(self.summary()['classrooms']), 19)
+
+
+class FakeGitlabAdapter(requests.adapters.BaseAdapter):
+    #answers every request with an empty JSON list after `delay` seconds
+    def __init__(self, delay=0, status=200):
+        super().__init__()
+        self.delay, self.status = delay, status
+
+    def send(self, request, **kwargs):
+        time.sleep(self.delay)
+        response = requests.Response()
+        response.status_code = self.status
+        response.headers['Content-Type'] = 'application/json'
+        response._content = b'[]'
+        response.url, response.request = request.url, request
+        return response
+
+    def close(self):
+        pass
+
+
+class GitlabInstrumentationTest(TestCase):
+    def session(self, **kwargs):
+        session = instrumentation.InstrumentedSession()
+        session.mount('https://', FakeGitlabAdapter(**kwargs))
+        return session
+
+    def test_endpoint_template(self):
+        template = instrumentation.endpoint_template
+        self.assertEqual(template('https://gl/api/v4/groups/12/subgroups?per_page=100'), 'groups/:id/subgroups')
+        self.assertEqual(template('https://gl/api/v4/projects/group%2Fproject/fork'), 'projects/:id/fork')
+        self.assertEqual(template('https://gl/api/v4/users'), 'users')
+        self.assertEqual(template('https://gl/api/v4/groups/prog_1'), 'groups/:id')
+        self.assertEqual(template('https://gl/api/v4/projects/5/repository/commits/0a1b2c'),
+                         'projects/:id/repository/commits/:id')
+        self.assertEqual(template('https://gl/api/v4/groups/5/members/all'), 'groups/:id/members/all')
+
+    def test_capture_counts_calls_per_endpoint(self):
+        session = self.session()
+        with instrumentation.capture() as stats:
+            session.get('https://gl/api/v4/groups/1/members')
+            session.get('https://gl/api/v4/groups/2/members')
+            session.post('https://gl/api/v4/projects/3/fork')
+        self.assertEqual(stats.count, 3)
+        self.assertEqual({key: count for key, (count, _) in stats.by_endpoint().items()},
+                         {'GET groups/:id/members': 2, 'POST projects/:id/fork': 1})
+        self.assertEqual([call.status for call in stats.calls], [200, 200, 200])
+
+    def test_worker_threads_count_with_propagate(self):
+        session = self.session()
+        with instrumentation.capture() as stats:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(instrumentation.propagate(lambda i: session.get(f'https://gl/api/v4/users/{i}')),
+                                  range(8)))
+        self.assertEqual(stats.count, 8)
+
+    @override_settings(GITLAB_SLOW_CALL_MS=10)
+    def test_slow_calls_logged(self):
+        with self.assertLogs('gitlab_classroom.gitlab', level='WARNING') as logs:
+            self.session(delay=0.02, status=502).get('https://gl/api/v4/groups/5')
+        self.assertEqual(logs.records[0].gitlab_endpoint, 'groups/:id')
+        self.assertEqual(logs.records[0].gitlab_status, 502)
+
+    def test_middleware_sets_server_timing(self):
+        session = self.session()
+
+        def view(request):
+            session.get('https://gl/api/v4/groups/1/subgroups')
+            return HttpResponse('ok')
+
+        request = RequestFactory().get('/')
+        response = instrumentation.GitlabTimingMiddleware(view)(request)
+        self.assertEqual(request.gitlab_stats.count, 1)
+        self.assertRegex(response['Server-Timing'],
+                         r'^gitlab;dur=[\d.]+;desc="1 GitLab calls", gitlab-0;dur=[\d.]+;desc="GET groups/:id/subgroups x1"$')
+
+    def test_pooled_clients_are_instrumented(self):
+        gitlab_client.clear()
+        self.addCleanup(gitlab_client.clear)
+        client = gitlab_client.get_client('token', url='https://gl')
+        self.assertIsInstance(client.session, instrumentation.InstrumentedSession)
+        response = self.client.get(reverse('accounts:login'))
+        self.assertIn('Server-Timing', response)
+
+
+class MetricsTest(TestCase):
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requests_are_measured(self):
+        User.objects.create_user(username='teacher', password='12345')
+        self.client.login(username='teacher', password='12345')
+        labels = {'view': 'gitlab_classroom:student-list', 'method': 'GET', 'status': '200'}
+        before = self.sample('gitlab_classroom_request_duration_seconds_count', **labels)
+        queries = self.sample('gitlab_classroom_request_db_queries_sum', view='gitlab_classroom:student-list')
+        self.client.get(reverse('gitlab_classroom:student-list'))
+        self.assertEqual(self.sample('gitlab_classroom_request_duration_seconds_count', **labels), before + 1)
+        self.assertGreater(self.sample('gitlab_classroom_request_db_queries_sum',
+                                       view='gitlab_classroom:student-list'), queries)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'gitlab_classroom_request_duration_seconds_bucket{', response.content)
+
+    def test_gitlab_calls_and_rate_limit(self):
+        class RateLimitedAdapter(FakeGitlabAdapter):
+            def send(self, request, **kwargs):
+                response = super().send(request, **kwargs)
+                response.headers['RateLimit-Remaining'] = '1999'
+                return response
+
+        session = instrumentation.InstrumentedSession()
+        session.mount('https://', RateLimitedAdapter())
+        labels = {'method': 'GET', 'endpoint': 'groups/:id/members', 'status': '200'}
+        before = self.sample('gitlab_classroom_gitlab_calls_total', **labels)
+        session.get('https://metrics.example/api/v4/groups/4/members')
+        self.assertEqual(self.sample('gitlab_classroom_gitlab_calls_total', **labels), before + 1)
+        self.assertEqual(self.sample('gitlab_classroom_gitlab_ratelimit_remaining', instance='metrics.example'), 1999)
+
+    def test_jobs_are_counted(self):
+        teacher = User.objects.create_user(username='teacher', password='12345')
+        before = self.sample('gitlab_classroom_jobs_total', kind=GitlabJob.DELETE_GROUP, status=GitlabJob.FAILED)
+        jobs.enqueue(GitlabJob.DELETE_GROUP, teacher, 'token')  # no group_id, fails
+        with self.assertLogs('gitlab_classroom.jobs', level='ERROR'):
+            jobs.run_pending()
+        self.assertEqual(self.sample('gitlab_classroom_jobs_total', kind=GitlabJob.DELETE_GROUP,
+                                     status=GitlabJob.FAILED), before + 1)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+class RateLimitTest(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(GITLAB_RATELIMIT_DIR=directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        ratelimit._limiters.clear()
+        self.addCleanup(ratelimit._limiters.clear)
+
+    def response(self, status=200, **headers):
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        return response
+
+    def test_bucket_is_shared_between_limiters(self):
+        # two limiters stand for two processes using the same instance
+        first = ratelimit.RateLimiter('gl', rate=10, burst=2)
+        second = ratelimit.RateLimiter('gl', rate=10, burst=2)
+        self.assertEqual(first.acquire(), 0)
+        self.assertEqual(second.acquire(), 0)
+        self.assertAlmostEqual(first.acquire(), 0.1, delta=0.02)
+        self.assertAlmostEqual(second.acquire(), 0.2, delta=0.02)
+
+    def test_rate_follows_headers(self):
+        limiter = ratelimit.RateLimiter('gl', rate=10, burst=1)
+        limiter.update(self.response(**{'RateLimit-Remaining': '5', 'RateLimit-Reset': str(int(time.time()) + 10)}))
+        with limiter.state() as (state, _):
+            self.assertAlmostEqual(state['rate'], 0.5, delta=0.06)
+
+    def test_throttled_response_blocks_every_process(self):
+        ratelimit.RateLimiter('gl', rate=10, burst=5).update(self.response(429, **{'Retry-After': '30'}))
+        self.assertAlmostEqual(ratelimit.RateLimiter('gl', rate=10, burst=5).acquire(), 30, delta=1)
+
+    def test_session_retries_throttled_calls(self):
+        responses = [self.response(429, **{'Retry-After': '0'}), self.response(429), self.response(200)]
+
+        class ThrottlingAdapter(FakeGitlabAdapter):
+            def send(self, request, **kwargs):
+                response = responses.pop(0)
+                response.request, response.url = request, request.url
+                return response
+
+        session = ratelimit.RateLimitedSession()
+        session.mount('https://', ThrottlingAdapter())
+        with patch('gitlab_classroom.ratelimit.time.sleep') as sleep, instrumentation.capture() as stats:
+            response = session.get('https://gl/api/v4/projects/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([call.status for call in stats.calls], [429, 429, 200])
+        self.assertTrue(sleep.called)
+
+    def test_pooled_clients_are_rate_limited(self):
+        gitlab_client.clear()
+        self.addCleanup(gitlab_client.clear)
+        self.assertIsInstance(gitlab_client.get_client('token', url='https://gl').session,
+                              ratelimit.RateLimitedSession)
+
+    @patch('gitlab.Gitlab')
+    def test_missing_template_reported(self, mock_gitlab):
+        gitlab_client.clear()
+        teacher = User.objects.create_user(username='teacher', password='12345', gitlab_id='1')
+        classroom = Classroom.objects.create(title='C', description='d', organization='Org', teacher=teacher,
+                                             gitlab_id=1, members_gitlab_id=2, assignments_gitlab_id=3)
+        assignment = Assignment.objects.create(title='A', description='d', deadline=timezone.now(),
+                                               repo_url='https://gitlab.example.com/a', teacher=teacher,
+                                               classroom=classroom)
+        gl = mock_gitlab.return_value
+        gl.projects.get.side_effect = gitlab.exceptions.GitlabGetError('404 Project Not Found', 404)
+        gl.groups.get.return_value.members.list.return_value = [MagicMock(id=2, username='student')]
+        job = jobs.enqueue(GitlabJob.FORK_PROJECTS, teacher, 'token', assignment=assignment, template_id='789')
+        with self.assertLogs('gitlab_classroom.jobs', level='ERROR'):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.error, 'There is no template with ID 789.')
+
+
+class CircuitBreakerTest(TestCase):
+    def setUp(self):
+        gitlab_client.clear()
+        breaker._breakers.clear()
+        self.addCleanup(breaker._breakers.clear)
+        self.teacher = User.objects.create_user(username='teacher', password='12345')
+        self.client.login(username='teacher', password='12345')
+        session = self.client.session
+        session['access_token'] = 'token'
+        session.save()
+
+    def session(self, adapter):
+        session = breaker.CircuitBreakerSession()
+        session.mount('https://', adapter)
+        return session
+
+    @override_settings(GITLAB_BREAKER_THRESHOLD=2, GITLAB_BREAKER_RESET_TIMEOUT=0.05)
+    def test_opens_after_failures_and_recovers(self):
+        class DownAdapter(FakeGitlabAdapter):
+            calls = 0
+
+            def send(self, request, **kwargs):
+                DownAdapter.calls += 1
+                raise requests.exceptions.ConnectTimeout('timed out')
+
+        session = self.session(DownAdapter())
+        for _ in range(3):
+            with self.assertRaises(breaker.GitlabUnavailable):
+                session.get('https://gl/api/v4/groups/1')
+        self.assertEqual(DownAdapter.calls, 2)  # the third call failed fast
+        self.assertTrue(breaker.breaker_for('https://gl').is_open)
+
+        time.sleep(0.06)
+        session.mount('https://', FakeGitlabAdapter())
+        self.assertEqual(session.get('https://gl/api/v4/groups/1').status_code, 200)
+        self.assertFalse(breaker.breaker_for('https://gl').is_open)
+
+    @override_settings(GITLAB_BREAKER_THRESHOLD=2)
+    def test_server_errors_count_as_failures(self):
+        session = self.session(FakeGitlabAdapter(status=503))
+        session.get('https://gl/api/v4/groups/1')
+        session.get('https://gl/api/v4/groups/1')
+        with self.assertRaises(breaker.GitlabUnavailable):
+            session.get('https://gl/api/v4/groups/1')
+
+    @override_settings(GITLAB_BREAKER_THRESHOLD=1, GITLAB_BREAKER_RESET_TIMEOUT=0.05)
+    def test_trial_call_raising_anything_opens_again(self):
+        class BrokenAdapter(FakeGitlabAdapter):
+            def send(self, request, **kwargs):
+                raise requests.exceptions.ChunkedEncodingError('connection broken')
+
+        session = self.session(FakeGitlabAdapter(status=503))
+        session.get('https://gl/api/v4/groups/1')
+        time.sleep(0.06)
+        session.mount('https://', BrokenAdapter())
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            session.get('https://gl/api/v4/groups/1')
+        self.assertEqual(breaker.breaker_for('https://gl').state, breaker.OPEN)
+        with self.assertRaises(breaker.GitlabUnavailable):
+            session.get('https://gl/api/v4/groups/1')
+
+    @override_settings(GITLAB_CONNECT_TIMEOUT=2, GITLAB_READ_TIMEOUT=7)
+    def test_clients_have_timeouts(self):
+        self.assertEqual(gitlab_client.get_client('token', url='https://gl').timeout, (2, 7))
+
+    @patch('gitlab.Gitlab')
+    def test_update_queues_sync_while_gitlab_is_down(self, mock_gitlab):
+        classroom = Classroom.objects.create(title='Old', description='d', organization='Org', gitlab_id=5,
+                                             teacher=self.teacher)
+        gl = mock_gitlab.return_value
+        gl.groups.get.side_effect = breaker.GitlabUnavailable('down')
+        response = self.client.post(reverse('gitlab_classroom:classroom-update', kwargs={'pk': classroom.pk}),
+                                    {'title': 'New', 'description': 'd2', 'organization': 'Org'})
+        self.assertEqual(response.status_code, 302)
+        classroom.refresh_from_db()
+        self.assertEqual(classroom.title, 'New')
+        job = GitlabJob.objects.get(kind=GitlabJob.SYNC_GROUP)
+        self.assertEqual(job.classroom, classroom)
+
+        gl.groups.get.side_effect = None
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, GitlabJob.DONE)
+        gl.groups.get.assert_called_with(5, lazy=True)
+        self.assertEqual(gl.groups.get.return_value.name, 'New')
+        gl.groups.get.return_value.save.assert_called_once()
+
+    @patch('gitlab.Gitlab')
+    def test_jobs_wait_for_gitlab(self, mock_gitlab):
+        mock_gitlab.return_value.groups.get.return_value.delete.side_effect = breaker.GitlabUnavailable('down')
+        job = jobs.enqueue(GitlabJob.DELETE_GROUP, self.teacher, 'token', group_id=5)
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.access_token), (GitlabJob.QUEUED, 1, 'token'))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(jobs.run_pending(), 0)  # not before run_after
+
+        GitlabJob.objects.filter(pk=job.pk).update(run_after=timezone.now(), attempts=4)
+        with self.assertLogs('gitlab_classroom.jobs', level='WARNING'):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, GitlabJob.FAILED)
+
+
+@override_settings(GITLAB_RATELIMIT_RATE=10000, GITLAB_RATELIMIT_BURST=10000)
+class FakeGitlabTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fake = FakeGitlab().start()
+        cls.addClassCleanup(cls.fake.stop)
+
+    def setUp(self):
+        gitlab_client.clear()
+        breaker._breakers.clear()
+        ratelimit._limiters.clear()
+        self.fake.faults = Faults()
+        self.gl = gitlab_client.get_client(f'token-{self._testMethodName}', url=self.fake.url)
+        self.gl.auth()
+        self.teacher_id = self.gl.user.id
+
+    def test_users(self):
+        self.assertTrue(self.gl.user.username.startswith('teacher_'))
+        self.fake.add_user('jkowal')
+        self.assertEqual([u.username for u in self.gl.users.list(username='jkowal')], ['jkowal'])
+        with self.assertRaises(gitlab.exceptions.GitlabAuthenticationError):
+            gitlab_client.get_client('invalid-token', url=self.fake.url).auth()
+
+    def test_subgroups_are_paginated(self):
+        parent = self.gl.groups.create({'name': 'Course', 'path': 'course-subgroups'})
+        for i in range(25):
+            self.gl.groups.create({'name': f'Sub {i}', 'path': f'sub{i}', 'parent_id': parent.id})
+        self.assertEqual(len(self.gl.groups.get(parent.id, lazy=True).subgroups.list(all=True)), 25)
+        self.assertEqual(len(self.gl.groups.get(parent.id, lazy=True).subgroups.list()), 20)
+
+    def test_add_members(self):
+        group = self.gl.groups.create({'name': 'Members', 'path': 'members-add'})
+        users = [self.fake.add_user(f'member{i}') for i in range(3)]
+        students = Student.objects.bulk_create(
+            [Student(gitlab_id=str(u['id']), gitlab_username=u['username'], email=f"{u['username']}@pw.edu.pl")
+             for u in users] + [Student(gitlab_id='', gitlab_username='ghost', email='ghost@pw.edu.pl')])
+        add_members(self.gl, group, students[:1])  # already a member the second time
+        added, failures = add_members(self.gl, group, students)
+        self.assertEqual(added, students[:3])
+        self.assertEqual(list(failures), [students[3]])
+        self.assertEqual(len(group.members.list(all=True)), 4)  # with the teacher who created it
+
+    def test_fork_engine_end_to_end(self):
+        templates = self.fake.add_group('templates', path='templates-e2e')
+        template = self.fake.add_project('template', namespace_id=templates['id'])
+        members = self.gl.groups.create({'name': 'E2E members', 'path': 'e2e-members'})
+        assignments = self.gl.groups.create({'name': 'E2E assignments', 'path': 'e2e-assignments'})
+        users = [self.fake.add_user(f'forker{i}') for i in range(6)]
+        self.gl.http_post(f'/groups/{members.id}/members',
+                          post_data={'user_id': ','.join(str(u['id']) for u in users), 'access_level': 30})
+        students = members.members.list(all=True)
+
+        report = fork_projects(self.gl, assignments, template['id'], students, skip_user_id=self.teacher_id)
+        self.assertEqual((len(report.created), len(report.failed)), (6, 0))
+        report = fork_projects(self.gl, assignments, template['id'], students, skip_user_id=self.teacher_id)
+        self.assertEqual(len(report.existed), 6)
+
+    def test_fault_injection(self):
+        self.fake.faults = Faults(endpoint_latency={'GET groups/:id': 0.05}, error_rate={'POST groups': 1.0})
+        group = self.fake.add_group('faults', path='faults')
+        with instrumentation.capture() as stats:
+            self.gl.groups.get(group['id'])
+        self.assertGreaterEqual(stats.duration, 0.05)
+        with self.assertRaises(gitlab.exceptions.GitlabCreateError):
+            self.gl.groups.create({'name': 'Broken', 'path': 'broken'})
+
+    def test_rate_limit_headers(self):
+        self.fake.faults = Faults(rate_limit=2)
+        url = f'{self.fake.url}/api/v4/user'
+        headers = {'PRIVATE-TOKEN': 'rate-limited'}
+        self.assertEqual(requests.get(url, headers=headers).headers['RateLimit-Remaining'], '1')
+        requests.get(url, headers=headers)
+        response = requests.get(url, headers=headers)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+
+
+class LoadTestTest(TransactionTestCase):  # the teachers are threads, with connections of their own
+    def setUp(self):
+        gitlab_client.clear()
+        breaker._breakers.clear()
+        ratelimit._limiters.clear()
+        cache.clear()
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([loadtest.percentile(values, q) for q in (50, 95, 99)], [50, 95, 99])
+        self.assertEqual(loadtest.percentile([], 50), 0)
+
+    def test_teachers(self):
+        with loadtest.fake_gitlab(students=6) as (fake, template_id):
+            report = loadtest.LoadTest(loadtest.InProcessClient, teachers=2, iterations=6, think_time=0,
+                                       template_id=template_id, students=6, workers=1).run()
+        #sqlite may refuse a write of one thread while another writes, the report has to show it
+        urls = report['urls']
+        self.assertEqual(urls['login (POST)']['requests'], 2)
+        created = urls['classroom-create (POST)']
+        self.assertEqual(Classroom.objects.count(), created['requests'] - created['errors'])
+        self.assertGreater(Classroom.objects.count(), 0)
+        self.assertEqual(report['requests'], sum(url['requests'] for url in urls.values()))
+        self.assertEqual(report['errors'], sum(url['errors'] for url in urls.values()))
+        self.assertEqual(sum(report['jobs'].values()), GitlabJob.objects.count())
+
+    def test_errors_are_reported(self):
+        with loadtest.fake_gitlab(students=1, faults=Faults(error_rate={'GET user': 1.0})) as (fake, template_id):
+            with self.assertLogs('django.request', 'ERROR'):
+                report = loadtest.LoadTest(loadtest.InProcessClient, teachers=1, think_time=0).run()
+        login = report['urls']['login (POST)']
+        self.assertEqual((login['error_rate'], login['error_reasons']), (1.0, {'HTTP 500': 1}))
+        self.assertNotIn('classroom-create', report['urls'])  # gave up after the failed login
+
+
+@override_settings(SUBMISSION_ACTIVITY_SLACK=0)
+class SubmissionTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fake = FakeGitlab().start()
+        cls.addClassCleanup(cls.fake.stop)
+
+    def setUp(self):
+        gitlab_client.clear()
+        breaker._breakers.clear()
+        ratelimit._limiters.clear()
+        self.gl = gitlab_client.get_client('submissions', url=self.fake.url)
+        self.teacher = User.objects.create_user(username='teacher', password='12345', gitlab_id='1')
+        self.classroom = Classroom.objects.create(title='Course', description='d', organization='o',
+                                                  teacher=self.teacher)
+        group = self.fake.add_group('Lab', path=f'lab-{self._testMethodName}')
+        self.assignment = Assignment.objects.create(title='Lab', description='d', teacher=self.teacher,
+                                                    classroom=self.classroom, gitlab_id=group['id'],
+                                                    deadline=timezone.now() + timedelta(days=1))
+        self.projects = {}
+        for username in ('anna', 'jan', 'ola'):
+            self.classroom.students.add(Student.objects.create(gitlab_username=username, email=f'{username}@pw.edu.pl'))
+            self.projects[username] = self.fake.add_project('fork', namespace_id=group['id'],
+                                                            path=f'Lab_{username}_project')['id']
+        self.fake.add_project('notes', namespace_id=group['id'])
+        self.handed_in = self.fake.add_commit(self.projects['anna'], 'Solution')
+        self.fake.add_pipeline(self.projects['anna'], self.handed_in['id'], 'running')
+        late = (self.assignment.deadline + timedelta(hours=1)).isoformat()
+        self.fake.add_commit(self.projects['anna'], 'Too late', committed_date=late)
+        self.fake.add_commit(self.projects['jan'], 'Solution')
+
+    def calls(self, func):
+        before = len(self.fake.calls)
+        result = func()
+        return result, self.fake.calls[before:]
+
+    def test_full_sweep(self):
+        report = submissions.collect(self.gl, self.assignment)
+        self.assertEqual((report.projects, report.collected, report.unmatched), (4, 3, ['notes']))
+        anna = Submission.objects.get(student__gitlab_username='anna')
+        self.assertEqual((anna.commit_sha, anna.pipeline_status), (self.handed_in['id'], 'running'))
+        self.assertEqual(Submission.objects.get(student__gitlab_username='ola').commit_sha, '')
+        self.assertIsNotNone(Assignment.objects.get(pk=self.assignment.pk).submissions_collected_at)
+
+    def test_incremental_sweep(self):
+        submissions.collect(self.gl, self.assignment)
+        #nothing changed: the group, one page of projects and anna's unfinished pipeline
+        self.fake.add_pipeline(self.projects['anna'], self.handed_in['id'], 'success')
+        report, calls = self.calls(lambda: submissions.collect(self.gl, self.assignment))
+        self.assertEqual([endpoint for _, endpoint, _ in calls],
+                         ['groups/:id', 'groups/:id/projects', 'projects/:id/pipelines'])
+        self.assertEqual(Submission.objects.get(student__gitlab_username='anna').pipeline_status, 'success')
+
+        commit = self.fake.add_commit(self.projects['ola'], 'Solution')
+        report, calls = self.calls(lambda: submissions.collect(self.gl, self.assignment))
+        self.assertEqual((report.projects, len(calls)), (1, 4))
+        self.assertEqual(Submission.objects.get(student__gitlab_username='ola').commit_sha, commit['id'])
+        self.assertEqual(Submission.objects.count(), 3)
+
+        report, calls = self.calls(lambda: submissions.collect(self.gl, self.assignment, incremental=False))
+        self.assertEqual(report.projects, 4)
+
+    def test_job_queues_next_sweep(self):
+        job = jobs.enqueue(GitlabJob.COLLECT_SUBMISSIONS, self.teacher, 'submissions', assignment=self.assignment,
+                           incremental=False)
+        with override_settings(GITLAB_URL=self.fake.url):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, GitlabJob.DONE, job.error)
+        self.assertIn('3 submission(s) collected', job.result['summary'])
+        following = GitlabJob.objects.get(status=GitlabJob.QUEUED)
+        self.assertEqual((following.payload, following.access_token), ({'incremental': True}, 'submissions'))
+        self.assertGreater(following.run_after, timezone.now())
+        self.assertTrue(following.scheduled)
+        self.assertFalse(following.is_active)
+
+        #a failing sweep doesn't end the schedule, and its retries don't queue more sweeps
+        following.delete()
+        job = jobs.enqueue(GitlabJob.COLLECT_SUBMISSIONS, self.teacher, 'submissions', assignment=self.assignment)
+        with override_settings(GITLAB_URL=self.fake.url), \
+                patch('gitlab_classroom.submissions.collect', side_effect=breaker.GitlabUnavailable('down')):
+            jobs.run_job(jobs.claim_next('test'))
+            GitlabJob.objects.filter(pk=job.pk).update(run_after=None)
+            jobs.run_job(jobs.claim_next('test'))
+        self.assertEqual(GitlabJob.objects.filter(status=GitlabJob.QUEUED).exclude(pk=job.pk).count(), 1)
+
+        self.assertIsNone(submissions.next_sweep(self.assignment, now=self.assignment.deadline + timedelta(days=1)))
+        self.assertEqual(submissions.next_sweep(self.assignment, now=self.assignment.deadline),
+                         self.assignment.deadline + timedelta(hours=1))
+
+    def test_view_starts_collecting_once(self):
+        self.client.login(username='teacher', password='12345')
+        session = self.client.session
+        session['access_token'] = 'submissions'
+        session.save()
+        url = reverse('gitlab_classroom:assignment-detail', args=[self.assignment.pk])
+        self.client.post(url, {'collect_submissions': ''})
+        self.client.post(url, {'collect_submissions': ''})
+        self.assertEqual(GitlabJob.objects.filter(kind=GitlabJob.COLLECT_SUBMISSIONS).count(), 1)
+        Submission.objects.create(student=Student.objects.get(gitlab_username='jan'), assignment=self.assignment,
+                                  project_id=1, commit_sha='0123456789abcdef', pipeline_status='failed')
+        self.assertContains(self.client.get(url), '<code>01234567</code>')
+
+    def test_scheduled_sweep_does_not_reload_the_page(self):
+        self.client.login(username='teacher', password='12345')
+        jobs.enqueue(GitlabJob.COLLECT_SUBMISSIONS, self.teacher, 'submissions', assignment=self.assignment,
+                     run_after=self.assignment.deadline)
+        response = self.client.get(reverse('gitlab_classroom:assignment-detail', args=[self.assignment.pk]))
+        self.assertContains(response, 'Scheduled for')
+        self.assertNotContains(response, 'location.reload')
+
+        for _ in range(2):
+            jobs.enqueue(GitlabJob.MIRROR_REPOSITORIES, self.teacher, 'submissions', assignment=self.assignment)
+        response = self.client.get(reverse('gitlab_classroom:assignment-detail', args=[self.assignment.pk]))
+        html = response.content.decode()
+        self.assertEqual(html.count('location.reload'), 1)
+        self.assertGreater(html.index('location.reload'), html.index('</ul>', html.index('GitLab operations')))
+
+
+class WebhookTest(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='12345', gitlab_id='1')
+        self.classroom = Classroom.objects.create(title='Course', description='d', organization='o',
+                                                  teacher=self.teacher)
+        self.assignment = Assignment.objects.create(title='Lab', description='d', teacher=self.teacher,
+                                                    classroom=self.classroom, gitlab_id=10,
+                                                    deadline=timezone.now() + timedelta(days=1))
+        for username in ('kowalski', 'jan_kowalski'):
+            self.classroom.students.add(Student.objects.create(gitlab_username=username, email=f'{username}@pw.edu.pl'))
+        self.url = reverse('gitlab_classroom:gitlab-webhook', args=[self.assignment.pk])
+        self.deliveries = 0
+
+    def deliver(self, event, payload, token=None, key=None):
+        self.deliveries += 1
+        return self.client.post(self.url, payload, content_type='application/json', HTTP_X_GITLAB_EVENT=event,
+                                HTTP_X_GITLAB_TOKEN=token or webhooks.secret(self.assignment.pk),
+                                HTTP_IDEMPOTENCY_KEY=key or f'delivery-{self.deliveries}')
+
+    def push(self, sha, committed, project_id=7, path='lab_jan_kowalski_project', ref='refs/heads/main'):
+        return self.deliver('Push Hook', {
+            'object_kind': 'push', 'ref': ref,
+            'project': {'id': project_id, 'path_with_namespace': f'course/assignments/{path}', 'default_branch': 'main'},
+            'commits': [{'id': sha, 'timestamp': committed.isoformat()}],
+        })
+
+    def pipeline(self, pipeline_id, sha, status, project_id=7):
+        return self.deliver('Pipeline Hook', {
+            'object_kind': 'pipeline', 'project': {'id': project_id},
+            'object_attributes': {'id': pipeline_id, 'sha': sha, 'status': status},
+        })
+
+    def test_receiver_verifies_and_deduplicates(self):
+        self.assertEqual(self.deliver('Push Hook', {}, token='wrong').status_code, 403)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.deliver('Push Hook', {}, key='same').status_code, 200)
+        self.assertEqual(self.deliver('Push Hook', {}, key='same').status_code, 200)  # redelivered
+        self.assertEqual(self.deliver('Issue Hook', {}).status_code, 200)
+        self.assertEqual(self.client.post(self.url, 'not json', content_type='application/json',
+                                          HTTP_X_GITLAB_EVENT='Push Hook',
+                                          HTTP_X_GITLAB_TOKEN=webhooks.secret(self.assignment.pk)).status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+
+    def test_events_update_submissions(self):
+        start = timezone.now()
+        self.push('first', start)
+        self.pipeline(100, 'first', 'success')
+        self.push('second', start + timedelta(minutes=5))
+        self.pipeline(101, 'second', 'success')
+        self.pipeline(101, 'second', 'running')  # arrived late
+        self.push('too-late', self.assignment.deadline + timedelta(minutes=1))
+        self.push('other-branch', start + timedelta(minutes=10), ref='refs/heads/draft')
+        self.push('readme', start, project_id=8, path='readme')
+        self.assertEqual(webhooks.process_pending(batch_size=3), 8)
+
+        submission = Submission.objects.get()
+        self.assertEqual(submission.student.gitlab_username, 'jan_kowalski')
+        self.assertEqual((submission.commit_sha, submission.pipeline_id, submission.pipeline_status),
+                         ('second', 101, 'success'))
+        self.assertFalse(WebhookEvent.objects.filter(processed_at__isnull=True).exists())
+
+        #out of order: an older push applied later changes nothing
+        self.push('first', start)
+        self.pipeline(102, 'second', 'running')  # retried
+        webhooks.process_pending()
+        submission.refresh_from_db()
+        self.assertEqual((submission.commit_sha, submission.pipeline_status), ('second', 'running'))
+
+    def test_events_of_a_dead_worker_are_claimed_again(self):
+        self.push('first', timezone.now())
+        self.assertEqual(len(webhooks.claim('dead', 10)), 1)
+        self.assertEqual(webhooks.process_pending(), 0)
+
+        WebhookEvent.objects.update(claimed_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(webhooks.process_pending(), 1)
+        self.assertEqual(Submission.objects.get().commit_sha, 'first')
+
+    def test_register(self):
+        with FakeGitlab() as fake:
+            gl = gitlab_client.get_client('webhooks', url=fake.url)
+            group = fake.add_group('Lab', path='lab-hooks')
+            webhooks.register(gl, group['id'], self.assignment, 'https://classroom.example.com' + self.url)
+        hook = fake.hooks[self.assignment.webhook_id]
+        self.assertEqual((hook['token'], hook['push_events'], hook['pipeline_events']),
+                         (webhooks.secret(self.assignment.pk), True, True))
+        self.assertEqual(Assignment.objects.get().webhook_id, hook['id'])
+        #kept current by the events, swept only once more after the deadline
+        self.assertEqual(submissions.next_sweep(self.assignment), self.assignment.deadline + timedelta(hours=1))
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fake = FakeGitlab().start()
+        cls.addClassCleanup(cls.fake.stop)
+
+    def setUp(self):
+        gitlab_client.clear()
+        breaker._breakers.clear()
+        ratelimit._limiters.clear()
+        directory = self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(GITLAB_URL=self.fake.url, EXPORT_CACHE_DIR=directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.teacher = User.objects.create_user(username='teacher', password='12345', gitlab_id='1')
+        classroom = Classroom.objects.create(title='Course', description='d', organization='o', teacher=self.teacher)
+        group = self.fake.add_group('Lab', path=f'lab-export-{self._testMethodName}')
+        self.assignment = Assignment.objects.create(title='Lab 1', description='d', teacher=self.teacher,
+                                                    classroom=classroom, gitlab_id=group['id'],
+                                                    deadline=timezone.now() + timedelta(days=1))
+        self.projects = {}
+        for username in ('anna', 'jan', 'ola'):
+            classroom.students.add(Student.objects.create(gitlab_username=username, email=f'{username}@pw.edu.pl'))
+            self.projects[username] = self.fake.add_project('fork', namespace_id=group['id'],
+                                                            path=f'Lab_{username}_project')['id']
+        self.fake.add_commit(self.projects['anna'], 'Anna solution')
+        self.fake.add_commit(self.projects['jan'], 'Jan solution')
+        self.client.login(username='teacher', password='12345')
+        session = self.client.session
+        session['access_token'] = 'export'
+        session.save()
+        self.url = reverse('gitlab_classroom:assignment-export', args=[self.assignment.pk])
+
+    def download(self):
+        response = self.client.get(self.url)
+        if response.status_code == 302:  # the submissions are collected first
+            jobs.run_pending()
+            response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertIn('attachment; filename="lab_1.zip"', response['Content-Disposition'])
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+    def archive_calls(self):
+        return sum(1 for _, endpoint, _ in self.fake.calls if endpoint.startswith('projects/:id/repository/archive'))
+
+    def test_export_streams_every_submission(self):
+        archive = self.download()
+        self.assertEqual(sorted(archive.namelist()), ['lab_1/anna/COMMIT', 'lab_1/anna/README.md',
+                                                      'lab_1/jan/COMMIT', 'lab_1/jan/README.md',
+                                                      'lab_1/manifest.csv'])
+        self.assertEqual(archive.read('lab_1/jan/COMMIT'), b'Jan solution\n')
+        manifest = archive.read('lab_1/manifest.csv').decode()
+        self.assertIn(Submission.objects.get(student__gitlab_username='anna').commit_sha, manifest)
+        self.assertIn('ola,,,,no submission', manifest)
+
+    def test_submissions_are_collected_by_the_worker_first(self):
+        calls = len(self.fake.calls)
+        response = self.client.get(self.url)
+        self.assertRedirects(response, self.assignment.get_absolute_url(), fetch_redirect_response=False)
+        self.client.get(self.url)
+        self.assertEqual(len(self.fake.calls), calls)  # no GitLab call in the request
+        job = GitlabJob.objects.get()
+        self.assertEqual((job.kind, job.status), (GitlabJob.COLLECT_SUBMISSIONS, GitlabJob.QUEUED))
+
+        jobs.run_pending()
+        self.assertEqual(self.client.get(self.url)['Content-Type'], 'application/zip')
+
+    def test_unchanged_submissions_come_from_the_cache(self):
+        before = self.archive_calls()
+        self.download()
+        self.assertEqual(self.archive_calls() - before, 2)
+        before = self.archive_calls()
+        self.assertEqual(self.download().read('lab_1/anna/COMMIT'), b'Anna solution\n')
+        self.assertEqual(self.archive_calls(), before)
+
+    def test_downloads_stay_close_to_the_stream(self):
+        submitted = []
+        executor = MagicMock()
+        executor.submit.side_effect = lambda fetch, gl, project_id, sha: submitted.append(project_id) or project_id
+        planned = [(name, MagicMock(project_id=i, commit_sha='sha')) for i, name in enumerate('abcdef')]
+        planned.insert(2, ('nobody', None))
+
+        items = export.fetches(executor, None, planned, 2)
+        self.assertEqual(next(items), ('a', planned[0][1], 0))
+        self.assertEqual(submitted, [0, 1])  # the one being written included
+        self.assertEqual([future for _, _, future in items], [1, None, 2, 3, 4, 5])
+
+    def test_broken_archive_is_recorded_in_the_manifest(self):
+        self.download()
+        anna = Submission.objects.get(student__gitlab_username='anna')
+        with open(export.cache_path(anna.commit_sha), 'wb') as f:
+            f.write(b'not a tar.gz')
+
+        archive = self.download()
+        self.assertEqual(archive.read('lab_1/jan/COMMIT'), b'Jan solution\n')
+        manifest = archive.read('lab_1/manifest.csv').decode()
+        self.assertRegex(manifest, r'anna,\w+,.*,failed: ')
+
+    def test_cache_is_trimmed_when_the_download_stops(self):
+        self.download()
+        response = self.client.get(self.url)
+        with self.settings(EXPORT_CACHE_MAX_BYTES=0):
+            next(iter(response.streaming_content))
+            response.close()
+        self.assertEqual([name for _, _, names in os.walk(self.cache_dir) for name in names], [])
+
+    def test_other_teachers_cannot_export(self):
+        User.objects.create_user(username='other', password='12345')
+        self.client.login(username='other', password='12345')
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_evict_least_recently_used(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for age, name in enumerate(['new', 'old', 'oldest']):
+            path = os.path.join(directory, name)
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100)
+            os.utime(path, (time.time() - age * 60,) * 2)
+        export.evict(directory, 250)
+        self.assertEqual(sorted(os.listdir(directory)), ['new', 'old'])
+
+
+class LocalForksMixin:  # forks of anna and jan in local repositories, mirrored from file:// URLs
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings_override = override_settings(MIRROR_DIR=os.path.join(self.directory, 'mirrors'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        teacher = User.objects.create_user(username='teacher', password='12345', gitlab_id='1')
+        classroom = Classroom.objects.create(title='Course', description='d', organization='o', teacher=teacher)
+        self.assignment = Assignment.objects.create(title='Lab', description='d', teacher=teacher, classroom=classroom,
+                                                    deadline=timezone.now() + timedelta(days=1))
+        self.remotes = {}
+        for project_id, username in enumerate(('anna', 'jan'), start=1):
+            student = Student.objects.create(gitlab_username=username, email=f'{username}@pw.edu.pl')
+            remote = self.remotes[username] = os.path.join(self.directory, username)
+            gitrepo.git('init', '--quiet', '--initial-branch=main', remote)
+            self.commit(username, 'Solution')
+            Submission.objects.create(student=student, assignment=self.assignment, project_id=project_id,
+                                      commit_sha=gitrepo.head(remote), last_activity_at=timezone.now())
+            RepositoryMirror.objects.create(student=student, assignment=self.assignment, project_id=project_id,
+                                            url=f'file://{remote}')
+
+    def commit(self, username, message):
+        with open(os.path.join(self.remotes[username], 'solution.py'), 'a') as f:
+            f.write(f'# {message}\n')
+        gitrepo.git('-C', self.remotes[username], 'add', 'solution.py')
+        gitrepo.git('-C', self.remotes[username], '-c', 'user.name=Student', '-c', 'user.email=s@pw.edu.pl',
+                    'commit', '--quiet', '-m', message)
+
+
+class MirrorTest(LocalForksMixin, TestCase):
+    def test_sync_fetches_only_changed_forks(self):
+        report = mirrors.sync(self.assignment, processes=2)
+        self.assertEqual((report.fetched, report.up_to_date, report.failed), (2, 0, []))
+        anna = RepositoryMirror.objects.get(student__gitlab_username='anna')
+        self.assertEqual(anna.head_sha, gitrepo.head(self.remotes['anna']))
+        self.assertTrue(gitrepo.has_commit(mirrors.mirror_path(anna), anna.head_sha))
+        self.assertGreater(anna.size_bytes, 0)
+
+        self.assertEqual(mirrors.sync(self.assignment).fetched, 0)  # nothing happened since
+        self.commit('jan', 'Fix')
+        Submission.objects.filter(student__gitlab_username='jan').update(last_activity_at=timezone.now())
+        report = mirrors.sync(self.assignment)
+        self.assertEqual((report.fetched, report.up_to_date), (1, 1))
+        self.assertEqual(RepositoryMirror.objects.get(student__gitlab_username='jan').head_sha,
+                         gitrepo.head(self.remotes['jan']))
+
+    def test_failed_fetch_is_reported(self):
+        RepositoryMirror.objects.filter(student__gitlab_username='jan').update(url='file:///nonexistent/repo')
+        report = mirrors.sync(self.assignment)
+        self.assertEqual((report.fetched, [username for username, _ in report.failed]), (1, ['jan']))
+        self.assertIsNone(RepositoryMirror.objects.get(student__gitlab_username='jan').fetched_at)
+
+    def test_least_recently_used_are_evicted(self):
+        mirrors.sync(self.assignment)
+        anna, jan = RepositoryMirror.objects.order_by('student__gitlab_username')
+        mirrors.use(anna)
+        self.assertEqual(mirrors.evict(anna.size_bytes), 1)
+        self.assertFalse(os.path.exists(mirrors.mirror_path(jan)))
+        self.assertTrue(os.path.exists(mirrors.mirror_path(anna)))
+        self.assertEqual(mirrors.sync(self.assignment).fetched, 1)  # fetched in full again
+
+    def test_mirrors_of_new_forks_are_added(self):
+        RepositoryMirror.objects.all().delete()
+        with FakeGitlab() as fake:
+            gl = gitlab_client.get_client('mirrors', url=fake.url)
+            projects = [fake.add_project(f'fork{i}')['id'] for i in range(2)]
+            for project_id, submission in zip(projects, Submission.objects.order_by('student__gitlab_username')):
+                submission.project_id = project_id
+                submission.save()
+            mirrors.add_forks(gl, self.assignment, mirrors.SyncReport())
+        self.assertEqual(list(RepositoryMirror.objects.values_list('url', flat=True)),
+                         [f'{fake.url}/fork0.git', f'{fake.url}/fork1.git'])
+
+
+SORTING = """
+def sort(items):
+    for i in range(len(items)):
+        for j in range(len(items) - 1 - i):
+            if items[j] > items[j + 1]:
+                items[j], items[j + 1] = items[j + 1], items[j]
+    return items
+"""
+
+SEARCHING = """
+def search(items, wanted):
+    low, high = 0, len(items) - 1
+    while low <= high:
+        middle = (low + high) // 2
+        if items[middle] == wanted:
+            return middle
+        if items[middle] < wanted:
+            low = middle + 1
+        else:
+            high = middle - 1
+    return -1
+"""
+
+INSERTING = """
+def sort(items):
+    result = []
+    for item in items:
+        position = 0
+        while position < len(result) and result[position] < item:
+            position += 1
+        result.insert(position, item)
+    return result
+"""
+
+
+class WinnowingTest(TestCase):
+    def test_renamed_copy_has_the_same_fingerprints(self):
+        renamed = SORTING.replace('items', 'values').replace('j', 'k')
+        fingerprints = winnowing.winnow(winnowing.hashes(SORTING, 12), 8)
+        self.assertTrue(fingerprints)
+        self.assertEqual(winnowing.winnow(winnowing.hashes(renamed, 12), 8), fingerprints)
+        self.assertFalse(fingerprints & winnowing.winnow(winnowing.hashes(SEARCHING, 12), 8))
+
+    def test_winnow_keeps_one_hash_per_window(self):
+        self.assertEqual(winnowing.winnow([5, 3, 8, 3, 9, 1, 7], 3), {3, 1})
+        self.assertEqual(winnowing.winnow([4, 2], 3), {2})
+        self.assertEqual(winnowing.winnow([], 3), set())
+
+
+@override_settings(SIMILARITY_MAX_OCCURRENCES=2, SIMILARITY_MIN_SCORE=0.5)
+class SimilarityTest(LocalForksMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.write('anna', 'template.py', SEARCHING)  # everyone starts from it
+        self.write('anna', 'solution.py', SORTING)
+        self.write('jan', 'template.py', SEARCHING)
+        self.write('jan', 'solution.py', SORTING.replace('items', 'numbers'))  # copied from anna
+        self.add_student('ola', 3, {'template.py': SEARCHING, 'solution.py': INSERTING})
+
+    def write(self, username, name, content):
+        with open(os.path.join(self.remotes[username], name), 'w') as f:
+            f.write(content)
+        gitrepo.git('-C', self.remotes[username], 'add', name)
+        gitrepo.git('-C', self.remotes[username], '-c', 'user.name=Student', '-c', 'user.email=s@pw.edu.pl',
+                    'commit', '--quiet', '-m', f'Add {name}')
+        Submission.objects.filter(student__gitlab_username=username).update(
+            commit_sha=gitrepo.head(self.remotes[username]), last_activity_at=timezone.now())
+
+    def add_student(self, username, project_id, files):
+        student = Student.objects.create(gitlab_username=username, email=f'{username}@pw.edu.pl')
+        self.remotes[username] = os.path.join(self.directory, username)
+        gitrepo.git('init', '--quiet', '--initial-branch=main', self.remotes[username])
+        Submission.objects.create(student=student, assignment=self.assignment, project_id=project_id)
+        RepositoryMirror.objects.create(student=student, assignment=self.assignment, project_id=project_id,
+                                        url=f'file://{self.remotes[username]}')
+        for name, content in files.items():
+            self.write(username, name, content)
+
+    def pairs(self):
+        return [(pair.student_a.gitlab_username, pair.student_b.gitlab_username)
+                for pair in SimilarPair.objects.select_related('student_a', 'student_b')]
+
+    def test_copies_are_ranked(self):
+        mirrors.sync(self.assignment)
+        report = similarity.update(self.assignment, processes=2)
+        self.assertEqual((report.fingerprinted, report.failed), (3, []))
+        self.assertEqual(self.pairs(), [('anna', 'jan')])  # sharing the template alone doesn't count
+        self.assertEqual(SimilarPair.objects.get().score, 1.0)
+
+        #a late submission is the only one fingerprinted and compared
+        self.add_student('piotr', 4, {'template.py': SEARCHING, 'solution.py': INSERTING.replace('item', 'x')})
+        mirrors.sync(self.assignment)
+        report = similarity.update(self.assignment)
+        self.assertEqual((report.fingerprinted, report.compared), (1, 1))
+        self.assertEqual(sorted(self.pairs()), [('anna', 'jan'), ('ola', 'piotr')])
+
+        self.assertEqual(similarity.update(self.assignment).fingerprinted, 0)
+
+    def test_unmirrored_submissions_are_skipped(self):
+        report = similarity.update(self.assignment)
+        self.assertEqual((report.fingerprinted, sorted(report.not_mirrored)), (0, ['anna', 'jan', 'ola']))
+
+    def test_detail_view_lists_pairs(self):
+        mirrors.sync(self.assignment)
+        similarity.update(self.assignment)
+        self.client.login(username='teacher', password='12345')
+        session = self.client.session
+        session['access_token'] = 'similarity'
+        session.save()
+        url = reverse('gitlab_classroom:assignment-detail', args=[self.assignment.pk])
+        self.assertContains(self.client.get(url), '<td>100%</td>')
+        self.client.post(url, {'check_similarity': ''})
+        self.client.post(url, {'check_similarity': ''})
+        self.assertEqual(GitlabJob.objects.filter(kind=GitlabJob.CHECK_SIMILARITY).count(), 1)
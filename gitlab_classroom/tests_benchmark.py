@@ -0,0 +1,156 @@
+"""Query and latency budgets of every page, on a database of a large faculty.
+
+Each URL of gitlab_classroom/urls.py is rendered with GitLab mocked, and the
+number of SQL queries it runs is checked against its budget in ``BUDGETS``, so
+an N+1 query shows up as a failing test rather than as a slow page in
+production. The time each page took is checked against
+``BENCHMARK_LATENCY_BUDGET`` seconds (2 by default).
+
+Set ``BENCHMARK_REPORT`` to a file name to get the numbers as JSON, e.g.::
+
+    BENCHMARK_REPORT=before.json python manage.py test gitlab_classroom.tests_benchmark
+"""
+import json
+import os
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from gitlab_classroom import gitlab_client, webhooks
+from gitlab_classroom.models import Student, Classroom, Assignment
+
+
+CLASSROOMS = 50
+STUDENTS = 5000
+ASSIGNMENTS = 500
+
+LATENCY_BUDGET = float(os.environ.get("BENCHMARK_LATENCY_BUDGET", 2))
+
+# url name -> maximum number of queries; the session and the user are two of them
+BUDGETS = {
+    "index": 3,
+    "classroom-list": 4,
+    "classroom-detail": 6,
+    "classroom-create": 2,
+    "classroom-update": 3,
+    "classroom-delete": 3,
+    "assignment-list": 4,
+    "assignment-detail": 6,
+    "assignment-create": 2,
+    "assignment-update": 3,
+    "assignment-delete": 3,
+    "assignment-export": 5,
+    "student-list": 4,
+    "student-detail": 3,
+    "student-create": 2,
+    "student-import": 2,
+    "student-autocomplete": 3,
+    "student-update": 3,
+    "student-delete": 3,
+    "metrics": 0,
+    "gitlab-webhook": 1,
+}
+
+
+class ViewBudgetTest(TestCase):
+    report = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = get_user_model().objects.create_user(username="teacher", password="12345")
+        Student.objects.bulk_create([
+            Student(gitlab_id=str(i), gitlab_username=f"student{i}", first_name=f"First{i}",
+                    second_name=f"Second{i}", email=f"student{i}@pw.edu.pl", student_id=str(300000 + i))
+            for i in range(STUDENTS)
+        ])
+        Classroom.objects.bulk_create([
+            Classroom(title=f"Classroom {i}", description="description", organization="Org",
+                      gitlab_id=1000 + i, teacher=cls.teacher)
+            for i in range(CLASSROOMS)
+        ])
+        classrooms = list(Classroom.objects.order_by("id"))
+        students = list(Student.objects.order_by("id"))
+        per_classroom = STUDENTS // CLASSROOMS
+        Classroom.students.through.objects.bulk_create([
+            Classroom.students.through(classroom=classroom, student=student)
+            for i, classroom in enumerate(classrooms)
+            for student in students[i * per_classroom:(i + 1) * per_classroom]
+        ])
+        deadline = timezone.now() + timedelta(days=14)
+        Assignment.objects.bulk_create([
+            Assignment(title=f"Assignment {i}", description="description", deadline=deadline,
+                       repo_url=f"https://gitlab.example.com/assignment{i}", gitlab_id=5000 + i,
+                       teacher=cls.teacher, classroom=classrooms[i % CLASSROOMS])
+            for i in range(ASSIGNMENTS)
+        ])
+        cls.classroom = classrooms[0]
+        cls.assignment = Assignment.objects.filter(classroom=cls.classroom).first()
+        Assignment.objects.filter(pk=cls.assignment.pk).update(submissions_collected_at=timezone.now())
+        cls.student = students[0]
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        path = os.environ.get("BENCHMARK_REPORT")
+        if path:
+            with open(path, "w") as report_file:
+                json.dump({"fixtures": {"classrooms": CLASSROOMS, "students": STUDENTS, "assignments": ASSIGNMENTS},
+                           "views": dict(sorted(cls.report.items()))}, report_file, indent=2)
+
+    def setUp(self):
+        cache.clear()
+        gitlab_client.clear()
+        patcher = patch("gitlab.Gitlab")
+        self.gitlab = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.login(username="teacher", password="12345")
+        session = self.client.session
+        session.update({"access_token": "token", "name": "Teacher", "email": "teacher@pw.edu.pl"})
+        session.save()
+
+    def url(self, name):
+        if name in ("classroom-detail", "classroom-update", "classroom-delete", "assignment-create"):
+            return reverse(f"gitlab_classroom:{name}", kwargs={"pk": self.classroom.pk})
+        if name in ("assignment-detail", "assignment-update", "assignment-delete", "assignment-export",
+                    "gitlab-webhook"):
+            return reverse(f"gitlab_classroom:{name}", kwargs={"pk": self.assignment.pk})
+        if name in ("student-detail", "student-update", "student-delete"):
+            return reverse(f"gitlab_classroom:{name}", kwargs={"pk": self.student.pk})
+        if name == "student-autocomplete":
+            return reverse(f"gitlab_classroom:{name}") + f"?classroom={self.classroom.pk}&q=stud"
+        return reverse(f"gitlab_classroom:{name}")
+
+    def request(self, name, url):
+        if name == "gitlab-webhook":  # only GitLab calls it, with a POST
+            return self.client.post(url, {"object_kind": "push"}, content_type="application/json",
+                                    HTTP_X_GITLAB_EVENT="Push Hook",
+                                    HTTP_X_GITLAB_TOKEN=webhooks.secret(self.assignment.pk))
+        return self.client.get(url)
+
+    def test_views_stay_within_budget(self):
+        for name, budget in BUDGETS.items():
+            with self.subTest(view=name):
+                url = self.url(name)
+                self.request(name, url)  # warm up templates and caches
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = self.request(name, url)
+                    seconds = time.perf_counter() - start
+                self.report[name] = {"url": url, "queries": len(queries), "budget": budget,
+                                     "seconds": round(seconds, 4)}
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(len(queries), budget,
+                                     "\n".join(query["sql"] for query in queries.captured_queries))
+                self.assertLess(seconds, LATENCY_BUDGET)
+
+    def test_every_url_has_a_budget(self):
+        from gitlab_classroom.urls import urlpatterns
+        self.assertEqual({pattern.name for pattern in urlpatterns}, set(BUDGETS))
@@ -1,5 +1,9 @@
 from django.urls import path
 from gitlab_classroom.views import (index,
+                          metrics_view,
+                          gitlab_webhook,
+                          assignment_export,
+                          student_autocomplete,
                           ClassroomsListView,
                           AssignmentsListView,
                           ClassroomsDetailView,
@@ -13,6 +17,7 @@ from gitlab_classroom.views import (index,
                           StudentsListView,
                           StudentsDetailView,
                           StudentCreateView,
+                          StudentImportView,
                           StudentUpdateView,
                           StudentDeleteView)
 
@@ -25,6 +30,7 @@ urlpatterns = [
     path("assignments/<int:pk>/", AssignmentsDetailView.as_view(), name="assignment-detail"),
     path("classrooms/<int:pk>/assignments/create/", AssignmentCreateView.as_view(), name="assignment-create"),
     path("assignments/<int:pk>/update/", AssignmentUpdateView.as_view(), name="assignment-update"),
+    path("assignments/<int:pk>/export/", assignment_export, name="assignment-export"),
     path("assignments/<int:pk>/delete/", AssignmentDeleteView.as_view(), name="assignment-delete"),
     path("classrooms/create/", ClassroomCreateView.as_view(), name="classroom-create"),
     path("classrooms/<int:pk>/update/", ClassroomUpdateView.as_view(), name="classroom-update"),
@@ -32,8 +38,12 @@ urlpatterns = [
     path("students/", StudentsListView.as_view(), name="student-list"),
     path("students/<int:pk>/", StudentsDetailView.as_view(), name="student-detail"),
     path("students/create/", StudentCreateView.as_view(), name="student-create"),
+    path("students/import/", StudentImportView.as_view(), name="student-import"),
+    path("students/autocomplete/", student_autocomplete, name="student-autocomplete"),
     path("students/<int:pk>/update/", StudentUpdateView.as_view(), name="student-update"),
     path("students/<int:pk>/delete/", StudentDeleteView.as_view(), name="student-delete"),
+    path("metrics", metrics_view, name="metrics"),
+    path("webhooks/gitlab/<int:pk>", gitlab_webhook, name="gitlab-webhook"),
 ]
 
 
@@ -0,0 +1,117 @@
+"""Resolving GitLab usernames to user ids through a local cache.
+
+Every lookup result is kept in ``GitlabUserCache``, so the same student added
+to several classrooms, or imported again next semester, costs no API call.
+Entries older than ``GITLAB_USER_CACHE_TTL`` seconds are still answered from
+the cache, but are queued for revalidation by the GitLab worker. Usernames
+without an account are looked up again after ``GITLAB_USER_CACHE_MISSING_TTL``
+seconds, since a cached "no such user" is of no use once it may be outdated.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils import timezone
+
+from gitlab_classroom.forking import instance_limit
+from gitlab_classroom.instrumentation import propagate
+from gitlab_classroom.models import GitlabJob, GitlabUserCache, Student
+
+
+def is_stale(entry, now):
+    ttl = settings.GITLAB_USER_CACHE_MISSING_TTL if entry.is_missing else settings.GITLAB_USER_CACHE_TTL
+    return (now - entry.last_verified).total_seconds() > ttl
+
+
+def lookup(gl, username):
+    """Ask GitLab for ``username`` and return ``(gitlab id, state)``."""
+    with instance_limit(gl.url):
+        users = gl.users.list(username=username)
+    if not users:
+        return "", GitlabUserCache.MISSING
+    return str(users[0].id), getattr(users[0], "state", "active")
+
+
+def lookup_many(gl, usernames, max_workers=None):
+    usernames = list(usernames)
+    if not usernames:
+        return {}
+    max_workers = min(max_workers or settings.GITLAB_LOOKUP_WORKERS, len(usernames))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(usernames, executor.map(propagate(lambda username: lookup(gl, username)), usernames)))
+
+
+def store(found, now=None):
+    now = now or timezone.now()
+    GitlabUserCache.objects.bulk_create(
+        [GitlabUserCache(username=username, gitlab_id=gitlab_id, state=state, last_verified=now)
+         for username, (gitlab_id, state) in found.items()],
+        update_conflicts=True,
+        unique_fields=["username"],
+        update_fields=["gitlab_id", "state", "last_verified"],
+    )
+
+
+def resolve(gl, usernames, teacher=None, access_token=None, max_workers=None):
+    """Return ``{username: gitlab id or None}`` for ``usernames``.
+
+    Only usernames that aren't cached (or are cached as missing and stale)
+    are looked up on GitLab. When ``teacher`` and ``access_token`` are given,
+    other stale entries are queued for revalidation in the background.
+    """
+    usernames = set(usernames)
+    now = timezone.now()
+    cached = {entry.username: entry for entry in GitlabUserCache.objects.filter(username__in=usernames)}
+    resolved, to_lookup, to_refresh = {}, [], []
+    for username in usernames:
+        entry = cached.get(username)
+        if entry is None or (entry.is_missing and is_stale(entry, now)):
+            to_lookup.append(username)
+            continue
+        resolved[username] = entry.gitlab_id or None
+        if is_stale(entry, now):
+            to_refresh.append(username)
+
+    found = lookup_many(gl, to_lookup, max_workers)
+    store(found, now)
+    resolved.update({username: gitlab_id or None for username, (gitlab_id, _) in found.items()})
+
+    if to_refresh and teacher is not None and access_token:
+        queue_refresh(teacher, access_token, to_refresh)
+    return resolved
+
+
+def queue_refresh(teacher, access_token, usernames):
+    """Queue a refresh of ``usernames``, added to the teacher's refresh that is still queued if there is one."""
+    from gitlab_classroom import jobs
+
+    queued = GitlabJob.objects.filter(kind=GitlabJob.REFRESH_USERS, teacher=teacher, status=GitlabJob.QUEUED).first()
+    if queued is not None:
+        merged = sorted(set(queued.payload["usernames"]) | set(usernames))
+        if len(merged) == len(queued.payload["usernames"]):
+            return queued
+        #unless a worker took it meanwhile
+        if GitlabJob.objects.filter(pk=queued.pk, status=GitlabJob.QUEUED).update(payload={"usernames": merged}):
+            return queued
+    return jobs.enqueue(GitlabJob.REFRESH_USERS, teacher, access_token, usernames=sorted(usernames))
+
+
+def fill_student_ids(gl, students, teacher=None, access_token=None):
+    """Resolve the GitLab ids of ``students`` that don't have one yet and save them."""
+    missing = [student for student in students if not student.gitlab_id]
+    if not missing:
+        return
+    resolved = resolve(gl, [student.gitlab_username for student in missing], teacher, access_token)
+    for student in missing:
+        gitlab_id = resolved.get(student.gitlab_username)
+        if gitlab_id and not Student.objects.filter(gitlab_id=gitlab_id).exclude(pk=student.pk).exists():
+            student.gitlab_id, student.gl_flag = gitlab_id, True
+            Student.objects.filter(pk=student.pk).update(gitlab_id=gitlab_id, gl_flag=True)
+
+
+def refresh(gl, usernames):
+    """Look ``usernames`` up again and bring the cache and the students up to date."""
+    found = lookup_many(gl, usernames)
+    store(found)
+    for username, (gitlab_id, _) in found.items():
+        Student.objects.filter(gitlab_username=username).update(gitlab_id=gitlab_id, gl_flag=bool(gitlab_id))
+    return found
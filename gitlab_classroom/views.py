@@ -1,22 +1,39 @@
 from django.contrib.auth.decorators import login_required
 from django.forms import BaseModelForm
 from django.shortcuts import render
-from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
+from django.http import (HttpRequest, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden,
+                         HttpResponseRedirect, JsonResponse, StreamingHttpResponse)
+from django.utils.crypto import constant_time_compare
+from django.conf import settings
+from django.db.models import OuterRef
 from django.views import generic
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from gitlab_classroom.forms import (ClassroomSearchForm,
                                     AssignmentSearchForm,
                                     StudentSearchForm,
                                     AddStudentToClassroomForm,
-                                    ForkProjectsForm)
-from gitlab_classroom.models import Classroom, Assignment, Student
+                                    ForkProjectsForm,
+                                    RosterImportForm)
+from gitlab_classroom.models import Classroom, Assignment, Student, GitlabJob, subquery_count
+from gitlab_classroom import dashboard, export, metrics, submissions, webhooks
 from gitlab_classroom.forms import AssignmentForm
+from gitlab_classroom import jobs
+from gitlab_classroom.gitlab_client import get_client
+from gitlab_classroom.breaker import GitlabUnavailable
+from gitlab_classroom.roster import ImportReport, import_roster
+from gitlab_classroom.user_cache import fill_student_ids
+from gitlab_classroom.search import student_prefix_search, search
+from gitlab_classroom.pagination import KeysetPaginationMixin
+from gitlab_classroom.groups import MEMBERS, ASSIGNMENTS, sanitize_path, subgroup, add_members
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse_lazy
 from django.shortcuts import get_object_or_404
 from django.contrib import messages
-from gitlab import GitlabGetError
+from gitlab import GitlabGetError, GitlabDeleteError
 import gitlab
-import re
+import csv
+import io
 
 
 # Create your views here.
@@ -24,15 +41,39 @@ import re
 def index(request: HttpResponse) -> HttpRequest:
     context = {
         "name": request.session["name"],
-        "email": request.session["email"]
+        "email": request.session["email"],
+        "summary": dashboard.get_summary(request.user),
+        "jobs": GitlabJob.objects.filter(teacher=request.user)[:5], #not cached, statuses change all the time
     }
     return render(request, "gitlab_classroom/index.html", context=context)
 
 
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    if settings.METRICS_TOKEN and not constant_time_compare(
+            request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"):
+        return HttpResponseForbidden()
+    body, content_type = metrics.render()
+    return HttpResponse(body, content_type=content_type)
+
+
+@csrf_exempt
+@require_POST
+def gitlab_webhook(request: HttpRequest, pk: int) -> HttpResponse:
+    #called by GitLab for every push and pipeline in an assignment group, has to answer fast: see webhooks.py
+    if not constant_time_compare(request.headers.get("X-Gitlab-Token", ""), webhooks.secret(pk)):
+        return HttpResponseForbidden()
+    try:
+        webhooks.enqueue(pk, request.headers, request.body)
+    except ValueError:
+        return HttpResponseBadRequest()
+    return HttpResponse()
+
+
 #this is a classbased representation of a classrooms
-class ClassroomsListView(LoginRequiredMixin, generic.ListView):
+class ClassroomsListView(LoginRequiredMixin, KeysetPaginationMixin, generic.ListView):
     model = Classroom
     paginate_by = 5
+    keyset_ordering = ("-creation_date", "-id")
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super(ClassroomsListView, self).get_context_data(**kwargs)
@@ -43,10 +84,13 @@ class ClassroomsListView(LoginRequiredMixin, generic.ListView):
         return context
 
     def get_queryset(self):
-        queryset = Classroom.objects.select_related("teacher").prefetch_related("students").filter(teacher=self.request.user)
+        queryset = Classroom.objects.filter(teacher=self.request.user).annotate(
+            student_count=subquery_count(Classroom.students.through.objects.filter(classroom=OuterRef("pk"))),
+            assignment_count=subquery_count(Assignment.objects.filter(classroom=OuterRef("pk"))),
+        )
         form = ClassroomSearchForm(self.request.GET)
         if form.is_valid():
-            return queryset.filter(title__icontains=form.cleaned_data["title"])
+            return search(queryset, form.cleaned_data["title"])
         """Override to filter assignments to those owned by the current user."""
         return queryset
 
@@ -59,43 +103,40 @@ class ClassroomsDetailView(LoginRequiredMixin, generic.DetailView):
         context = super().get_context_data(**kwargs)
         classroom_id = self.kwargs.get('pk')
         context['add_student_form'] = AddStudentToClassroomForm(classroom_id=classroom_id)
+        context['jobs'] = self.object.gitlab_job.all()[:5]
         return context
 
     def post(self, request, *args, **kwargs):
         self.object = self.get_object() 
         classroom_id = self.kwargs.get('pk')  
-        gl = gitlab.Gitlab('https://gitlab-stud.elka.pw.edu.pl', private_token=self.request.session["access_token"])
+        gl = get_client(self.request.session["access_token"])
         if 'add_student' in request.POST:
             add_form = AddStudentToClassroomForm(request.POST, classroom_id=classroom_id)
             if add_form.is_valid():
                 try:
-                    group = gl.groups.get(self.object.gitlab_id)
-                    subgroups = group.subgroups.list(all=True)
-                    members_group = gl.groups.get(subgroups[1].id)
-                    student = add_form.cleaned_data['student']
-                    if subgroups:
-                        member = members_group.members.create({'user_id': student.gitlab_id,
-                                                            'access_level': gitlab.const.DEVELOPER_ACCESS})
-                    self.object.students.add(student)
+                    students = list(add_form.cleaned_data['students'])
+                    fill_student_ids(gl, students, request.user, request.session["access_token"])
+                    members_group = subgroup(gl, self.object, MEMBERS)
+                    added, failures = add_members(gl, members_group, students)
+                    self.object.students.add(*added)
+                    if added:
+                        messages.success(self.request, f"{len(added)} student(s) were added to the classroom.")
+                    for student, reason in failures.items():
+                        messages.error(self.request, f"Student {student.gitlab_username} was not added: {reason}")
                     return HttpResponseRedirect(self.object.get_absolute_url())
-                except GitlabGetError:
-                    messages.error(self.request, "Student has no account on GitLab.")
                 except Exception as e:
-                    messages.error(self.request, "Student has no account on GitLab.")
+                    messages.error(self.request, f"Students could not be added to the GitLab group: {e}.")
 
         elif 'remove_student' in request.POST:
             student_id = request.POST.get('student_id')
             if student_id:
+                student = get_object_or_404(Student, id=student_id)
                 try:
-                    group = gl.groups.get(self.object.gitlab_id)
-                    subgroups = group.subgroups.list(all=True)
-                    members_group = gl.groups.get(subgroups[1].id)
-                    student = get_object_or_404(Student, id=student_id)
-                    member = members_group.members.get(student.gitlab_id)
-                    member.delete()
+                    members_group = subgroup(gl, self.object, MEMBERS)
+                    members_group.members.delete(student.gitlab_id)
                     self.object.students.remove(student)
                     return HttpResponseRedirect(self.object.get_absolute_url())
-                except GitlabGetError:
+                except GitlabDeleteError:
                     messages.error(self.request, "Student is no longer a GitLab group member.")
                     self.object.students.remove(student)
                 except Exception as e:
@@ -110,50 +151,17 @@ class ClassroomCreateView(LoginRequiredMixin, generic.CreateView):
     template_name = "gitlab_classroom/classroom_form.html"
     
     def form_valid(self, form):
-        user = self.request.user
-        form.instance.teacher = user
-        response = super().form_valid(form)
-
         try:
             access_token = self.request.session["access_token"]
         except KeyError:
             return HttpResponse(status=403)  # Forbidden if no access token
 
-        gl = gitlab.Gitlab('https://gitlab-stud.elka.pw.edu.pl', private_token=access_token)
-
-        # Sanitize the title to create a valid path
-        sanitized_title = re.sub(r'[^a-zA-Z0-9_\-.]', '_', self.object.title.lower()).strip('-.')
-
-        group_data = {
-            'name': self.object.title,
-            'path': sanitized_title,
-            'description': self.object.description
-        }
-
-        try:
-            group = gl.groups.create(group_data)
-        except gitlab.exceptions.GitlabCreateError:
-            self.object.delete()  # Clean up the created object on failure
-            return HttpResponse(status=500)  # Internal Server Error
-
-        # Create members and assignments subgroups
-        def create_subgroup(name_suffix, description):
-            subgroup_path = f"{group_data['path']}_{name_suffix}".strip('-.')
-
-            subgroup_data = {
-                "name": name_suffix,
-                "path": subgroup_path,
-                "description": description,
-                "parent_id": group.id
-            }
-            return gl.groups.create(subgroup_data)
-
-        members = create_subgroup("MEMBERS", "Classroom Members")
-        assignments = create_subgroup("ASSIGNMENTS", "Assignments folder")
-
-        self.object.gitlab_id = group.id
-        self.object.save()
-        messages.success(self.request, "Classroom was successfully created.")
+        user = self.request.user
+        form.instance.teacher = user
+        response = super().form_valid(form)
+        # GitLab groups are created by the worker, see jobs.create_classroom_groups
+        jobs.enqueue(GitlabJob.CREATE_CLASSROOM, user, access_token, classroom=self.object)
+        messages.success(self.request, "Classroom was successfully created. Its GitLab group is being set up.")
         return response
 
 
@@ -176,7 +184,7 @@ class ClassroomUpdateView(LoginRequiredMixin, generic.UpdateView):
             
             # Example: update a GitLab group's name or other details
             # Configure access to your GitLab instance
-            gl = gitlab.Gitlab('https://gitlab-stud.elka.pw.edu.pl', private_token=self.request.session["access_token"])
+            gl = get_client(self.request.session["access_token"])
             
             group = gl.groups.get(gitlab_group_id)
             # Assuming you want to update the name of the group based on a field in your form
@@ -186,6 +194,11 @@ class ClassroomUpdateView(LoginRequiredMixin, generic.UpdateView):
             messages.success(self.request, "Classroom was successfully updated.")
             # Don't forget to save the form and the instance it represents
             response = super().form_valid(form)
+        except GitlabUnavailable:
+            #gitlab is down, not the group gone: keep the change and update the group later
+            jobs.enqueue(GitlabJob.SYNC_GROUP, self.request.user, self.request.session["access_token"],
+                         classroom=self.object)
+            messages.warning(self.request, "Classroom was saved. GitLab is unavailable, its group will be updated later.")
         except GitlabGetError:
             messages.error(self.request, "GitLab group could not be found. Classroom was deleted.")
             self.object.delete()  # Delete the classroom instance
@@ -203,38 +216,28 @@ class ClassroomDeleteView(LoginRequiredMixin, generic.DeleteView):
     success_url = reverse_lazy("gitlab_classroom:classroom-list")
 
     def form_valid(self, form):
-        # Get the object
         self.object = self.get_object()
+        gitlab_id = self.object.gitlab_id
         response = super().form_valid(form)
-        # Optionally retrieve GitLab group ID from Classroom object
-        if self.object.gitlab_id:
-            try:
-                # Configure access to your GitLab instance
-                gl = gitlab('https://gitlab-stud.elka.pw.edu.pl', private_token=self.request.session["access_token"])
-                
-                # Try to get the GitLab group and delete it
-                group = gl.groups.get(self.object.gitlab_id)
-                group.delete()
-                
-                messages.success(self.request, "Classroom and associated GitLab group were deleted successfully.")
-            except GitlabGetError:
-                messages.error(self.request, "GitLab group could not be found. Classroom deleted without deleting the GitLab group.")
-            except Exception as e:
-                # Log the exception if necessary
-                messages.error(self.request, f"An error occurred while trying to delete the GitLab group: {str(e)}. It doesn't exist.")
-        
+        if gitlab_id:
+            jobs.enqueue(GitlabJob.DELETE_GROUP, self.request.user, self.request.session["access_token"],
+                         group_id=gitlab_id)
+            messages.success(self.request, "Classroom was deleted. Its GitLab group will be removed shortly.")
+        else:
+            messages.success(self.request, "Classroom was deleted.")
         return response
 
 
-class StudentsListView(LoginRequiredMixin, generic.ListView):
+class StudentsListView(LoginRequiredMixin, KeysetPaginationMixin, generic.ListView):
     model = Student
     paginate_by = 5
+    keyset_ordering = ("-first_name", "-id")
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super(StudentsListView, self).get_context_data(**kwargs)
-        gitlab_username = self.request.GET.get("gitlab_username", "")
+        query = self.request.GET.get("query", "")
         context["search_form"] = StudentSearchForm(
-            initial={"gitlab_username" : gitlab_username}
+            initial={"query" : query}
         )
         return context
     
@@ -242,7 +245,32 @@ class StudentsListView(LoginRequiredMixin, generic.ListView):
         queryset = Student.objects.all()
         form = StudentSearchForm(self.request.GET)
         if form.is_valid():
-            return queryset.filter(gitlab_username__icontains=form.cleaned_data["gitlab_username"])
+            return search(queryset, form.cleaned_data["query"])
+        return queryset
+
+
+@login_required
+def student_autocomplete(request: HttpRequest) -> JsonResponse:
+    """Paginated prefix search over students for the add-students widget."""
+    page_size = settings.STUDENT_AUTOCOMPLETE_PAGE_SIZE
+    try:
+        page = max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        page = 1
+    queryset = student_prefix_search(Student.objects.all(), request.GET.get("q", ""))
+    classroom_id = request.GET.get("classroom", "")
+    if classroom_id.isdigit():
+        queryset = queryset.exclude(classroom=classroom_id)
+    # one extra row tells whether there is a next page without a COUNT(*)
+    offset = (page - 1) * page_size
+    students = list(queryset.order_by("gitlab_username", "id")
+                    .values("id", "gitlab_username", "first_name", "second_name", "student_id")
+                    [offset:offset + page_size + 1])
+    results = [{
+        "id": student["id"],
+        "text": f"{student['gitlab_username']} - {student['first_name']} {student['second_name']} ({student['student_id']})",
+    } for student in students[:page_size]]
+    return JsonResponse({"results": results, "pagination": {"more": len(students) > page_size}})
 
 
 class StudentsDetailView(LoginRequiredMixin, generic.DetailView):
@@ -261,29 +289,42 @@ class StudentCreateView(LoginRequiredMixin, generic.CreateView):
 
     def form_valid(self, form):
         response = super().form_valid(form)
-        gl = gitlab.Gitlab('https://gitlab-stud.elka.pw.edu.pl',
-                        private_token=self.request.session["access_token"])
+        gl = get_client(self.request.session["access_token"])
         try:
-            students = gl.users.list(username=self.object.gitlab_username)
-            if students:
-                student = students[0]
-                # Check if the gitlab_id already exists
-                if not Student.objects.filter(gitlab_id=student.id).exists():
-                    self.object.gitlab_id = student.id
-                    self.object.gl_flag = True
-                else:
-                    # Handle duplicate gitlab_id scenario, maybe set gitlab_id to None or handle differently
-                    print(f"Duplicate gitlab_id detected: {student.id}")
-            else:
-                print("No user found with that username.")
-                messages.error(self.request, f"Student {self.object.gitlab_username} has no GitLab account.")
+            fill_student_ids(gl, [self.object], self.request.user, self.request.session["access_token"])
+            if not self.object.gl_flag:
+                messages.error(self.request, f"Student {self.object.gitlab_username} could not be linked to a GitLab account.")
         except Exception as e:
-            print("An error occurred:", e)
-        self.object.save()
+            messages.error(self.request, f"GitLab account of {self.object.gitlab_username} could not be checked: {e}")
         messages.success(self.request, f"Student {self.object.gitlab_username} was successfully created")
         return response
 
 
+class StudentImportView(LoginRequiredMixin, generic.FormView):
+    form_class = RosterImportForm
+    success_url = reverse_lazy("gitlab_classroom:student-list")
+    template_name = "gitlab_classroom/student_import.html"
+
+    def form_valid(self, form):
+        gl = get_client(self.request.session["access_token"])
+        roster = io.TextIOWrapper(form.cleaned_data["roster"].file, encoding="utf-8-sig", newline="")
+        report = ImportReport()
+        try:
+            import_roster(gl, roster, teacher=self.request.user, access_token=self.request.session["access_token"],
+                          report=report)
+        except (UnicodeDecodeError, csv.Error) as e:
+            form.add_error("roster", f"The roster could not be read: {e}")
+            return self.form_invalid(form)
+        except (GitlabUnavailable, gitlab.exceptions.GitlabError) as e:
+            #the chunks before the failing one are imported, importing the file again skips them
+            messages.error(self.request, f"The import stopped after line {report.last_line}, "
+                                         f"GitLab accounts could not be looked up: {e}")
+        messages.success(self.request, report.summary())
+        if report.invalid_rows:
+            messages.error(self.request, "Invalid rows on lines: " + ", ".join(map(str, report.invalid_rows)))
+        return super().form_valid(form)
+
+
 class StudentUpdateView(LoginRequiredMixin, generic.UpdateView):
     model = Student
     fields = {"gitlab_id",
@@ -312,11 +353,10 @@ class StudentDeleteView(LoginRequiredMixin, generic.DeleteView):
         return response
 
 #this is a classbased representation of assignments
-class AssignmentsListView(LoginRequiredMixin, generic.ListView):
+class AssignmentsListView(LoginRequiredMixin, KeysetPaginationMixin, generic.ListView):
     model = Assignment
-    queryset = Assignment.objects.select_related("classroom", "classroom__teacher").prefetch_related("classroom__students")
-    #above i am fixing n+1 problem i should fix it later
     paginate_by = 5
+    keyset_ordering = ("-creation_date", "-id")
 
     def get_context_data(self, *, object_list=None, **kwargs):
         context = super(AssignmentsListView, self).get_context_data(**kwargs)
@@ -327,82 +367,78 @@ class AssignmentsListView(LoginRequiredMixin, generic.ListView):
         return context
 
     def get_queryset(self):
-        queryset = Assignment.objects.select_related("classroom", "classroom__teacher").prefetch_related("classroom__students").filter(teacher=self.request.user)
+        queryset = Assignment.objects.select_related("classroom").filter(teacher=self.request.user).annotate(
+            student_count=subquery_count(Classroom.students.through.objects.filter(classroom=OuterRef("classroom_id"))),
+        )
         form = AssignmentSearchForm(self.request.GET)
         if form.is_valid():
-            return queryset.filter(title__icontains=form.cleaned_data["title"])
+            return search(queryset, form.cleaned_data["title"])
         """Override to filter assignments to those owned by the current user."""
         return queryset
 
 
 class AssignmentsDetailView(LoginRequiredMixin, generic.DetailView):
     model = Assignment
+    queryset = Assignment.objects.select_related("classroom") #the template shows the classroom title
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["fork_projects_form"] = ForkProjectsForm()
+        context["jobs"] = self.object.gitlab_job.all()[:5]
+        context["submissions"] = self.object.submission.select_related("student")
+        context["similar_pairs"] = self.object.similar_pair.select_related(
+            "student_a", "student_b")[:settings.SIMILARITY_PAIRS_SHOWN]
         return context
 
     def post(self, request, *args, **kwargs):
         self.object = self.get_object()
+        if "collect_submissions" in request.POST:
+            scheduled = submissions.scheduled(self.object)
+            if scheduled.exists():
+                #already being swept, just don't make the teacher wait for the next sweep
+                scheduled.filter(status=GitlabJob.QUEUED).update(run_after=None)
+                messages.info(self.request, "Submissions are already being collected, the next sweep starts shortly.")
+            else:
+                jobs.enqueue(GitlabJob.COLLECT_SUBMISSIONS, request.user, request.session["access_token"],
+                             assignment=self.object, incremental=False)
+                messages.success(self.request, "Collecting submissions was queued. "
+                                               "They are collected again regularly until after the deadline.")
+            return HttpResponseRedirect(self.object.get_absolute_url())
+        if "check_similarity" in request.POST:
+            if self.object.gitlab_job.filter(kind=GitlabJob.CHECK_SIMILARITY,
+                                             status__in=[GitlabJob.QUEUED, GitlabJob.RUNNING]).exists():
+                messages.info(self.request, "The submissions are already being compared.")
+            else:
+                jobs.enqueue(GitlabJob.CHECK_SIMILARITY, request.user, request.session["access_token"],
+                             assignment=self.object)
+                messages.success(self.request, "Comparing the submissions was queued. "
+                                               "Only submissions that changed since the last check are compared again.")
+            return HttpResponseRedirect(self.object.get_absolute_url())
         form = ForkProjectsForm(request.POST)
-        gl = gitlab.Gitlab('https://gitlab-stud.elka.pw.edu.pl',
-                           private_token=self.request.session["access_token"])
-        assignment_id = self.kwargs.get('pk')
-        assignment = Assignment.objects.get(pk=assignment_id)
         if form.is_valid():
-            try:
-                gitlab_template_id = form.cleaned_data['gitlab_template_id']
-                assignments_group = gl.groups.get(assignment.gitlab_id) 
-                classroom_group = gl.groups.get(assignment.classroom.gitlab_id)
-                members_group = self.create_or_get_subgroup(classroom_group, 'MEMBERS')
-                self.fork_project_for_students(assignments_group, gitlab_template_id, members_group)
-            except Exception as e:
-                messages.error(self.request, "There is no template with such ID")
-
-        context = self.get_context_data()
-        context['fork_projects_form'] = form
+            jobs.enqueue(GitlabJob.FORK_PROJECTS, request.user, request.session["access_token"],
+                         assignment=self.object, template_id=form.cleaned_data['gitlab_template_id'])
+            messages.success(self.request, "Forking was queued. Progress is shown below.")
         return HttpResponseRedirect(self.object.get_absolute_url())
 
-    def create_or_get_subgroup(self, parent_group, subgroup_name):
-        gl = gitlab.Gitlab('https://gitlab-stud.elka.pw.edu.pl', private_token=self.request.session["access_token"])
-        """ Create a subgroup if it does not exist or return existing one """
-        subgroups = parent_group.subgroups.list(all=True)
-        for subgroup in subgroups:
-            if subgroup.name == subgroup_name:
-                return gl.groups.get(subgroup.id)
-
-        subgroup_data = {
-            'name': subgroup_name,
-            'path': subgroup_name,
-            'parent_id': parent_group.id
-        }
-        return gl.groups.create(subgroup_data)
-
-    def fork_project_for_students(self, assignments_group, base_project_id, student_group):
-        user = self.request.user
-        gl = gitlab.Gitlab('https://gitlab-stud.elka.pw.edu.pl', private_token=self.request.session["access_token"])
-        students = gl.groups.get(student_group.id).members.list(all=True)
-        base_project = gl.projects.get(base_project_id)
-        for student in students:
-            if int(student.id) != int(user.gitlab_id):
-                personal_group_name = f"{assignments_group.name}_{student.username}"
-                existing_projects = gl.projects.list(search=f"{personal_group_name}_project")
-                project_exists = any(proj for proj in existing_projects if proj.namespace['id'] == assignments_group.id)
-                if not project_exists:
-                    forked_project_data = base_project.forks.create({
-                        'namespace': assignments_group.id,
-                        'name': f"{personal_group_name}_project",
-                        'path': f"{personal_group_name}_project"
-                    })
-                    forked_project = gl.projects.get(forked_project_data.id)
-
-                    forked_project.members.create({
-                        'user_id': student.id,
-                        'access_level': gitlab.const.AccessLevel.DEVELOPER
-                    })
-                    print(f"Project forked for {student.username} in subgroup {personal_group_name}")
 
+@login_required
+def assignment_export(request: HttpRequest, pk: int) -> HttpResponse:
+    assignment = get_object_or_404(Assignment.objects.select_related("classroom"), pk=pk, teacher=request.user)
+    if export.stale(assignment):
+        #collected by the worker, a sweep of a large course takes longer than a request may
+        if not any(job.is_active for job in submissions.scheduled(assignment)):
+            jobs.enqueue(GitlabJob.COLLECT_SUBMISSIONS, request.user, request.session["access_token"],
+                         assignment=assignment)
+        messages.info(request, "The submissions are being collected first. Export them again once that is done.")
+        return HttpResponseRedirect(assignment.get_absolute_url())
+    gl = get_client(request.session["access_token"])
+    #the archives are downloaded while the ZIP is being sent, see export.py
+    response = StreamingHttpResponse(export.stream_zip(gl, assignment, export.plan(assignment)),
+                                     content_type="application/zip")
+    filename = sanitize_path(assignment.title) or "assignment"
+    response["Content-Disposition"] = f'attachment; filename="{filename}.zip"'
+    return response
 
 
 class AssignmentCreateView(LoginRequiredMixin, generic.CreateView):
@@ -417,17 +453,15 @@ class AssignmentCreateView(LoginRequiredMixin, generic.CreateView):
         classroom = get_object_or_404(Classroom, pk=self.kwargs.get('pk'))
         form.instance.classroom = classroom 
         response = super().form_valid(form)
-        gl = gitlab.Gitlab('https://gitlab-stud.elka.pw.edu.pl', private_token=self.request.session["access_token"])
+        gl = get_client(self.request.session["access_token"])
 
         if classroom.gitlab_id:
             try:
-                group = gl.groups.get(classroom.gitlab_id)
-                subgroups = group.subgroups.list(all=True)
-                assignments_group = gl.groups.get(subgroups[0].id)
-                sanitized_title = re.sub(r'[^a-zA-Z0-9_\-.]', '_', form.instance.title.lower()).strip('-.')
+                assignments_group = subgroup(gl, classroom, ASSIGNMENTS)
+                sanitized_title = sanitize_path(form.instance.title)
                 subgroup_data = {
                     "name": sanitized_title,
-                    "path": f"{assignments_group.name}_{sanitized_title}",
+                    "path": f"{ASSIGNMENTS}_{sanitized_title}",
                     "description": form.instance.description,
                     "parent_id": assignments_group.id  
                 }
@@ -435,6 +469,11 @@ class AssignmentCreateView(LoginRequiredMixin, generic.CreateView):
                 self.object.repo_url = group.web_url
                 self.object.gitlab_id = group.id
                 self.object.save()
+                try:
+                    webhooks.register(gl, group.id, self.object, webhooks.hook_url(self.request, self.object))
+                except gitlab.exceptions.GitlabError as e:
+                    #group webhooks need GitLab Premium, the submission sweeps work without them
+                    messages.warning(self.request, f"Submissions will be collected without a webhook: {e}")
                 messages.success(self.request, "Assignment was successfully created")
             except Exception as e:
                 messages.error(self.request, "Error occured ")
@@ -450,7 +489,7 @@ class AssignmentUpdateView(LoginRequiredMixin, generic.UpdateView):
 
     def form_valid(self, form):
         response = super().form_valid(form)
-        gl = gitlab.Gitlab('https://gitlab-stud.elka.pw.edu.pl', private_token=self.request.session["access_token"])
+        gl = get_client(self.request.session["access_token"])
         try:
             gitlab_group_id = form.instance.gitlab_id
             group = gl.groups.get(gitlab_group_id)
@@ -458,6 +497,10 @@ class AssignmentUpdateView(LoginRequiredMixin, generic.UpdateView):
             group.description = form.cleaned_data["description"]
             group.save()
             messages.success(self.request, "Assignment was updated successfully")
+        except GitlabUnavailable:
+            jobs.enqueue(GitlabJob.SYNC_GROUP, self.request.user, self.request.session["access_token"],
+                         assignment=self.object)
+            messages.warning(self.request, "Assignment was saved. GitLab is unavailable, its group will be updated later.")
         except Exception as e:
             messages.error(self.request, "Error occured. Assignmend doesn't exist on gitlab")
         return response 
@@ -469,16 +512,11 @@ class AssignmentDeleteView(LoginRequiredMixin, generic.DeleteView):
     success_url = reverse_lazy("gitlab_classroom:assignment-list")
 
     def form_valid(self, form):
-        try:
-            self.object = self.get_object()
-            gitlab_assignment_id = self.object.gitlab_id
-            gl = gitlab.Gitlab('https://gitlab-stud.elka.pw.edu.pl', private_token=self.request.session["access_token"])
-            response = super().form_valid(form)
-            group = gl.groups.get(gitlab_assignment_id)
-            group.delete()
-            messages.success(self.request, "Assignment was deleted successfully")
-        except Exception as e:
-            messages.error(self.request, "Error occured. Assignment doesn't exists on GitLab")
-            group = gl.groups.get(gitlab_assignment_id)
-            group.delete()
+        self.object = self.get_object()
+        gitlab_assignment_id = self.object.gitlab_id
+        response = super().form_valid(form)
+        if gitlab_assignment_id:
+            jobs.enqueue(GitlabJob.DELETE_GROUP, self.request.user, self.request.session["access_token"],
+                         group_id=gitlab_assignment_id)
+        messages.success(self.request, "Assignment was deleted successfully")
         return response
@@ -0,0 +1,179 @@
+"""Keeping submissions current from GitLab's push and pipeline events.
+
+Every assignment group gets a group webhook (:func:`register`) pointing at
+``/webhooks/gitlab/<assignment id>``. Its secret token is derived from
+``SECRET_KEY`` and the assignment, so a delivery is verified without a
+query. The receiver only checks the token and inserts the event, keyed by
+GitLab's idempotency key so that retried deliveries are dropped by the
+unique constraint: one INSERT and no GitLab call per request.
+
+The worker applies the queued events in batches (:func:`process_pending`).
+An event only ever moves a submission forward, to a later commit before the
+deadline or to a newer pipeline, so events can be applied out of order or
+twice, which also lets events whose worker died mid-batch be claimed again
+after ``WEBHOOK_STALE_TIMEOUT`` seconds. Group webhooks need GitLab Premium; without one an assignment is kept
+current by the sweeps of submissions.py alone.
+"""
+import hashlib
+import json
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from django.utils.dateparse import parse_datetime
+
+from gitlab_classroom import submissions
+from gitlab_classroom.models import Assignment, Submission, WebhookEvent
+
+
+EVENTS = {
+    "Push Hook": WebhookEvent.PUSH,
+    "Pipeline Hook": WebhookEvent.PIPELINE,
+}
+
+
+def secret(assignment_id):
+    return salted_hmac("gitlab_classroom.webhooks", str(assignment_id)).hexdigest()
+
+
+def hook_url(request, assignment):
+    path = reverse("gitlab_classroom:gitlab-webhook", args=[assignment.pk])
+    if settings.WEBHOOK_BASE_URL:
+        return settings.WEBHOOK_BASE_URL.rstrip("/") + path
+    return request.build_absolute_uri(path)
+
+
+def register(gl, group_id, assignment, url):
+    """Add the webhook of ``assignment`` to its GitLab group ``group_id``."""
+    hook = gl.groups.get(group_id, lazy=True).hooks.create({
+        "url": url,
+        "token": secret(assignment.pk),
+        "push_events": True,
+        "pipeline_events": True,
+    })
+    Assignment.objects.filter(pk=assignment.pk).update(webhook_id=hook.id)
+    assignment.webhook_id = hook.id
+    return hook
+
+
+def enqueue(assignment_id, headers, body):
+    """Queue a verified delivery. Raises ValueError if the body isn't JSON."""
+    kind = EVENTS.get(headers.get("X-Gitlab-Event"))
+    if kind is None:
+        return None  # not subscribed to, nothing GitLab should retry
+    payload = json.loads(body)
+    event_id = (headers.get("Idempotency-Key") or headers.get("X-Gitlab-Event-UUID")
+                or hashlib.sha256(body).hexdigest())
+    WebhookEvent.objects.bulk_create([WebhookEvent(event_id=event_id, kind=kind, assignment_id=assignment_id,
+                                                   payload=payload)], ignore_conflicts=True)
+    return kind
+
+
+def claim(worker_name, batch_size):
+    ids = list(WebhookEvent.objects.filter(worker="").values_list("id", flat=True)[:batch_size])
+    WebhookEvent.objects.filter(id__in=ids, worker="").update(worker=worker_name, claimed_at=timezone.now())
+    return list(WebhookEvent.objects.filter(id__in=ids, worker=worker_name))
+
+
+def reclaim():
+    """Release the events claimed by a worker that died before applying them; returns how many."""
+    cutoff = timezone.now() - timedelta(seconds=settings.WEBHOOK_STALE_TIMEOUT)
+    return (WebhookEvent.objects.filter(processed_at__isnull=True, claimed_at__lt=cutoff).exclude(worker="")
+            .update(worker="", claimed_at=None))
+
+
+def process_pending(worker_name="inline", batch_size=None):
+    """Apply queued events in batches until there are none left."""
+    reclaim()
+    processed = 0
+    while events := claim(worker_name, batch_size or settings.WEBHOOK_BATCH_SIZE):
+        apply(events)
+        WebhookEvent.objects.filter(id__in=[event.id for event in events]).update(processed_at=timezone.now())
+        processed += len(events)
+    if processed:
+        #kept a while so that late retries of a delivery are still recognised
+        retention = timezone.now() - timedelta(days=settings.WEBHOOK_EVENT_RETENTION_DAYS)
+        WebhookEvent.objects.filter(processed_at__lt=retention).delete()
+    return processed
+
+
+def apply(events):
+    by_assignment = defaultdict(list)
+    for event in events:
+        by_assignment[event.assignment_id].append(event)
+    assignments = Assignment.objects.select_related("classroom").in_bulk(list(by_assignment))
+    for assignment_id, assignment_events in by_assignment.items():
+        if assignment_id in assignments:  # otherwise deleted since
+            apply_to_assignment(assignments[assignment_id], assignment_events)
+
+
+def student_of(students, path):
+    """The student whose fork is at ``path``, see forking.project_path."""
+    path = path.lower()
+    # the longest username first, "jan_kowalski" before "kowalski"
+    for username in sorted(students, key=len, reverse=True):
+        if path.endswith(f"_{username}_project"):
+            return students[username]
+    return None
+
+
+def apply_to_assignment(assignment, events):
+    by_project = {submission.project_id: submission
+                  for submission in assignment.submission.select_related("student")}
+    students = None
+    changed = {}
+    for event in events:
+        project = event.payload.get("project") or {}
+        submission = by_project.get(project.get("id"))
+        if submission is None:
+            if event.kind != WebhookEvent.PUSH:
+                continue  # no commit of this project recorded yet
+            if students is None:
+                students = {student.gitlab_username.lower(): student
+                            for student in assignment.classroom.students.all()}
+            student = student_of(students, project.get("path_with_namespace", "").rsplit("/", 1)[-1])
+            if student is None:
+                continue  # not a student's fork
+            submission = by_project[project["id"]] = Submission(student=student, assignment=assignment,
+                                                                project_id=project["id"])
+        if event.kind == WebhookEvent.PUSH:
+            updated = apply_push(submission, event.payload, assignment.deadline, event.received_at)
+        else:
+            updated = apply_pipeline(submission, event.payload)
+        if updated:
+            changed[submission.project_id] = submission
+    submissions.save(changed.values())
+
+
+def apply_push(submission, payload, deadline, received_at):
+    default_branch = (payload.get("project") or {}).get("default_branch")
+    if payload.get("ref") != f"refs/heads/{default_branch}":
+        return False
+    commits = [(parse_datetime(commit["timestamp"]), commit["id"]) for commit in payload.get("commits", [])]
+    commits = [commit for commit in commits if commit[0] <= deadline]
+    if not commits:
+        return False
+    committed, sha = max(commits)
+    submission.last_activity_at = received_at
+    if submission.commit_date and committed <= submission.commit_date:
+        return True
+    submission.commit_sha, submission.commit_date = sha, committed
+    submission.pipeline_id, submission.pipeline_status = None, ""
+    return True
+
+
+def apply_pipeline(submission, payload):
+    pipeline = payload.get("object_attributes") or {}
+    if pipeline.get("sha") != submission.commit_sha or pipeline.get("id") is None:
+        return False
+    if submission.pipeline_id:
+        if pipeline["id"] < submission.pipeline_id:
+            return False  # an older pipeline of the same commit
+        if (pipeline["id"] == submission.pipeline_id and submission.pipeline_finished
+                and pipeline.get("status") in Submission.PIPELINE_UNFINISHED):
+            return False  # a late event of a pipeline that has finished
+    submission.pipeline_id, submission.pipeline_status = pipeline["id"], pipeline.get("status", "")
+    return True
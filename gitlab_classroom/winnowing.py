@@ -0,0 +1,68 @@
+"""Winnowing fingerprints of source code (Schleimer, Wilkerson and Aiken, 2003).
+
+Every file is turned into tokens with identifiers and numbers replaced by
+placeholders, so that renaming variables doesn't hide a copy. Every run of
+``k`` tokens is hashed, and from every ``window`` consecutive hashes the
+smallest one is kept. Two files sharing a run of at least ``k + window - 1``
+tokens are then guaranteed to share a fingerprint, while only a fraction of
+the hashes has to be stored.
+
+Kept free of Django, like gitrepo.py, so that it can run in spawned processes.
+"""
+import hashlib
+import re
+
+from gitlab_classroom import gitrepo
+
+
+TOKEN = re.compile(r"[A-Za-z_]\w*|\d+(?:\.\d+)?|\S")
+# kept as they are, the structure of the code is in them
+KEYWORDS = frozenset("""
+    and as assert async await break case catch class const continue def default del do elif else enum except
+    extends false final finally for from function if implements import in interface is lambda let match new
+    none nonlocal not null or pass private protected public raise return static struct switch this throw
+    throws true try var void while with yield
+""".split())
+
+
+def tokens(text):
+    for token in TOKEN.findall(text):
+        if token[0].isdigit():
+            yield "0"
+        elif (token[0].isalpha() or token[0] == "_") and token.lower() not in KEYWORDS:
+            yield "x"
+        else:
+            yield token
+
+
+def hashes(text, k):
+    """Hash of every run of ``k`` tokens of ``text``, 63 bits so that it fits a signed 64-bit column."""
+    words = list(tokens(text))
+    return [int.from_bytes(hashlib.blake2b(" ".join(words[i:i + k]).encode(), digest_size=8).digest(), "big") >> 1
+            for i in range(len(words) - k + 1)]
+
+
+def winnow(values, window):
+    """The smallest of every ``window`` consecutive ``values``, the rightmost one on ties."""
+    if len(values) <= window:
+        return {min(values)} if values else set()
+    selected = set()
+    last = None
+    for start in range(len(values) - window + 1):
+        current = values[start:start + window]
+        smallest = min(current)
+        position = start + window - 1 - current[::-1].index(smallest)
+        if position != last:  # a hash is only recorded again when a new occurrence is selected
+            selected.add(smallest)
+            last = position
+    return selected
+
+
+def fingerprint(path, sha, k, window, max_file_bytes=None):
+    """Sorted fingerprints of the text files of commit ``sha`` of the repository at ``path``."""
+    fingerprints = set()
+    for _, content in gitrepo.blobs(path, sha, max_file_bytes):
+        if b"\0" in content:
+            continue  # binary
+        fingerprints |= winnow(hashes(content.decode(errors="replace"), k), window)
+    return sorted(fingerprints)
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 from django.contrib.messages import constants as messages
 
@@ -46,7 +48,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'gitlab_classroom.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'gitlab_classroom.instrumentation.GitlabTimingMiddleware',
     "debug_toolbar.middleware.DebugToolbarMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,6 +73,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'gitlab_classroom.context_processors.gitlab',
             ],
         },
     },
@@ -151,4 +156,134 @@ MESSAGE_TAGS = {
     messages.SUCCESS: "alert-success",
     messages.WARNING: "alert_warning",
     messages.ERROR: "alert-danger",
-}
\ No newline at end of file
+}
+# Forking assignment templates: threads used per fork run and the cap on
+# in-flight requests to one GitLab instance, shared by every run in a process.
+GITLAB_FORK_WORKERS = 8
+GITLAB_MAX_CONCURRENCY = 16
+
+# GitLab instance used by every view and job (the GITLAB_URL environment
+# variable, e.g. for `manage.py fake_gitlab`), and the pooled clients talking
+# to it (see gitlab_classroom/gitlab_client.py): at most GITLAB_CLIENTS_MAX
+# clients are kept, each with up to GITLAB_CLIENT_POOL_SIZE keep-alive
+# connections, and a client unused for GITLAB_CLIENT_IDLE_TIMEOUT seconds is dropped.
+GITLAB_URL = os.environ.get("GITLAB_URL", "https://gitlab-stud.elka.pw.edu.pl")
+GITLAB_CLIENTS_MAX = 64
+GITLAB_CLIENT_POOL_SIZE = 20
+GITLAB_CLIENT_IDLE_TIMEOUT = 300
+
+# Users added to a GitLab group per members API request.
+GITLAB_MEMBERS_BATCH_SIZE = 100
+
+# Roster imports: rows written per bulk_create and concurrent GitLab user lookups.
+ROSTER_IMPORT_CHUNK_SIZE = 500
+GITLAB_LOOKUP_WORKERS = 16
+
+# GitLab username -> id cache (gitlab_classroom/user_cache.py): seconds after
+# which a known user is revalidated in the background, and after which a
+# username without an account is looked up again.
+GITLAB_USER_CACHE_TTL = 7 * 24 * 3600
+GITLAB_USER_CACHE_MISSING_TTL = 3600
+
+# Students returned per page by the add-students autocomplete.
+STUDENT_AUTOCOMPLETE_PAGE_SIZE = 20
+
+# Backend of the list view searches (gitlab_classroom/search.py): "auto" uses
+# FTS5 on SQLite and trigram indexes on PostgreSQL, "like" plain icontains.
+SEARCH_BACKEND = "auto"
+
+# Pagination of the classroom, student and assignment lists (gitlab_classroom/pagination.py):
+# "offset" numbers the pages, "cursor" continues from the last row shown, which
+# stays fast on deep pages. With PAGINATION_EXACT_COUNT = False cursor pages
+# don't count the matching rows.
+LIST_PAGINATION = "offset"
+PAGINATION_EXACT_COUNT = True
+
+# Seconds the index page dashboard of a teacher stays cached (gitlab_classroom/dashboard.py).
+# It's dropped earlier whenever the teacher's classrooms, assignments or students
+# change, but only in the process making the change unless CACHES is shared.
+DASHBOARD_CACHE_TIMEOUT = 300
+
+# GitLab calls slower than this many milliseconds are logged by the
+# "gitlab_classroom.gitlab" logger (gitlab_classroom/instrumentation.py).
+GITLAB_SLOW_CALL_MS = 1000
+
+# Bearer token Prometheus has to send to scrape /metrics; empty leaves it open.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Pacing of GitLab API calls, shared by all processes through files in
+# GITLAB_RATELIMIT_DIR (gitlab_classroom/ratelimit.py): at most GITLAB_RATELIMIT_RATE
+# calls per second per instance in bursts of GITLAB_RATELIMIT_BURST, slower when
+# GitLab's RateLimit-* headers ask for it. Throttled (429) calls are retried up to
+# GITLAB_RATELIMIT_RETRIES times after a jittered backoff starting at
+# GITLAB_RATELIMIT_BACKOFF seconds.
+GITLAB_RATELIMIT_RATE = 10
+GITLAB_RATELIMIT_BURST = 20
+GITLAB_RATELIMIT_DIR = os.path.join(tempfile.gettempdir(), "gitlab_classroom_ratelimit")
+GITLAB_RATELIMIT_RETRIES = 5
+GITLAB_RATELIMIT_BACKOFF = 0.5
+
+# Seconds to wait for GitLab to accept a connection and to answer
+# (gitlab_classroom/breaker.py). After GITLAB_BREAKER_THRESHOLD failed calls in a
+# row an instance is treated as down for GITLAB_BREAKER_RESET_TIMEOUT seconds:
+# calls fail at once and queued jobs wait, at most GITLAB_JOB_MAX_ATTEMPTS times.
+# A job still running GITLAB_JOB_STALE_TIMEOUT seconds after a worker took it is
+# run again, as its worker is assumed to have died; keep it above the longest job.
+GITLAB_CONNECT_TIMEOUT = 5
+GITLAB_READ_TIMEOUT = 30
+GITLAB_BREAKER_THRESHOLD = 5
+GITLAB_BREAKER_RESET_TIMEOUT = 30
+GITLAB_JOB_MAX_ATTEMPTS = 5
+GITLAB_JOB_STALE_TIMEOUT = 3 * 3600
+
+# Collecting submissions (gitlab_classroom/submissions.py): once started for an
+# assignment it is swept every SUBMISSION_SWEEP_INTERVAL seconds until
+# SUBMISSION_SWEEP_GRACE seconds after the deadline. Incremental sweeps revisit
+# projects active since the previous one, less SUBMISSION_ACTIVITY_SLACK seconds
+# because GitLab updates a project's last activity at most once an hour.
+SUBMISSION_SWEEP_INTERVAL = 3600
+SUBMISSION_SWEEP_GRACE = 3600
+SUBMISSION_ACTIVITY_SLACK = 3600
+
+# GitLab webhook events (gitlab_classroom/webhooks.py). GitLab calls back at
+# WEBHOOK_BASE_URL, or at the host the assignment was created on when empty;
+# set it when that isn't reachable from GitLab. The worker applies up to
+# WEBHOOK_BATCH_SIZE events at a time, and keeps processed ones for
+# WEBHOOK_EVENT_RETENTION_DAYS to recognise redelivered events. Events claimed
+# WEBHOOK_STALE_TIMEOUT seconds ago and still not applied are claimed again.
+WEBHOOK_BASE_URL = os.environ.get("WEBHOOK_BASE_URL", "")
+WEBHOOK_BATCH_SIZE = 100
+WEBHOOK_EVENT_RETENTION_DAYS = 7
+WEBHOOK_STALE_TIMEOUT = 600
+
+# Exporting an assignment's submissions as one ZIP (gitlab_classroom/export.py).
+# EXPORT_CONCURRENCY archives are downloaded at a time into EXPORT_CACHE_DIR,
+# keyed by commit, which drops the least recently used ones beyond
+# EXPORT_CACHE_MAX_BYTES.
+EXPORT_CACHE_DIR = os.environ.get("EXPORT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "gitlab_classroom_exports"))
+EXPORT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+EXPORT_CONCURRENCY = 4
+
+# Local bare mirrors of the students' forks (gitlab_classroom/mirrors.py), kept
+# in MIRROR_DIR and fetched by MIRROR_PROCESSES processes at a time, each fetch
+# taking at most MIRROR_FETCH_TIMEOUT seconds. The least recently used mirrors
+# are removed once they take up more than MIRROR_MAX_BYTES.
+MIRROR_DIR = os.environ.get("MIRROR_DIR", os.path.join(tempfile.gettempdir(), "gitlab_classroom_mirrors"))
+MIRROR_MAX_BYTES = 10 * 1024 ** 3
+MIRROR_PROCESSES = 4
+MIRROR_FETCH_TIMEOUT = 300
+
+# Similarity of submissions (gitlab_classroom/similarity.py, winnowing.py).
+# Runs of SIMILARITY_KGRAM tokens are hashed and the smallest hash of every
+# SIMILARITY_WINDOW is kept, by SIMILARITY_PROCESSES processes; files over
+# SIMILARITY_MAX_FILE_BYTES are left out. Fingerprints more than
+# SIMILARITY_MAX_OCCURRENCES submissions have are treated as template code.
+# Pairs scoring at least SIMILARITY_MIN_SCORE are kept, the best
+# SIMILARITY_PAIRS_SHOWN of them are shown on the assignment page.
+SIMILARITY_KGRAM = 12
+SIMILARITY_WINDOW = 8
+SIMILARITY_PROCESSES = 4
+SIMILARITY_MAX_FILE_BYTES = 256 * 1024
+SIMILARITY_MAX_OCCURRENCES = 10
+SIMILARITY_MIN_SCORE = 0.2
+SIMILARITY_PAIRS_SHOWN = 20
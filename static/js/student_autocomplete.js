@@ -0,0 +1,56 @@
+// Fills the add-students <select multiple> from the autocomplete endpoint
+// while the teacher types, instead of rendering every student up front.
+document.addEventListener("DOMContentLoaded", function () {
+    document.querySelectorAll("select[data-autocomplete-url]").forEach(function (select) {
+        var url = select.dataset.autocompleteUrl;
+        var input = document.createElement("input");
+        input.type = "search";
+        input.className = "form-control mb-1";
+        input.placeholder = "search by username, name or student ID";
+        select.parentNode.insertBefore(input, select);
+
+        var more = document.createElement("button");
+        more.type = "button";
+        more.className = "btn btn-link btn-sm";
+        more.textContent = "Load more";
+        more.hidden = true;
+        select.parentNode.insertBefore(more, select.nextSibling);
+
+        var page = 1;
+        var timer = null;
+
+        function load(reset) {
+            if (reset) {
+                page = 1;
+                // keep what was already chosen
+                Array.from(select.options).forEach(function (option) {
+                    if (!option.selected) {
+                        option.remove();
+                    }
+                });
+            }
+            var query = url + "&q=" + encodeURIComponent(input.value) + "&page=" + page;
+            fetch(query, {credentials: "same-origin"})
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    var present = new Set(Array.from(select.options).map(function (o) { return o.value; }));
+                    data.results.forEach(function (student) {
+                        if (!present.has(String(student.id))) {
+                            select.add(new Option(student.text, student.id));
+                        }
+                    });
+                    more.hidden = !data.pagination.more;
+                });
+        }
+
+        input.addEventListener("input", function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () { load(true); }, 250);
+        });
+        more.addEventListener("click", function () {
+            page += 1;
+            load(false);
+        });
+        load(true);
+    });
+});